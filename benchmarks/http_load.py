@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Load test for the RAG HTTP API.
+
+Drives /chat/process, /qa, /documents/upload and /documents/files at a fixed
+concurrency and reports latency percentiles, throughput and, when the server
+sends Server-Timing headers, a per-stage breakdown. Results are written as JSON
+so runs of different commits can be compared.
+
+Run the API against the mock OpenAI server so LLM latency is stubbed:
+
+    python src/api/scripts/mock_openai_server.py --port 8001 --latency-ms 50 &
+    OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=mock python -m uvicorn src.api.app:app &
+    python benchmarks/http_load.py --concurrency 8 --requests 200
+    python benchmarks/http_load.py --compare benchmarks/results/<previous>.json
+"""
+
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import httpx
+
+RESULTS_DIR = Path(__file__).parent / "results"
+SCENARIOS = ["chat", "qa", "upload", "files"]
+
+QUERIES = [
+    "Was sind die Berichtspflichten nach der CSRD für mittelständische Unternehmen?",
+    "How do I calculate Scope 3 emissions for purchased goods?",
+    "Welche Anforderungen stellt die EU-Taxonomie an Herstellungsbetriebe?",
+    "What does ESRS E1 require regarding transition plans?",
+    "Wie berichte ich über Wasserentnahme in der Landwirtschaft?",
+    "Which GHG Protocol guidance applies to agricultural emissions?",
+    "What are science-based targets and how are they validated?",
+    "Welche Angaben verlangt der VSME-Standard zu Energieverbrauch?",
+]
+ONACE_CODES = ["0", "C", "A", "F", "G"]
+UPLOAD_WORDS = (
+    "emissions reporting taxonomy sustainability disclosure energy water waste biodiversity "
+    "governance supply chain climate risk transition plan scope target verification"
+).split()
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Linear-interpolated percentile (q in 0..100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    """Latency summary in milliseconds."""
+    if not values:
+        return {"mean": None, "p50": None, "p95": None, "p99": None, "max": None}
+    return {
+        "mean": round(sum(values) / len(values), 2),
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "max": round(max(values), 2),
+    }
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """Parse `name;dur=12.3, other;dur=4` into {name: ms}."""
+    stages: Dict[str, float] = {}
+    if not header:
+        return stages
+    for entry in header.split(","):
+        parts = [part.strip() for part in entry.split(";")]
+        for part in parts[1:]:
+            if part.startswith("dur="):
+                try:
+                    stages[parts[0]] = stages.get(parts[0], 0.0) + float(part[4:])
+                except ValueError:
+                    pass
+    return stages
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Scenario:
+    """Builds requests for one endpoint and remembers created documents for cleanup."""
+
+    def __init__(self, name: str, rng: random.Random, upload_words: int):
+        self.name = name
+        self.rng = rng
+        self.upload_words = upload_words
+        self.created_documents: List[str] = []
+
+    def request(self) -> Tuple[str, str, Dict[str, Any]]:
+        """Return (method, path, httpx request kwargs)."""
+        query = self.rng.choice(QUERIES)
+        if self.name == "chat":
+            history = []
+            if self.rng.random() < 0.5:
+                history = [
+                    {"role": "user", "content": self.rng.choice(QUERIES)},
+                    {"role": "assistant", "content": "Die CSRD verpflichtet große Unternehmen zur Nachhaltigkeitsberichterstattung."},
+                ]
+            return "POST", "/chat/process", {"json": {
+                "message": query, "history": history, "user_onace_code": self.rng.choice(ONACE_CODES)
+            }}
+        if self.name == "qa":
+            return "POST", "/qa", {"json": {"query": query}}
+        if self.name == "upload":
+            # Unique content per request so nothing is deduplicated or cached
+            text = f"Benchmark document {uuid.uuid4()}\n" + " ".join(
+                self.rng.choice(UPLOAD_WORDS) for _ in range(self.upload_words)
+            )
+            return "POST", "/documents/upload", {"files": {
+                "file": (f"benchmark_{uuid.uuid4().hex[:8]}.txt", text.encode("utf-8"), "text/plain")
+            }}
+        if self.name == "files":
+            return "GET", "/documents/files", {}
+        raise ValueError(f"Unknown scenario: {self.name}")
+
+    def record(self, response: httpx.Response) -> None:
+        if self.name == "upload" and response.status_code == 200:
+            document_id = response.json().get("document_id")
+            if document_id:
+                self.created_documents.append(document_id)
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    scenario: Scenario,
+    requests: int,
+    concurrency: int,
+    warmup: int,
+    headers: Dict[str, str]
+) -> Dict[str, Any]:
+    """Send `requests` requests with `concurrency` workers and collect timings."""
+    latencies: List[float] = []
+    ttfbs: List[float] = []
+    stages: Dict[str, List[float]] = {}
+    statuses: Dict[str, int] = {}
+    errors: List[str] = []
+
+    async def send(measure: bool) -> None:
+        method, path, kwargs = scenario.request()
+        start = time.perf_counter()
+        try:
+            async with client.stream(method, path, headers=headers, **kwargs) as response:
+                ttfb = time.perf_counter() - start
+                await response.aread()
+            elapsed = time.perf_counter() - start
+        except httpx.HTTPError as e:
+            if measure:
+                statuses["error"] = statuses.get("error", 0) + 1
+                if len(errors) < 10:
+                    errors.append(f"{type(e).__name__}: {e}")
+            return
+        scenario.record(response)
+        if not measure:
+            return
+        statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+        if response.status_code < 400:
+            latencies.append(elapsed * 1000)
+            ttfbs.append(ttfb * 1000)
+            for stage, duration in parse_server_timing(response.headers.get("server-timing")).items():
+                stages.setdefault(stage, []).append(duration)
+        elif len(errors) < 10:
+            errors.append(f"{response.status_code}: {response.text[:200]}")
+
+    for _ in range(warmup):
+        await send(measure=False)
+
+    remaining = requests
+
+    async def worker() -> None:
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            await send(measure=True)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "duration_s": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall > 0 else None,
+        "statuses": statuses,
+        "latency_ms": summarize(latencies),
+        "ttfb_ms": summarize(ttfbs),
+        "stages_ms": {stage: summarize(values) for stage, values in sorted(stages.items())},
+        "sample_errors": errors,
+    }
+
+
+async def cleanup(client: httpx.AsyncClient, scenario: Scenario) -> None:
+    """Delete documents uploaded during the run."""
+    for document_id in scenario.created_documents:
+        try:
+            await client.delete(f"/documents/{document_id}")
+        except httpx.HTTPError:
+            pass
+
+
+def print_report(results: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    def delta(current: Optional[float], previous: Optional[float]) -> str:
+        if current is None or previous is None or previous == 0:
+            return ""
+        return f" ({(current - previous) / previous * 100:+.1f}%)"
+
+    for name, result in results["scenarios"].items():
+        previous = (baseline or {}).get("scenarios", {}).get(name, {})
+        latency, prev_latency = result["latency_ms"], previous.get("latency_ms", {})
+        print(f"\n{name}: {result['throughput_rps']} req/s{delta(result['throughput_rps'], previous.get('throughput_rps'))}"
+              f"  statuses={result['statuses']}")
+        for key in ("p50", "p95", "p99"):
+            print(f"  {key}: {latency[key]} ms{delta(latency[key], prev_latency.get(key))}")
+        for stage, summary in result["stages_ms"].items():
+            print(f"  stage {stage}: mean {summary['mean']} ms, p95 {summary['p95']} ms")
+        for error in result["sample_errors"][:3]:
+            print(f"  error: {error}")
+
+
+async def main_async(args: argparse.Namespace) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    headers = {"X-Debug-Timing": "1"} if args.server_timing else {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results: Dict[str, Any] = {
+        "meta": {
+            "label": args.label,
+            "git_commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "base_url": args.base_url,
+            "concurrency": args.concurrency,
+            "requests_per_scenario": args.requests,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "scenarios": {},
+    }
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        for name in args.scenarios:
+            scenario = Scenario(name, rng, args.upload_words)
+            requests = args.upload_requests if name == "upload" and args.upload_requests else args.requests
+            print(f"Running {name}: {requests} requests, concurrency {args.concurrency}")
+            results["scenarios"][name] = await run_scenario(
+                client, scenario, requests, args.concurrency, args.warmup, headers
+            )
+            if not args.keep_uploads:
+                await cleanup(client, scenario)
+    return results
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load test the RAG HTTP API")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="Measured requests per scenario")
+    parser.add_argument("--upload-requests", type=int, default=None, help="Override --requests for uploads")
+    parser.add_argument("--upload-words", type=int, default=2000, help="Words per uploaded document")
+    parser.add_argument("--warmup", type=int, default=3, help="Unmeasured requests per scenario")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--label", default=None, help="Free-form label stored with the results")
+    parser.add_argument("--output", type=Path, default=None, help="Result file (default: benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument("--compare", type=Path, default=None, help="Earlier result file to diff against")
+    parser.add_argument("--keep-uploads", action="store_true", help="Do not delete uploaded benchmark documents")
+    parser.add_argument("--no-server-timing", dest="server_timing", action="store_false",
+                        help="Do not request Server-Timing stage breakdowns")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = asyncio.run(main_async(args))
+
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print_report(results, baseline)
+
+    output = args.output
+    if output is None:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output = RESULTS_DIR / f"http-{stamp}-{results['meta']['git_commit'] or 'nogit'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
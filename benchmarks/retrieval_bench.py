@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Offline retrieval microbenchmark over the embedded corpus.
+
+Replays a fixed, seeded set of query vectors (no network, no API key) against
+the corpus store and alternative index layouts. For each layout it measures:
+- cold (first query) and warm latency
+- QPS at several top_k
+- index memory
+- recall@k against exact search
+
+    python benchmarks/retrieval_bench.py
+    python benchmarks/retrieval_bench.py --layouts exact two_stage hnsw --top-k 3 12 50
+    python benchmarks/retrieval_bench.py --save-queries queries.npz   # freeze the query set
+    python benchmarks/retrieval_bench.py --queries queries.npz --compare benchmarks/results/<previous>.json
+
+Query vectors are corpus chunks plus Gaussian noise, and their query text is the
+opening words of the chunk (used by the BM25 half of hybrid search).
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+import faiss
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from api.core.vector_store import CorpusIndex, load_corpus_index, TWO_STAGE_SEARCH  # noqa: E402
+
+RESULTS_DIR = Path(__file__).parent / "results"
+DEFAULT_EMBEDDINGS_DIR = Path(__file__).resolve().parent.parent / "src" / "api" / "data" / "embeddings"
+
+# Search function: (query vector of shape (1, d), top_k, query text) -> rows
+SearchFn = Callable[[np.ndarray, int, str], List[int]]
+
+
+@dataclass
+class Layout:
+    """A search path under test."""
+    search: SearchFn
+    build_seconds: float
+    index_bytes: int
+    # Row bitmap the layout restricts to; recall is measured against exact search with the same bitmap
+    bitmap: Optional[np.ndarray] = None
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process (Linux), 0 if unavailable."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def serialized_bytes(index: faiss.Index) -> int:
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def all_vectors(corpus: CorpusIndex) -> np.ndarray:
+    return corpus.full_index.reconstruct_n(0, corpus.size)
+
+
+def corpus_bytes(corpus: CorpusIndex) -> int:
+    """Memory of the corpus store's vector indexes and BM25 postings."""
+    lexical = sum(rows.nbytes + tfs.nbytes for rows, tfs in corpus.lexical_index.postings.values())
+    return serialized_bytes(corpus.full_index) + serialized_bytes(corpus.coarse_index) + lexical
+
+
+def build_exact(corpus: CorpusIndex, args: argparse.Namespace) -> Layout:
+    def search(qv, k, _):
+        return [row for row, _ in corpus.search(qv, k, two_stage=False)]
+    return Layout(search, 0.0, serialized_bytes(corpus.full_index))
+
+
+def build_two_stage(corpus: CorpusIndex, args: argparse.Namespace) -> Layout:
+    def search(qv, k, _):
+        return [row for row, _ in corpus.search(qv, k, two_stage=True)]
+    return Layout(search, 0.0, serialized_bytes(corpus.full_index) + serialized_bytes(corpus.coarse_index))
+
+
+def build_hybrid(corpus: CorpusIndex, args: argparse.Namespace) -> Layout:
+    """The default path of search_all_documents (BM25 + vectors fused with RRF)."""
+    def search(qv, k, text):
+        return [row for row, _, _ in corpus.hybrid_search(text, qv, k, None, TWO_STAGE_SEARCH)]
+    return Layout(search, 0.0, corpus_bytes(corpus))
+
+
+def build_filtered(corpus: CorpusIndex, args: argparse.Namespace) -> Layout:
+    """Two-stage search restricted to one ÖNACE section's bitmap."""
+    bitmap = corpus.filter_bitmap(args.onace_code, None)
+
+    def search(qv, k, _):
+        return [row for row, _ in corpus.search(qv, k, bitmap, two_stage=True)]
+    return Layout(search, 0.0, serialized_bytes(corpus.full_index) + serialized_bytes(corpus.coarse_index), bitmap)
+
+
+def build_per_document(corpus: CorpusIndex, args: argparse.Namespace) -> Layout:
+    """The former layout: one flat index per document, searched one after another and merged."""
+    start = time.perf_counter()
+    vectors = all_vectors(corpus)
+    indexes: List[Tuple[int, faiss.Index]] = []
+    for document in corpus.documents.values():
+        first, last = document["rows"]
+        index = faiss.IndexFlatL2(vectors.shape[1])
+        index.add(vectors[first:last])
+        indexes.append((first, index))
+    build_seconds = time.perf_counter() - start
+
+    def search(qv, k, _):
+        matches = []
+        for first, index in indexes:
+            distances, rows = index.search(qv, min(k, index.ntotal))
+            matches.extend((float(d), first + int(r)) for d, r in zip(distances[0], rows[0]) if r >= 0)
+        return [row for _, row in sorted(matches)[:k]]
+    return Layout(search, build_seconds, sum(serialized_bytes(index) for _, index in indexes))
+
+
+def build_hnsw(corpus: CorpusIndex, args: argparse.Namespace) -> Layout:
+    start = time.perf_counter()
+    index = faiss.IndexHNSWFlat(corpus.full_index.d, args.hnsw_m)
+    index.hnsw.efConstruction = 80
+    index.add(all_vectors(corpus))
+    index.hnsw.efSearch = args.hnsw_ef_search
+    build_seconds = time.perf_counter() - start
+
+    def search(qv, k, _):
+        _, rows = index.search(qv, k)
+        return [int(row) for row in rows[0] if row >= 0]
+    return Layout(search, build_seconds, serialized_bytes(index))
+
+
+def build_ivf(corpus: CorpusIndex, args: argparse.Namespace) -> Layout:
+    start = time.perf_counter()
+    vectors = all_vectors(corpus)
+    nlist = max(1, int(np.sqrt(len(vectors))))
+    quantizer = faiss.IndexFlatL2(vectors.shape[1])
+    index = faiss.IndexIVFFlat(quantizer, vectors.shape[1], nlist)
+    index.train(vectors)
+    index.add(vectors)
+    index.nprobe = args.ivf_nprobe
+    build_seconds = time.perf_counter() - start
+
+    def search(qv, k, _):
+        _, rows = index.search(qv, k)
+        return [int(row) for row in rows[0] if row >= 0]
+    return Layout(search, build_seconds, serialized_bytes(index))
+
+
+LAYOUTS: Dict[str, Callable[[CorpusIndex, argparse.Namespace], Layout]] = {
+    "exact": build_exact,
+    "two_stage": build_two_stage,
+    "hybrid": build_hybrid,
+    "filtered": build_filtered,
+    "per_document": build_per_document,
+    "hnsw": build_hnsw,
+    "ivf": build_ivf,
+}
+
+
+def make_queries(corpus: CorpusIndex, count: int, noise: float, seed: int) -> Tuple[np.ndarray, List[str]]:
+    """Perturbed chunk vectors and the opening words of those chunks as query text."""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(corpus.size, size=min(count, corpus.size), replace=False)
+    vectors = corpus.full_index.reconstruct_batch(rows.astype(np.int64))
+    vectors = vectors + rng.normal(0, noise, size=vectors.shape).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    texts = [" ".join(corpus.chunks[row]["text"].split()[:8]) for row in rows]
+    return vectors.astype(np.float32), texts
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    ms = np.array(values) * 1000
+    return {
+        "mean": round(float(ms.mean()), 4),
+        "p50": round(float(np.percentile(ms, 50)), 4),
+        "p95": round(float(np.percentile(ms, 95)), 4),
+        "p99": round(float(np.percentile(ms, 99)), 4),
+    }
+
+
+def exact_results(corpus: CorpusIndex, vectors: np.ndarray, k: int, bitmap: Optional[np.ndarray]) -> List[List[int]]:
+    return [[row for row, _ in corpus.search(vectors[i:i + 1], k, bitmap, two_stage=False)] for i in range(len(vectors))]
+
+
+def benchmark_layout(
+    corpus: CorpusIndex,
+    layout: Layout,
+    vectors: np.ndarray,
+    texts: List[str],
+    top_ks: List[int],
+    warmup: int,
+    ground_truth: Dict[Tuple[int, int], List[List[int]]]
+) -> Dict:
+    queries = [(vectors[i:i + 1], texts[i]) for i in range(len(vectors))]
+    default_k = top_ks[0]
+
+    # Cold: the very first query after building/loading
+    start = time.perf_counter()
+    layout.search(queries[0][0], default_k, queries[0][1])
+    cold_ms = (time.perf_counter() - start) * 1000
+
+    for qv, text in queries[:warmup]:
+        layout.search(qv, default_k, text)
+
+    per_k = {}
+    for k in top_ks:
+        latencies = []
+        hits = 0.0
+        truth = ground_truth[(id(layout.bitmap), k)]
+        started = time.perf_counter()
+        for i, (qv, text) in enumerate(queries):
+            t = time.perf_counter()
+            rows = layout.search(qv, k, text)
+            latencies.append(time.perf_counter() - t)
+            if truth[i]:
+                hits += len(set(rows) & set(truth[i])) / len(truth[i])
+        elapsed = time.perf_counter() - started
+        per_k[str(k)] = {
+            "qps": round(len(queries) / elapsed, 1),
+            "latency_ms": percentiles(latencies),
+            "recall": round(hits / len(queries), 4),
+        }
+
+    return {
+        "build_seconds": round(layout.build_seconds, 3),
+        "index_bytes": layout.index_bytes,
+        "cold_query_ms": round(cold_ms, 3),
+        "top_k": per_k,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results: Dict, baseline: Optional[Dict]) -> None:
+    def delta(current: float, previous: Optional[float]) -> str:
+        if previous in (None, 0):
+            return ""
+        return f" ({(current - previous) / previous * 100:+.1f}%)"
+
+    load = results["load"]
+    print(f"\nCorpus: {load['rows']} rows x {load['dimensions']} dims, {load['documents']} documents")
+    print(f"Cold load: {load['seconds']} s, RSS +{load['rss_delta_bytes'] / 2**20:.1f} MiB")
+    for name, layout in results["layouts"].items():
+        previous = (baseline or {}).get("layouts", {}).get(name, {})
+        print(f"\n{name}: index {layout['index_bytes'] / 2**20:.1f} MiB, build {layout['build_seconds']} s, "
+              f"cold query {layout['cold_query_ms']} ms")
+        for k, stats in layout["top_k"].items():
+            prev = previous.get("top_k", {}).get(k, {})
+            print(f"  top_k={k:>3}: {stats['qps']:>9} qps{delta(stats['qps'], prev.get('qps'))}  "
+                  f"p50 {stats['latency_ms']['p50']} ms  p99 {stats['latency_ms']['p99']} ms  "
+                  f"recall {stats['recall']}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline retrieval microbenchmark")
+    parser.add_argument("--embeddings-dir", type=Path, default=Path(os.getenv("EMBEDDINGS_DIR", DEFAULT_EMBEDDINGS_DIR)))
+    parser.add_argument("--layouts", nargs="+", choices=list(LAYOUTS), default=["exact", "two_stage", "hybrid", "filtered", "per_document"])
+    parser.add_argument("--top-k", type=int, nargs="+", default=[3, 12, 50], help="First value is used for cold/warm-up queries")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.02, help="Per-dimension noise added to sampled chunk vectors")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--queries", type=Path, default=None, help="Load a frozen query set (.npz)")
+    parser.add_argument("--save-queries", type=Path, default=None, help="Write the query set used (.npz)")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=1, help="FAISS OpenMP threads")
+    parser.add_argument("--onace-code", default="C", help="ÖNACE section of the filtered layout")
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--hnsw-ef-search", type=int, default=64)
+    parser.add_argument("--ivf-nprobe", type=int, default=8)
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument("--compare", type=Path, default=None, help="Earlier result file to diff against")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    faiss.omp_set_num_threads(args.threads)
+
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    corpus = load_corpus_index(args.embeddings_dir)
+    load_seconds = time.perf_counter() - start
+    if corpus.size == 0:
+        sys.exit(f"No embedded documents found in {args.embeddings_dir}")
+
+    if args.queries:
+        frozen = np.load(args.queries, allow_pickle=False)
+        vectors, texts = frozen["vectors"].astype(np.float32), [str(t) for t in frozen["texts"]]
+    else:
+        vectors, texts = make_queries(corpus, args.num_queries, args.noise, args.seed)
+    if args.save_queries:
+        np.savez(args.save_queries, vectors=vectors, texts=np.array(texts))
+
+    results = {
+        "meta": {
+            "git_commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "queries": len(vectors),
+            "seed": args.seed,
+            "noise": args.noise,
+            "threads": args.threads,
+            "python": platform.python_version(),
+            "faiss": faiss.__version__,
+            "platform": platform.platform(),
+        },
+        "load": {
+            "seconds": round(load_seconds, 3),
+            "rss_delta_bytes": rss_bytes() - rss_before,
+            "rows": corpus.size,
+            "dimensions": corpus.full_index.d,
+            "documents": len(corpus.documents),
+            "corpus_bytes": corpus_bytes(corpus),
+        },
+        "layouts": {},
+    }
+
+    ground_truth: Dict[Tuple[int, int], List[List[int]]] = {}
+    for name in args.layouts:
+        print(f"Benchmarking {name}...")
+        rss = rss_bytes()
+        layout = LAYOUTS[name](corpus, args)
+        for k in args.top_k:
+            key = (id(layout.bitmap), k)
+            if key not in ground_truth:
+                ground_truth[key] = exact_results(corpus, vectors, k, layout.bitmap)
+        result = benchmark_layout(corpus, layout, vectors, texts, args.top_k, args.warmup, ground_truth)
+        result["rss_delta_bytes"] = rss_bytes() - rss
+        results["layouts"][name] = result
+
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print_report(results, baseline)
+
+    output = args.output
+    if output is None:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output = RESULTS_DIR / f"retrieval-{stamp}-{results['meta']['git_commit'] or 'nogit'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
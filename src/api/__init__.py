@@ -1,7 +1,8 @@
 """RAG API package."""
-from .app import start
 
 
 def main() -> None:
     """Run the RAG API application."""
+    # Imported lazily so tools importing api.core do not load the whole application
+    from .app import start
     start()
@@ -11,12 +11,22 @@ if not os.getenv("OPENAI_API_KEY"):
     print("Please set OPENAI_API_KEY in Railway environment variables")
     # Don't raise error during startup, let the app start and show error in health check
 
-import uvicorn
-from fastapi import FastAPI, HTTPException
+import time
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
 from .routers import documents, qa, chat, onace
+from .core.reconciler import reconciler, RECONCILE_ENABLED
+from .core.openai_client import close_openai_client
+from .core.session_store import session_store
+from .core.warmup import warmup, WARMUP_ENABLED
+from .core.timing import configure_tracing, start_request_timing, finish_request_timing, server_timing_header
+from .core.metrics import HTTP_REQUESTS, HTTP_DURATION, CONTENT_TYPE_LATEST, render_metrics, mark_worker_stopped
+
+# Server-Timing response header: "off", "header" (only for requests sending X-Debug-Timing: 1) or "always"
+SERVER_TIMING = os.getenv("SERVER_TIMING", "header").lower()
 
 
 @asynccontextmanager
@@ -24,8 +34,19 @@ async def lifespan(app: FastAPI):
     # Startup: Create necessary directories
     os.makedirs(os.getenv("DOCUMENTS_DIR", "./data/documents"), exist_ok=True)
     os.makedirs(os.getenv("EMBEDDINGS_DIR", "./data/embeddings"), exist_ok=True)
+    configure_tracing()
+    # Repair missing embeddings in the background instead of inside requests
+    if RECONCILE_ENABLED:
+        reconciler.start()
+    # Load the tokenizer, OpenAI SDK and corpus index while /health already answers
+    if WARMUP_ENABLED:
+        warmup.start()
     yield
-    # Shutdown: Nothing to clean up for now
+    # Shutdown: Stop the reconciler; unfinished documents stay pending
+    await warmup.stop()
+    await reconciler.stop()
+    await close_openai_client()
+    mark_worker_stopped()
 
 
 # Create FastAPI app
@@ -45,6 +66,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    """Record request metrics and report the request's stage spans as Server-Timing."""
+    token = start_request_timing()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        spans = finish_request_timing(token)
+        # The matched route template (e.g. /documents/{document_id}) keeps the label set bounded
+        route = request.scope.get("route")
+        route_path = route.path if route is not None else "unmatched"
+        HTTP_REQUESTS.labels(method=request.method, route=route_path, status=str(status)).inc()
+        HTTP_DURATION.labels(method=request.method, route=route_path).observe(time.perf_counter() - start)
+    if SERVER_TIMING == "always" or (SERVER_TIMING == "header" and request.headers.get("x-debug-timing") == "1"):
+        spans.append(("total", time.perf_counter() - start))
+        response.headers["Server-Timing"] = server_timing_header(spans)
+    return response
+
+
 # Include routers
 app.include_router(documents.router)
 app.include_router(qa.router)
@@ -61,12 +105,34 @@ async def health_check():
         "version": "0.1.0",
         "openai_key": openai_key_status,
         "documents_dir": os.getenv("DOCUMENTS_DIR", "default"),
-        "embeddings_dir": os.getenv("EMBEDDINGS_DIR", "default")
+        "embeddings_dir": os.getenv("EMBEDDINGS_DIR", "default"),
+        "reconciliation": await reconciler.status(),
+        "sessions": session_store.stats(),
+        "warmup": warmup.status()
     }
 
 
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness probe: 503 until the warm-up has loaded the index and opened
+    the OpenAI connections, so the load balancer only routes warm workers.
+    """
+    return JSONResponse(
+        {"ready": warmup.ready, "warmup": warmup.status()},
+        status_code=200 if warmup.ready else 503
+    )
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics, aggregated across workers when PROMETHEUS_MULTIPROC_DIR is set."""
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
 def start():
     """Run the API using uvicorn."""
+    import uvicorn
     uvicorn.run(
         "api.app:app",
         host="0.0.0.0",
@@ -0,0 +1,92 @@
+"""Semantic cache for generated answers keyed by query-embedding similarity."""
+import os
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from .metrics import CACHE_LOOKUPS
+
+# Whether generate_answer consults the cache
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+# Maximum number of cached answers across all scopes
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+# Minimum cosine similarity between query embeddings to reuse an answer
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+
+def cache_scope(**params: Any) -> str:
+    """
+    Build the scope an answer is valid for.
+
+    Everything that changes the answer besides the query itself (ÖNACE code,
+    model, temperature, corpus version, filters, history, meta information)
+    goes into the scope; only queries within the same scope are compared.
+    """
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class SemanticAnswerCache:
+    """LRU cache returning a stored answer for paraphrased queries."""
+
+    def __init__(self, max_size: int = ANSWER_CACHE_SIZE, threshold: float = ANSWER_CACHE_THRESHOLD):
+        self.max_size = max_size
+        self.threshold = threshold
+        self._entries: "OrderedDict[int, Tuple[str, np.ndarray, Dict[str, Any]]]" = OrderedDict()
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, scope: str, embedding: List[float]) -> Optional[Dict[str, Any]]:
+        """Return the cached response of the most similar query in scope, if similar enough."""
+        candidates = [(entry_id, vector) for entry_id, (entry_scope, vector, _) in self._entries.items() if entry_scope == scope]
+        if not candidates:
+            self.misses += 1
+            CACHE_LOOKUPS.labels(cache="answer", result="miss").inc()
+            return None
+
+        query_vector = self._normalize(embedding)
+        similarities = np.stack([vector for _, vector in candidates]) @ query_vector
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            self.misses += 1
+            CACHE_LOOKUPS.labels(cache="answer", result="miss").inc()
+            return None
+
+        entry_id = candidates[best][0]
+        self._entries.move_to_end(entry_id)
+        self.hits += 1
+        CACHE_LOOKUPS.labels(cache="answer", result="hit").inc()
+        return self._entries[entry_id][2]
+
+    def put(self, scope: str, embedding: List[float], response: Dict[str, Any]) -> None:
+        """Store a response, evicting the least recently used entries beyond the size cap."""
+        self._entries[self._next_id] = (scope, self._normalize(embedding), response)
+        self._next_id += 1
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop all entries, e.g. after documents were uploaded or deleted."""
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Get cache size and hit ratio."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+
+# Global instance
+answer_cache = SemanticAnswerCache()
@@ -0,0 +1,170 @@
+"""In-process BM25 inverted index over chunk texts."""
+import re
+import json
+import math
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+# BM25 parameters (Robertson/Zaragoza defaults)
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Constant of reciprocal rank fusion, dampens the influence of top ranks
+RRF_K = 60
+# Suffix of the per-document term statistics written next to the FAISS index
+BM25_SUFFIX = ".bm25"
+# Files of a corpus-wide index in a snapshot directory
+BM25_TERMS_FILE = "bm25_terms.json"
+BM25_ARRAY_FILES = ("bm25_rows.npy", "bm25_tfs.npy", "bm25_lengths.npy")
+
+# Keeps identifiers such as "29b", "E1", "2022/2464" or CAS numbers "7732-18-5" intact
+TOKEN_PATTERN = re.compile(r"\w+(?:[./-]\w+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase lexical tokens."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def build_document_postings(texts: List[str]) -> Dict:
+    """
+    Build the persisted term statistics for one document.
+
+    Args:
+        texts: Chunk texts in embedding index order
+
+    Returns:
+        Dict with per-chunk token counts and term -> [[position, tf], ...] postings
+    """
+    postings: Dict[str, List[List[int]]] = defaultdict(list)
+    lengths = []
+    for position, text in enumerate(texts):
+        tokens = tokenize(text)
+        lengths.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            postings[term].append([position, tf])
+    return {"lengths": lengths, "postings": dict(postings)}
+
+
+class BM25Builder:
+    """Accumulates postings of many documents into a corpus-wide BM25Index."""
+
+    def __init__(self):
+        self.rows_by_term: Dict[str, List[int]] = defaultdict(list)
+        self.tfs_by_term: Dict[str, List[int]] = defaultdict(list)
+        self.lengths: Dict[int, int] = {}
+
+    def add_postings(self, start: int, document: Dict) -> None:
+        """Add persisted postings (see build_document_postings) of a document starting at row `start`."""
+        for position, length in enumerate(document.get("lengths", [])):
+            self.lengths[start + position] = length
+        for term, entries in document.get("postings", {}).items():
+            rows = self.rows_by_term[term]
+            tfs = self.tfs_by_term[term]
+            for position, tf in entries:
+                rows.append(start + position)
+                tfs.append(tf)
+
+    def add_texts(self, start: int, texts: List[str]) -> None:
+        """Tokenize chunk texts of a document without persisted postings."""
+        for position, text in enumerate(texts):
+            tokens = tokenize(text)
+            self.lengths[start + position] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                self.rows_by_term[term].append(start + position)
+                self.tfs_by_term[term].append(tf)
+
+    def build(self, size: int) -> "BM25Index":
+        """Convert the accumulated lists into arrays, once per term."""
+        lengths = np.zeros(size, dtype=np.float32)
+        for row, length in self.lengths.items():
+            lengths[row] = length
+        postings = {
+            term: (np.array(rows, dtype=np.int64), np.array(self.tfs_by_term[term], dtype=np.float32))
+            for term, rows in self.rows_by_term.items()
+        }
+        average_length = float(lengths.mean()) if size else 0.0
+        return BM25Index(postings=postings, lengths=lengths, average_length=average_length or 1.0)
+
+
+@dataclass
+class BM25Index:
+    """Corpus-wide inverted index with rows aligned to the vector store."""
+    postings: Dict[str, Tuple[np.ndarray, np.ndarray]]
+    lengths: np.ndarray
+    average_length: float
+
+    @property
+    def size(self) -> int:
+        return len(self.lengths)
+
+    def save(self, directory: Path) -> None:
+        """Write the postings as flat arrays plus a term -> (offset, count) table."""
+        terms = {}
+        offset = 0
+        for term, (rows, _) in self.postings.items():
+            terms[term] = [offset, len(rows)]
+            offset += len(rows)
+        rows = [rows for rows, _ in self.postings.values()]
+        tfs = [tfs for _, tfs in self.postings.values()]
+        rows_file, tfs_file, lengths_file = BM25_ARRAY_FILES
+        np.save(directory / rows_file, np.concatenate(rows) if rows else np.empty(0, dtype=np.int64))
+        np.save(directory / tfs_file, np.concatenate(tfs) if tfs else np.empty(0, dtype=np.float32))
+        np.save(directory / lengths_file, np.asarray(self.lengths, dtype=np.float32))
+        with open(directory / BM25_TERMS_FILE, "w") as f:
+            json.dump({"terms": terms, "average_length": self.average_length}, f)
+
+    @classmethod
+    def load(cls, directory: Path) -> "BM25Index":
+        """Open an index written by `save`; the arrays are memory-mapped, not copied."""
+        with open(directory / BM25_TERMS_FILE, "r") as f:
+            data = json.load(f)
+        rows, tfs, lengths = (np.load(directory / name, mmap_mode="r") for name in BM25_ARRAY_FILES)
+        postings = {
+            term: (rows[offset:offset + count], tfs[offset:offset + count])
+            for term, (offset, count) in data["terms"].items()
+        }
+        return cls(postings=postings, lengths=lengths, average_length=data["average_length"])
+
+    def search(self, query: str, top_k: int, bitmap: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Score rows against a query with BM25.
+
+        Args:
+            query: Raw query text
+            top_k: Number of results to return
+            bitmap: Optional packed row bitmap restricting the search
+
+        Returns:
+            Up to top_k (row, score) pairs sorted by descending score
+        """
+        terms = [term for term in set(tokenize(query)) if term in self.postings]
+        if not terms or self.size == 0:
+            return []
+
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in terms:
+            rows, tfs = self.postings[term]
+            idf = math.log(1 + (self.size - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[rows] / self.average_length)
+            scores[rows] += idf * tfs * (BM25_K1 + 1) / (tfs + norm)
+
+        if bitmap is not None:
+            scores[~np.unpackbits(bitmap, count=self.size, bitorder="little").astype(bool)] = 0
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k)[:top_k]]
+        order = candidates[np.argsort(-scores[candidates])]
+        return [(int(row), float(scores[row])) for row in order]
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = RRF_K) -> List[Tuple[int, float]]:
+    """Fuse several ranked row lists into one, sorted by descending fused score."""
+    fused: Dict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, row in enumerate(ranking):
+            fused[row] += 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
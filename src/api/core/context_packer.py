@@ -0,0 +1,184 @@
+"""Fits conversation history and retrieved chunks into the prompt token budget."""
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from .openai_scheduler import count_tokens, get_token_encoding
+
+# Maximum prompt tokens of an answer completion (system prompt, history, context and question)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "8000"))
+# Maximum tokens of conversation history within that budget
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+# Per-message overhead of the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+# Minimum length of text shared by two chunks of a document to be cut from the later one
+MIN_OVERLAP_CHARS = 64
+
+# Turn boundaries in histories formatted as "User: ..." / "Assistant: ..." lines
+_TURN_START = re.compile(r"^(?=(?:User|Assistant): )", re.MULTILINE)
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut a text to at most `max_tokens` tokens."""
+    encoding = get_token_encoding()
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max(max_tokens, 0)])
+
+
+def split_turns(conversation_history: str) -> Tuple[Optional[str], List[str]]:
+    """
+    Split a formatted history into turns.
+
+    Returns:
+        Text before the first turn (e.g. a summary of older turns) or None, and the turns
+    """
+    segments = [segment.strip() for segment in _TURN_START.split(conversation_history) if segment.strip()]
+    if segments and not _TURN_START.match(segments[0]):
+        return segments[0], segments[1:]
+    return None, segments
+
+
+def strip_overlap(previous: str, text: str) -> Optional[str]:
+    """
+    Remove text already contained in an earlier chunk of the same document.
+
+    Consecutive chunks share CHUNK_OVERLAP tokens, so a chunk usually starts with
+    the end of its predecessor.
+
+    Returns:
+        The remaining text, or None when the chunk adds nothing new
+    """
+    if text in previous:
+        return None
+    head = text[:MIN_OVERLAP_CHARS]
+    if len(head) < MIN_OVERLAP_CHARS:
+        return text
+    position = previous.find(head)
+    while position != -1:
+        overlap = len(previous) - position
+        if text.startswith(previous[position:]):
+            return text[overlap:].lstrip()
+        position = previous.find(head, position + 1)
+    return text
+
+
+@dataclass
+class PackedPrompt:
+    """Result of packing: the prompt parts that fit and how the budget was spent."""
+    conversation_history: Optional[str]
+    chunks: List[Dict]
+    context: str
+    usage: Dict[str, Any] = field(default_factory=dict)
+
+
+def format_chunks(chunks: List[Dict], texts: List[str]) -> str:
+    """Format packed chunks as "[Chunk n - Source: filename]" blocks, using their deduplicated text."""
+    formatted_chunks = []
+    for i, (chunk, text) in enumerate(zip(chunks, texts)):
+        source = chunk.get("metadata", {}).get("filename", "Unknown source")
+        formatted_chunks.append(f"[Chunk {i+1} - Source: {source}]\n{text}\n")
+    return "\n".join(formatted_chunks)
+
+
+def pack_prompt(
+    system_prompt: str,
+    query: str,
+    chunks: List[Dict],
+    conversation_history: Optional[str] = None,
+    budget: int = PROMPT_TOKEN_BUDGET,
+    history_budget: int = HISTORY_TOKEN_BUDGET
+) -> PackedPrompt:
+    """
+    Fit history and chunks into the prompt token budget.
+
+    Chunks are taken in the given (rank) order with text repeated from earlier
+    chunks removed. History is trimmed oldest turn first, first to its own
+    budget, then as far as needed to fit the chunks; only then are the
+    lowest-ranked chunks dropped. The best chunk is always kept, truncated if it
+    does not fit on its own.
+
+    Args:
+        system_prompt: Instructions including meta information, without history
+        query: The user's question
+        chunks: Retrieved chunks, best first
+        conversation_history: History formatted as "User: ..." / "Assistant: ..." lines
+        budget: Maximum prompt tokens
+        history_budget: Maximum history tokens
+
+    Returns:
+        PackedPrompt with the history and context to send and the token usage
+    """
+    # System prompt, context message and question are separate messages
+    fixed_tokens = count_tokens(system_prompt) + count_tokens(query) + 3 * MESSAGE_OVERHEAD_TOKENS + count_tokens("Context:\n")
+
+    # Deduplicate chunk text against the chunks already packed from the same document
+    texts: List[str] = []
+    kept: List[Dict] = []
+    redundant_chunks = 0
+    for chunk in chunks:
+        text = chunk.get("text", "")
+        for previous_chunk, previous_text in zip(kept, texts):
+            if previous_chunk.get("document_id") != chunk.get("document_id"):
+                continue
+            text = strip_overlap(previous_text, text)
+            if text is None:
+                break
+        if not text:
+            redundant_chunks += 1
+            continue
+        kept.append(chunk)
+        texts.append(text)
+    chunk_tokens = [count_tokens(format_chunks([chunk], [text])) for chunk, text in zip(kept, texts)]
+
+    # History turns, oldest first; a leading summary is trimmed last
+    summary, turns = split_turns(conversation_history) if conversation_history else (None, [])
+    if summary:
+        turns.append(summary)
+    turn_tokens = [count_tokens(turn) + 1 for turn in turns]
+    history_overhead = count_tokens("\n\nPrevious conversation:\n\n\nPlease consider the previous conversation when answering the current question.")
+    dropped_turns = 0
+
+    def history_tokens() -> int:
+        return sum(turn_tokens[dropped_turns:]) + history_overhead if dropped_turns < len(turns) else 0
+
+    while dropped_turns < len(turns) and history_tokens() > history_budget:
+        dropped_turns += 1
+    while dropped_turns < len(turns) and fixed_tokens + history_tokens() + sum(chunk_tokens) > budget:
+        dropped_turns += 1
+
+    # Drop the lowest-ranked chunks, then truncate the best one if still needed
+    dropped_chunks = 0
+    while len(kept) > 1 and fixed_tokens + history_tokens() + sum(chunk_tokens) > budget:
+        kept.pop()
+        texts.pop()
+        chunk_tokens.pop()
+        dropped_chunks += 1
+    truncated = False
+    if kept and fixed_tokens + history_tokens() + chunk_tokens[0] > budget:
+        texts[0] = truncate_tokens(texts[0], budget - fixed_tokens - history_tokens() - 20)
+        chunk_tokens[0] = count_tokens(format_chunks(kept[:1], texts[:1]))
+        truncated = True
+
+    remaining = turns[dropped_turns:]
+    if summary and remaining:
+        # The summary was appended for trimming only; it precedes the turns in the prompt
+        remaining = [remaining[-1]] + remaining[:-1]
+    history = "\n".join(remaining) or None
+    return PackedPrompt(
+        conversation_history=history,
+        chunks=kept,
+        context=format_chunks(kept, texts),
+        usage={
+            "budget": budget,
+            "prompt_tokens_estimated": fixed_tokens + history_tokens() + sum(chunk_tokens),
+            "instruction_tokens": fixed_tokens,
+            "history_tokens": history_tokens(),
+            "context_tokens": sum(chunk_tokens),
+            "history_turns_dropped": dropped_turns,
+            "chunks_redundant": redundant_chunks,
+            "chunks_dropped": dropped_chunks,
+            "chunk_truncated": truncated
+        }
+    )
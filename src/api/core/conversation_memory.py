@@ -0,0 +1,163 @@
+"""Conversation memory: recent turns verbatim plus a rolling summary of older turns."""
+import os
+import hashlib
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set
+from .openai_scheduler import chat_completion, PRIORITY_BULK
+
+# Number of most recent user/assistant turns sent verbatim
+MEMORY_RECENT_TURNS = int(os.getenv("MEMORY_RECENT_TURNS", "3"))
+# Model and length of the rolling summary
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4.1-mini-2025-04-14")
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "400"))
+
+SUMMARY_PROMPT = (
+    "You maintain the memory of a conversation between a user and an assistant for "
+    "sustainability reporting and regulations. Update the summary with the new messages. "
+    "Keep the user's company details, industry, the regulations, standards, articles and "
+    "figures discussed, decisions and open questions. Drop pleasantries. Write at most "
+    "200 words in the language of the conversation."
+)
+
+
+def format_messages(messages: List[Dict[str, str]]) -> str:
+    """Format user and assistant messages as "User: ..." / "Assistant: ..." lines."""
+    formatted_history = ""
+    for msg in messages:
+        if msg["role"] in ["user", "assistant"]:
+            role = "Assistant" if msg["role"] == "assistant" else "User"
+            formatted_history += f"{role}: {msg['content']}\n"
+    return formatted_history.strip()
+
+
+def messages_digest(messages: List[Dict[str, str]]) -> str:
+    """Fingerprint of a message prefix, to notice when a client rewrites earlier history."""
+    digest = hashlib.sha256()
+    for msg in messages:
+        digest.update(f"{msg['role']}\x00{msg['content']}\x01".encode("utf-8"))
+    return digest.hexdigest()
+
+
+@dataclass
+class ConversationSummary:
+    """Summary of the first `covered` messages of a conversation."""
+    text: str
+    covered: int
+    digest: str
+
+
+class ConversationMemory:
+    """Builds compact conversation histories and rolls older turns into a summary."""
+
+    def __init__(self, recent_turns: int = MEMORY_RECENT_TURNS):
+        self.recent_turns = recent_turns
+        self._updating: Set[str] = set()
+        self.summaries_created = 0
+
+    def _split(self, messages: List[Dict[str, str]]) -> int:
+        """Index of the first message that is sent verbatim."""
+        return max(len(messages) - 2 * self.recent_turns, 0)
+
+    @staticmethod
+    def summary_applies(summary: Optional[ConversationSummary], messages: List[Dict[str, str]]) -> bool:
+        """Whether the summary was made from the beginning of these messages."""
+        return (
+            summary is not None
+            and summary.covered <= len(messages)
+            and summary.digest == messages_digest(messages[:summary.covered])
+        )
+
+    def build_history(self, messages: List[Dict[str, str]], summary: Optional[ConversationSummary] = None) -> Optional[str]:
+        """
+        Format the history for the prompt.
+
+        Older turns are replaced by the summary as far as it reaches; turns the
+        summary does not cover yet are kept verbatim until it catches up.
+
+        Args:
+            messages: The conversation so far, oldest first
+            summary: Summary of its first messages, e.g. from the session
+
+        Returns:
+            The formatted history, or None for an empty conversation
+        """
+        messages = [msg for msg in messages if msg["role"] in ["user", "assistant"]]
+        if not messages:
+            return None
+        if not self.summary_applies(summary, messages) or summary.covered > self._split(messages):
+            return format_messages(messages)
+        recent = format_messages(messages[summary.covered:])
+        # One line, so the summary is never mistaken for "User:" / "Assistant:" turns
+        summary_text = " ".join(summary.text.split())
+        return f"Summary of the earlier conversation: {summary_text}\n{recent}".strip()
+
+    async def update(
+        self,
+        conversation_id: str,
+        messages: List[Dict[str, str]],
+        previous: Optional[ConversationSummary] = None
+    ) -> Optional[ConversationSummary]:
+        """
+        Fold turns that fell out of the verbatim window into the summary.
+
+        Meant to run after the response was sent (e.g. as a background task);
+        concurrent updates of the same conversation are skipped.
+
+        Returns:
+            The new summary, or None if none was needed or it failed
+        """
+        messages = [msg for msg in messages if msg["role"] in ["user", "assistant"]]
+        split = self._split(messages)
+        if not self.summary_applies(previous, messages):
+            previous = None
+        if split == 0 or (previous is not None and previous.covered >= split):
+            return None
+        if conversation_id in self._updating:
+            return None
+        self._updating.add(conversation_id)
+        try:
+            return await self._summarize(conversation_id, messages[:split], previous)
+        finally:
+            self._updating.discard(conversation_id)
+
+    async def _summarize(
+        self,
+        conversation_id: str,
+        messages: List[Dict[str, str]],
+        previous: Optional[ConversationSummary]
+    ) -> Optional[ConversationSummary]:
+        new_messages = messages[previous.covered:] if previous else messages
+        content = f"Current summary:\n{previous.text}\n\n" if previous else ""
+        content += f"New messages:\n{format_messages(new_messages)}"
+        try:
+            response = await chat_completion(
+                priority=PRIORITY_BULK,
+                operation="summary",
+                model=SUMMARY_MODEL,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": content}
+                ],
+                temperature=0.0,
+                max_tokens=SUMMARY_MAX_TOKENS
+            )
+        except Exception as e:
+            print(f"Error summarizing conversation {conversation_id}: {e}")
+            return None
+        self.summaries_created += 1
+        return ConversationSummary(
+            text=response.choices[0].message.content.strip(),
+            covered=len(messages),
+            digest=messages_digest(messages)
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Running and completed summary updates."""
+        return {
+            "updating": len(self._updating),
+            "summaries_created": self.summaries_created
+        }
+
+
+# Global instance
+conversation_memory = ConversationMemory()
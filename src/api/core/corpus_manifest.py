@@ -0,0 +1,373 @@
+"""Versioned manifest of the embedded corpus."""
+import os
+import json
+import fcntl
+import hashlib
+import threading
+import unicodedata
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+from .metrics import PENDING_DOCUMENTS
+
+# Directory holding the per-document indexes and the manifest
+EMBEDDINGS_DIR = Path(os.getenv("EMBEDDINGS_DIR", "./src/api/data/embeddings"))
+# Directory holding the original documents, scanned once when bootstrapping
+DOCUMENTS_DIR = Path(os.getenv("DOCUMENTS_DIR", "./data/documents"))
+# Manifest filename; deliberately not *.json so metadata globs never pick it up
+MANIFEST_NAME = "corpus.manifest"
+# Lock file serializing manifest updates of all worker processes
+MANIFEST_LOCK_NAME = "corpus.manifest.lock"
+# Lock file serializing the first-start bootstrap; taken while holding _lock, so it cannot be
+# the manifest lock (which is always taken before _lock)
+BOOTSTRAP_LOCK_NAME = "corpus.manifest.bootstrap.lock"
+
+# Suffix of the lock file claiming a document while it is being embedded
+INGESTING_SUFFIX = ".ingesting"
+
+_lock = threading.Lock()
+_manifest: Optional[Dict[str, Any]] = None
+# (inode, mtime) of the manifest file last read; the inode changes with every atomic rename
+_manifest_stamp: Optional[tuple] = None
+
+
+def content_hash(texts: List[str]) -> str:
+    """Hash of a document's chunk texts, used to detect content changes."""
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def manifest_digest(manifest: Dict[str, Any]) -> str:
+    """Fingerprint of the embedded documents; unlike the version it survives a recreated manifest."""
+    return hashlib.sha256(json.dumps(manifest["documents"], sort_keys=True).encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def file_lock(path: Path, blocking: bool = True, shared: bool = False) -> Iterator[bool]:
+    """
+    Lock shared by all processes and threads opening the same file (flock).
+
+    Exclusive unless `shared`, which admits other shared holders. Yields whether
+    the lock was acquired, which is only False when `blocking` is off and the
+    lock is held elsewhere.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f.fileno(), (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def ingestion_claim(document_id: str, embeddings_dir: Path = EMBEDDINGS_DIR) -> Iterator[bool]:
+    """
+    Claim a document for embedding, across coroutines, threads and worker processes.
+
+    Yields whether the claim succeeded; it fails while an upload or a repair is
+    embedding the same document. Uploads claim the document before registering
+    it as pending, so the reconciler never embeds it at the same time. The OS
+    releases the claim if the process dies.
+    """
+    path = embeddings_dir / f"{document_id}{INGESTING_SUFFIX}"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        # The previous holder removes the file on release; a lock on that removed file claims nothing
+        try:
+            claimed = os.stat(path).st_ino == os.fstat(f.fileno()).st_ino
+        except FileNotFoundError:
+            claimed = False
+        try:
+            yield claimed
+        finally:
+            if claimed:
+                path.unlink(missing_ok=True)
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _manifest_path(embeddings_dir: Path = EMBEDDINGS_DIR) -> Path:
+    return embeddings_dir / MANIFEST_NAME
+
+
+@contextmanager
+def _update_lock(embeddings_dir: Path) -> Iterator[None]:
+    """Serialize read-modify-write cycles across threads and worker processes."""
+    # The file lock comes first: readers holding it shared still need _lock to read the version
+    with file_lock(embeddings_dir / MANIFEST_LOCK_NAME), _lock:
+        yield
+
+
+@contextmanager
+def corpus_read_lock(embeddings_dir: Path = EMBEDDINGS_DIR) -> Iterator[None]:
+    """
+    Keep document files and manifest consistent while reading them.
+
+    Writers rename files into place and commit the manifest under the exclusive
+    lock, so a reader holding this shared lock sees exactly the documents of
+    one manifest version.
+    """
+    with file_lock(embeddings_dir / MANIFEST_LOCK_NAME, shared=True):
+        yield
+
+
+def staged_path(path: Path) -> Path:
+    """Temporary name next to `path`, for a file that record_document moves into place."""
+    return path.with_name(f"{path.name}.tmp.{uuid.uuid4().hex}")
+
+
+def _fsync(path: Path) -> None:
+    """Flush a file (or directory entry changes) to disk."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _bootstrap(embeddings_dir: Path, previous_version: int = 0) -> Dict[str, Any]:
+    """Build a manifest from the documents already on disk."""
+    documents = {}
+    if embeddings_dir.exists():
+        for metadata_file in sorted(embeddings_dir.glob("*.json")):
+            if not metadata_file.with_suffix(".index").exists():
+                continue
+            try:
+                with open(metadata_file, "r") as f:
+                    document_data = json.load(f)
+            except Exception as e:
+                print(f"Skipping unreadable metadata {metadata_file.name}: {e}")
+                continue
+            chunks = document_data.get("chunks", [])
+            documents[metadata_file.stem] = {
+                "content_hash": content_hash([chunk.get("text", "") for chunk in chunks]),
+                "chunks": len(chunks),
+                "embedding_model": document_data.get("embedding_model"),
+                "chunker": document_data.get("chunker"),
+                "filename": document_data.get("metadata", {}).get("filename"),
+            }
+
+    # Originals without embeddings, matched by document id or original filename
+    # (NFC-normalised, filenames copied from macOS are often decomposed)
+    pending = {}
+    if DOCUMENTS_DIR.exists():
+        embedded_filenames = {
+            unicodedata.normalize("NFC", entry["filename"]) for entry in documents.values() if entry.get("filename")
+        }
+        for path in sorted(DOCUMENTS_DIR.iterdir()):
+            if not path.is_file() or path.stem in documents:
+                continue
+            if unicodedata.normalize("NFC", path.name) not in embedded_filenames:
+                pending[path.stem] = path.name
+
+    return {
+        "version": previous_version + 1,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+        "documents": documents,
+        "pending": pending
+    }
+
+
+def _write(manifest: Dict[str, Any], embeddings_dir: Path) -> None:
+    """Write the manifest atomically (temp file + rename)."""
+    embeddings_dir.mkdir(parents=True, exist_ok=True)
+    path = _manifest_path(embeddings_dir)
+    tmp_path = path.with_name(f"{path.name}.tmp.{os.getpid()}")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _stamp(path: Path) -> Optional[tuple]:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns)
+
+
+def _load(embeddings_dir: Path = EMBEDDINGS_DIR) -> Dict[str, Any]:
+    """Return the manifest, re-reading it only when the file changed on disk."""
+    global _manifest, _manifest_stamp
+    path = _manifest_path(embeddings_dir)
+    stamp = _stamp(path)
+
+    if stamp is None:
+        with file_lock(embeddings_dir / BOOTSTRAP_LOCK_NAME):
+            # Another worker may have bootstrapped while we waited for the lock
+            stamp = _stamp(path)
+            if stamp is None:
+                # Keep counting up if the manifest was removed while we were running
+                _manifest = _bootstrap(embeddings_dir, _manifest["version"] if _manifest else 0)
+                _write(_manifest, embeddings_dir)
+                _manifest_stamp = _stamp(path)
+                PENDING_DOCUMENTS.set(len(_manifest.get("pending", {})))
+                return _manifest
+
+    if _manifest is None or stamp != _manifest_stamp:
+        with open(path, "r") as f:
+            _manifest = json.load(f)
+        _manifest_stamp = stamp
+        PENDING_DOCUMENTS.set(len(_manifest.get("pending", {})))
+    return _manifest
+
+
+def _commit(manifest: Dict[str, Any], embeddings_dir: Path, bump: bool = True) -> int:
+    """Persist the manifest, bumping the version when the embedded corpus changed."""
+    global _manifest, _manifest_stamp
+    if bump:
+        manifest["version"] += 1
+    manifest["updated_at"] = datetime.now(timezone.utc).isoformat()
+    _write(manifest, embeddings_dir)
+    _manifest = manifest
+    _manifest_stamp = _stamp(_manifest_path(embeddings_dir))
+    PENDING_DOCUMENTS.set(len(manifest.get("pending", {})))
+    return manifest["version"]
+
+
+def get_corpus_version(embeddings_dir: Path = EMBEDDINGS_DIR) -> int:
+    """Current corpus version; costs a single stat when nothing changed."""
+    with _lock:
+        return _load(embeddings_dir)["version"]
+
+
+def get_manifest(embeddings_dir: Path = EMBEDDINGS_DIR) -> Dict[str, Any]:
+    """Copy of the current manifest."""
+    with _lock:
+        manifest = _load(embeddings_dir)
+        return {**manifest, "documents": dict(manifest["documents"]), "pending": dict(manifest.get("pending", {}))}
+
+
+def get_embedding_status(embeddings_dir: Path = EMBEDDINGS_DIR) -> Dict[str, Any]:
+    """Embedding completeness from the maintained pending set, without scanning directories."""
+    with _lock:
+        manifest = _load(embeddings_dir)
+        pending = manifest.get("pending", {})
+        return {
+            "is_complete": not pending,
+            "missing": list(pending),
+            "total": len(manifest["documents"]) + len(pending)
+        }
+
+
+def register_pending(document_id: str, filename: str, embeddings_dir: Path = EMBEDDINGS_DIR) -> None:
+    """Mark a stored original as awaiting embeddings (does not change the corpus version)."""
+    with _update_lock(embeddings_dir):
+        manifest = _load(embeddings_dir)
+        manifest.setdefault("pending", {})[document_id] = filename
+        _commit(manifest, embeddings_dir, bump=False)
+
+
+def record_document(
+    document_id: str,
+    entry: Dict[str, Any],
+    embeddings_dir: Path = EMBEDDINGS_DIR,
+    files: Optional[Dict[Path, Path]] = None
+) -> int:
+    """
+    Add or replace a document entry and bump the version.
+
+    Args:
+        document_id: The document
+        entry: Manifest entry (content hash, chunk count, model, chunker, filename)
+        embeddings_dir: Directory of the manifest
+        files: Final path -> staged path (see staged_path) of the document's files;
+            they are synced, then renamed into place in the same commit
+
+    Returns:
+        The new corpus version
+    """
+    files = files or {}
+    try:
+        for tmp_path in files.values():
+            _fsync(tmp_path)
+    except Exception:
+        for tmp_path in files.values():
+            tmp_path.unlink(missing_ok=True)
+        raise
+    with _update_lock(embeddings_dir):
+        for path, tmp_path in files.items():
+            os.replace(tmp_path, path)
+        for directory in {path.parent for path in files}:
+            _fsync(directory)
+        manifest = _load(embeddings_dir)
+        manifest["documents"][document_id] = entry
+        manifest.setdefault("pending", {}).pop(document_id, None)
+        return _commit(manifest, embeddings_dir)
+
+
+def remove_document(
+    document_id: str,
+    embeddings_dir: Path = EMBEDDINGS_DIR,
+    files: Optional[List[Path]] = None
+) -> Optional[int]:
+    """
+    Remove a document entry; bumps the version only if it was embedded.
+
+    `files` (the document's index and metadata files) are deleted in the same commit.
+    """
+    with _update_lock(embeddings_dir):
+        for path in files or []:
+            path.unlink(missing_ok=True)
+        manifest = _load(embeddings_dir)
+        was_pending = manifest.setdefault("pending", {}).pop(document_id, None) is not None
+        if document_id not in manifest["documents"]:
+            if was_pending:
+                _commit(manifest, embeddings_dir, bump=False)
+            return None
+        del manifest["documents"][document_id]
+        return _commit(manifest, embeddings_dir)
+
+
+def _stale_documents(manifest: Dict[str, Any], embedding_model: str) -> Dict[str, Optional[str]]:
+    # Entries without a model predate model tracking; empty documents have no vectors to replace
+    return {
+        document_id: entry.get("filename")
+        for document_id, entry in manifest["documents"].items()
+        if entry.get("embedding_model") not in (None, embedding_model) and entry.get("chunks") != 0
+    }
+
+
+def requeue_stale_documents(embedding_model: str, embeddings_dir: Path = EMBEDDINGS_DIR) -> List[str]:
+    """
+    Move documents embedded with another model back to the pending set.
+
+    Their vectors are not comparable with queries of the active model, so they
+    leave the corpus until the reconciler has embedded them again.
+
+    Args:
+        embedding_model: Model of the active embedding provider
+        embeddings_dir: Directory of the manifest
+
+    Returns:
+        IDs of the requeued documents
+    """
+    with _lock:
+        if not _stale_documents(_load(embeddings_dir), embedding_model):
+            return []
+    with _update_lock(embeddings_dir):
+        manifest = _load(embeddings_dir)
+        stale = _stale_documents(manifest, embedding_model)
+        if not stale:
+            return []
+        for document_id, filename in stale.items():
+            del manifest["documents"][document_id]
+            manifest.setdefault("pending", {})[document_id] = filename
+        _commit(manifest, embeddings_dir)
+        return list(stale)
@@ -4,11 +4,11 @@ import uuid
 from typing import Dict, Optional, BinaryIO, List, Tuple, Any
 from pathlib import Path
 import shutil
-import pdfplumber
 import logging
 import time
-import pandas as pd
 from .onace_categories import OnaceManager, load_document_onace_mapping
+from .corpus_manifest import register_pending
+from .timing import record_span
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -20,11 +20,12 @@ DOCUMENTS_DIR = Path(os.getenv("DOCUMENTS_DIR", "./src/api/data/documents"))
 def process_text_document(
     file_content: str,
     filename: Optional[str] = None,
-    metadata: Optional[Dict] = None
+    metadata: Optional[Dict] = None,
+    document_id: Optional[str] = None
 ) -> Dict:
     """Process a text document directly from content."""
-    # Create a unique document ID
-    document_id = str(uuid.uuid4())
+    # Create a unique document ID unless the caller already claimed one
+    document_id = document_id or str(uuid.uuid4())
     
     # Create directory if it doesn't exist
     DOCUMENTS_DIR.mkdir(parents=True, exist_ok=True)
@@ -33,6 +34,7 @@ def process_text_document(
     document_path = DOCUMENTS_DIR / f"{document_id}.txt"
     with open(document_path, "w", encoding="utf-8") as f:
         f.write(file_content)
+    register_pending(document_id, document_path.name)
     
     # Prepare metadata
     doc_metadata = metadata or {}
@@ -58,6 +60,9 @@ def process_excel_file(document_path: Path) -> Optional[str]:
     try:
         logger.info(f"Processing Excel file: {document_path}")
         
+        # pandas/openpyxl are only needed for uploads, keep them out of the API's startup
+        import pandas as pd
+        
         # Read all sheets from the Excel file
         excel_data = pd.read_excel(document_path, sheet_name=None, engine='openpyxl')
         
@@ -100,6 +105,9 @@ def process_excel_file(document_path: Path) -> Optional[str]:
 
 def process_pdf_with_retry(document_path: Path, max_retries: int = 3) -> Optional[List[Tuple[int, str]]]:
     """Process a PDF file with retries, returning text per page."""
+    # Imported on first use, like pandas for Excel files
+    import pdfplumber
+    
     for attempt in range(max_retries):
         try:
             with pdfplumber.open(document_path) as pdf:
@@ -115,6 +123,7 @@ def process_pdf_with_retry(document_path: Path, max_retries: int = 3) -> Optiona
                 table_buffer = []
                 
                 for page_num, page in enumerate(pdf.pages, 1):
+                    page_started = time.perf_counter()
                     try:
                         # Add a small delay between pages to avoid potential issues
                         if page_num > 1:
@@ -198,6 +207,8 @@ def process_pdf_with_retry(document_path: Path, max_retries: int = 3) -> Optiona
                     except Exception as page_error:
                         logger.error(f"Error extracting text from page {page_num}/{total_pages}: {str(page_error)}")
                         continue
+                    finally:
+                        record_span("pdf_page", time.perf_counter() - page_started)
                 
                 if not page_texts:
                     if attempt < max_retries - 1:
@@ -220,14 +231,50 @@ def process_pdf_with_retry(document_path: Path, max_retries: int = 3) -> Optiona
     
     return None
 
+def extract_content(document_path: Path) -> Any:
+    """
+    Extract the content of a stored document based on its extension.
+    
+    Returns page tuples for PDFs and plain text otherwise; raises ValueError
+    when the file cannot be processed.
+    """
+    ext = document_path.suffix.lower()
+    if ext in (".txt", ".md", ".csv"):
+        with open(document_path, "r", encoding="utf-8", errors="ignore") as f:
+            return f.read()
+    if ext == ".pdf":
+        content = process_pdf_with_retry(document_path)
+        if content is None:
+            raise ValueError("Failed to process PDF after all retries")
+        return content
+    if ext in (".xlsx", ".xls"):
+        content = process_excel_file(document_path)
+        if content is None:
+            raise ValueError("Failed to process Excel file")
+        return content
+    raise ValueError(f"Unsupported file type: {ext}")
+
+def build_document_metadata(filename: str, ext: str, metadata: Optional[Dict] = None) -> Dict:
+    """Build document metadata, including the attributes used for filtered retrieval."""
+    # Get ÖNACE codes for this document
+    onace_mapping = load_document_onace_mapping()
+    
+    doc_metadata = metadata or {}
+    doc_metadata["filename"] = filename
+    doc_metadata["file_type"] = ext
+    doc_metadata["onace_codes"] = onace_mapping.get(filename, "0")
+    doc_metadata["is_vsme"] = filename == "EU_2025_1710_VSME"
+    return doc_metadata
+
 def save_uploaded_file(
     file: BinaryIO,
     filename: str,
-    metadata: Optional[Dict] = None
+    metadata: Optional[Dict] = None,
+    document_id: Optional[str] = None
 ) -> Dict:
     """Save an uploaded file and return its information."""
-    # Create a unique document ID
-    document_id = str(uuid.uuid4())
+    # Create a unique document ID unless the caller already claimed one
+    document_id = document_id or str(uuid.uuid4())
     
     # Create directory if it doesn't exist
     DOCUMENTS_DIR.mkdir(parents=True, exist_ok=True)
@@ -241,39 +288,18 @@ def save_uploaded_file(
     document_path = DOCUMENTS_DIR / f"{document_id}{ext}"
     with open(document_path, "wb") as f:
         shutil.copyfileobj(file, f)
+    register_pending(document_id, document_path.name)
     
     # Process different file types
-    processed_content: Any = None
-    if ext.lower() in (".txt", ".md", ".csv"):
-        with open(document_path, "r", encoding="utf-8", errors="ignore") as f:
-            processed_content = f.read()
-    elif ext.lower() == ".pdf":
-        try:
-            processed_content = process_pdf_with_retry(document_path)
-            if processed_content is None:
-                raise ValueError("Failed to process PDF after all retries")
-        except Exception as e:
-            logger.error(f"Error processing PDF {document_path}: {str(e)}")
-            processed_content = f"Error processing PDF: {str(e)}"
-    elif ext.lower() in (".xlsx", ".xls"):
-        try:
-            processed_content = process_excel_file(document_path)
-            if processed_content is None:
-                raise ValueError("Failed to process Excel file")
-        except Exception as e:
-            logger.error(f"Error processing Excel file {document_path}: {str(e)}")
-            processed_content = f"Error processing Excel file: {str(e)}"
-    else:
-        processed_content = f"Unsupported file type: {ext}"
-    
-    # Prepare metadata
-    doc_metadata = metadata or {}
-    doc_metadata["filename"] = filename
-    doc_metadata["file_type"] = ext
+    try:
+        processed_content = extract_content(document_path)
+    except Exception as e:
+        logger.error(f"Error processing {document_path}: {str(e)}")
+        processed_content = f"Error processing {ext.lstrip('.').upper()} file: {str(e)}"
     
-    # Get ÖNACE codes for this document
-    onace_mapping = load_document_onace_mapping()
-    onace_codes = onace_mapping.get(filename, "0")
+    doc_metadata = build_document_metadata(filename, ext, metadata)
+    onace_codes = doc_metadata["onace_codes"]
+    is_vsme = doc_metadata["is_vsme"]
     
     return {
         "document_id": document_id,
@@ -283,7 +309,7 @@ def save_uploaded_file(
         "size": os.path.getsize(document_path),
         "metadata": doc_metadata,
         "onace_codes": onace_codes,
-        "is_vsme": filename == "EU_2025_1710_VSME"
+        "is_vsme": is_vsme
     }
 
 def get_document_content(document_id: str) -> Optional[Any]:
@@ -292,21 +318,11 @@ def get_document_content(document_id: str) -> Optional[Any]:
     for ext in [".txt", ".md", ".csv", ".pdf", ".xlsx", ".xls"]:
         document_path = DOCUMENTS_DIR / f"{document_id}{ext}"
         if document_path.exists():
-            if ext.lower() == ".pdf":
-                try:
-                    return process_pdf_with_retry(document_path)
-                except Exception as e:
-                    logger.error(f"Error reading PDF {document_path}: {str(e)}")
-                    return None
-            elif ext.lower() in (".xlsx", ".xls"):
-                try:
-                    return process_excel_file(document_path)
-                except Exception as e:
-                    logger.error(f"Error reading Excel file {document_path}: {str(e)}")
-                    return None
-            else:
-                with open(document_path, "r", encoding="utf-8", errors="ignore") as f:
-                    return f.read()
+            try:
+                return extract_content(document_path)
+            except Exception as e:
+                logger.error(f"Error reading {document_path}: {str(e)}")
+                return None
     
     logger.error(f"Document not found: {document_id}")
     return None 
\ No newline at end of file
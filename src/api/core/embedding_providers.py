@@ -0,0 +1,190 @@
+"""Embedding backends: the OpenAI API or local CPU models."""
+import os
+import asyncio
+import hashlib
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional
+import numpy as np
+from .bm25 import tokenize
+from .vector_store import truncate_embeddings
+from .openai_scheduler import embedding_batcher, PRIORITY_INTERACTIVE, EMBEDDING_BATCH_SIZE
+
+# Backend used for documents and queries: "openai", "hashing" or "onnx"
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai").lower()
+# Default OpenAI embedding model
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Output size of the hashing embedder; matches text-embedding-3-small so index sizes are comparable
+LOCAL_EMBEDDING_DIMENSIONS = int(os.getenv("LOCAL_EMBEDDING_DIMENSIONS", "1536"))
+# Texts per local inference call and worker threads running those calls
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "64"))
+LOCAL_EMBEDDING_THREADS = int(os.getenv("LOCAL_EMBEDDING_THREADS", str(os.cpu_count() or 4)))
+# Directory with model.onnx and tokenizer.json of an exported sentence-transformer
+ONNX_MODEL_DIR = Path(os.getenv("ONNX_MODEL_DIR", "./models/embedding"))
+# Token limit of the ONNX model's input
+ONNX_MAX_LENGTH = int(os.getenv("ONNX_MAX_LENGTH", "512"))
+
+
+class EmbeddingProvider(ABC):
+    """Turns texts into vectors; `model` is recorded with every embedded document."""
+
+    model: str
+    # Texts per embed() call that ingestion should submit at once
+    batch_size: int
+
+    @abstractmethod
+    async def embed(
+        self,
+        texts: List[str],
+        dimensions: Optional[int] = None,
+        priority: int = PRIORITY_INTERACTIVE
+    ) -> List[List[float]]:
+        """
+        Embed a batch of texts.
+
+        Args:
+            texts: Texts to embed
+            dimensions: Optional size to shorten the vectors to
+            priority: Scheduling priority, only relevant for rate-limited backends
+
+        Returns:
+            One vector per text, in input order
+        """
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """OpenAI embeddings API, batched and rate-limited by the shared scheduler."""
+
+    def __init__(self, model: str = EMBEDDING_MODEL):
+        self.model = model
+        self.batch_size = EMBEDDING_BATCH_SIZE
+
+    async def embed(self, texts, dimensions=None, priority=PRIORITY_INTERACTIVE):
+        # Requests are coalesced by the batcher, also across concurrent callers
+        return list(await asyncio.gather(
+            *(embedding_batcher.embed(text, self.model, dimensions, priority) for text in texts)
+        ))
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """Base for CPU backends; batches run concurrently on a thread pool."""
+
+    def __init__(self):
+        self.batch_size = LOCAL_EMBEDDING_BATCH_SIZE
+        self._executor = ThreadPoolExecutor(max_workers=LOCAL_EMBEDDING_THREADS, thread_name_prefix="embedding")
+
+    @abstractmethod
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Embed texts into L2-normalised float32 rows (runs in a worker thread)."""
+
+    async def embed(self, texts, dimensions=None, priority=PRIORITY_INTERACTIVE):
+        if not texts:
+            return []
+        loop = asyncio.get_running_loop()
+        batches = await asyncio.gather(*(
+            loop.run_in_executor(self._executor, self._embed_batch, texts[start:start + self.batch_size])
+            for start in range(0, len(texts), self.batch_size)
+        ))
+        vectors = np.vstack(batches)
+        if dimensions and dimensions < vectors.shape[1]:
+            vectors = truncate_embeddings(vectors, dimensions)
+        return vectors.tolist()
+
+
+@lru_cache(maxsize=200_000)
+def _feature_hash(feature: str) -> int:
+    # blake2b instead of hash() so vectors are identical across processes and runs
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class HashingEmbeddingProvider(LocalEmbeddingProvider):
+    """
+    Deterministic feature-hashing embedder for tests and offline benchmarks.
+
+    Unigrams and bigrams of the BM25 tokenizer are hashed into signed buckets, so
+    texts sharing terms end up close; it needs no model files or network access.
+    """
+
+    def __init__(self, dimensions: int = LOCAL_EMBEDDING_DIMENSIONS):
+        super().__init__()
+        self.dimensions = dimensions
+        self.model = f"hashing-{dimensions}"
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                h = _feature_hash(feature)
+                vectors[row, h % self.dimensions] += 1.0 if h >> 63 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class OnnxEmbeddingProvider(LocalEmbeddingProvider):
+    """
+    Sentence-transformer exported to ONNX, with mean pooling.
+
+    Requires the optional onnxruntime and tokenizers packages and a model
+    directory containing model.onnx and tokenizer.json.
+    """
+
+    def __init__(self, model_dir: Path = ONNX_MODEL_DIR):
+        super().__init__()
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("EMBEDDING_PROVIDER=onnx requires the onnxruntime and tokenizers packages") from e
+
+        options = onnxruntime.SessionOptions()
+        # Parallelism comes from the thread pool; one thread per inference call avoids oversubscription
+        options.intra_op_num_threads = 1
+        self._session = onnxruntime.InferenceSession(
+            str(model_dir / "model.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {model_input.name for model_input in self._session.get_inputs()}
+        self._tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self._tokenizer.enable_truncation(max_length=ONNX_MAX_LENGTH)
+        self._tokenizer.enable_padding()
+        self.model = f"onnx-{model_dir.name}"
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self._tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+        }
+        if "token_type_ids" in self._input_names:
+            inputs["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+        token_embeddings = self._session.run(None, inputs)[0]
+        mask = inputs["attention_mask"][:, :, None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+_provider: Optional[EmbeddingProvider] = None
+
+
+def create_embedding_provider(name: str = EMBEDDING_PROVIDER) -> EmbeddingProvider:
+    """Create the embedding backend selected by name."""
+    if name == "openai":
+        return OpenAIEmbeddingProvider()
+    if name == "hashing":
+        return HashingEmbeddingProvider()
+    if name == "onnx":
+        return OnnxEmbeddingProvider()
+    raise ValueError(f"Unknown embedding provider: {name}")
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """Shared embedding backend configured by EMBEDDING_PROVIDER, created on first use."""
+    global _provider
+    if _provider is None:
+        _provider = create_embedding_provider()
+    return _provider
@@ -1,72 +1,67 @@
 """Document embedding using OpenAI API."""
 import os
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 import numpy as np
-import tiktoken
-import openai
-from openai import OpenAI, AsyncOpenAI
 import faiss
 import pickle
 import json
 from pathlib import Path
 from dotenv import load_dotenv
-from ..core.document_processor import get_document_content
+from ..core.document_processor import extract_content, build_document_metadata
+from .vector_store import (
+    CorpusIndex, get_corpus_index, truncate_embeddings, COARSE_DIMENSIONS, COARSE_INDEX_SUFFIX, TWO_STAGE_SEARCH, HYBRID_SEARCH
+)
+from .bm25 import build_document_postings, BM25_SUFFIX
+from .corpus_manifest import record_document, content_hash, get_manifest, get_embedding_status, staged_path
+from .openai_scheduler import get_token_encoding, PRIORITY_INTERACTIVE, PRIORITY_BULK
+from .embedding_providers import get_embedding_provider, EMBEDDING_MODEL, EMBEDDING_PROVIDER
+from .timing import span
 import asyncio
 
 # Load environment variables
 load_dotenv()
 
-# Get OpenAI API key
+# Get OpenAI API key (not needed when embedding with a local provider)
 api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
+if not api_key and EMBEDDING_PROVIDER == "openai":
     raise ValueError("OPENAI_API_KEY environment variable is not set")
 
-# Initialize the Async OpenAI client
-client = AsyncOpenAI(api_key=api_key)
-
-# Default embedding model
-EMBEDDING_MODEL = "text-embedding-3-small"
-# Default encoding for token counting
-ENCODING = tiktoken.get_encoding("cl100k_base")
 # Maximum tokens for embedding model
 MAX_TOKENS = 8191
+# Chunker parameters, recorded in the corpus manifest
+CHUNK_SIZE = 512
+CHUNK_OVERLAP = 80
+MIN_CHUNK_TOKENS = 128
 # Path to store the FAISS index
 EMBEDDINGS_DIR = Path(os.getenv("EMBEDDINGS_DIR", "./src/api/data/embeddings"))
 
-async def get_embedding(text: str, model: str = EMBEDDING_MODEL) -> List[float]:
-    """Get embeddings for a text using OpenAI API."""
-    text = text.replace("\n", " ")
-    
-    # Add retry logic
-    max_retries = 3
-    backoff_factor = 1.5
-    retry_count = 0
+async def get_embedding(
+    text: str,
+    dimensions: Optional[int] = None,
+    priority: int = PRIORITY_INTERACTIVE
+) -> List[float]:
+    """
+    Get the embedding of a text from the configured provider, optionally shortened to `dimensions`.
     
-    while retry_count < max_retries:
-        try:
-            response = await client.embeddings.create(input=[text], model=model)
-            return response.data[0].embedding
-        except Exception as e:
-            retry_count += 1
-            if retry_count >= max_retries:
-                print(f"Failed to get embedding after {max_retries} attempts: {str(e)}")
-                raise
-            
-            # Exponential backoff
-            wait_time = backoff_factor ** retry_count
-            print(f"Embedding API error: {str(e)}. Retrying in {wait_time:.1f} seconds...")
-            await asyncio.sleep(wait_time)
+    With the OpenAI provider, requests waiting at the same time are batched and rate
+    limits are handled by the shared scheduler; ingestion should pass PRIORITY_BULK
+    so queries go first.
+    """
+    text = text.replace("\n", " ")
+    return (await get_embedding_provider().embed([text], dimensions, priority))[0]
 
-def chunk_text(text: str, chunk_size: int = 512, overlap: int = 80) -> List[str]:
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
     """Split text into overlapping chunks of tokens."""
-    tokens = ENCODING.encode(text)
-    chunks = []
-    
-    for i in range(0, len(tokens), chunk_size - overlap):
-        chunk_tokens = tokens[i:i + chunk_size]
-        if len(chunk_tokens) < 128:  # Skip chunks smaller than 128 tokens to maintain context
-            continue
-        chunks.append(ENCODING.decode(chunk_tokens))
+    with span("chunk_text"):
+        encoding = get_token_encoding()
+        tokens = encoding.encode(text)
+        chunks = []
+        
+        for i in range(0, len(tokens), chunk_size - overlap):
+            chunk_tokens = tokens[i:i + chunk_size]
+            if len(chunk_tokens) < MIN_CHUNK_TOKENS:  # Skip small chunks to maintain context
+                continue
+            chunks.append(encoding.decode(chunk_tokens))
     
     return chunks
 
@@ -78,33 +73,29 @@ async def create_document_embeddings(
 ) -> Dict:
     """Create embeddings for a document and store in FAISS index."""
     EMBEDDINGS_DIR.mkdir(parents=True, exist_ok=True)
+    provider = get_embedding_provider()
     
     document_data = {
         "document_id": document_id,
         "chunks": [],
-        "metadata": metadata or {}
+        "metadata": metadata or {},
+        "embedding_model": provider.model,
+        "chunker": {"chunk_size": CHUNK_SIZE, "overlap": CHUNK_OVERLAP, "min_tokens": MIN_CHUNK_TOKENS}
     }
     
-    embeddings = []
-    chunk_index_counter = 0
+    # Collect chunks first so their embedding requests can be batched together
+    candidates = []
 
     # Handle based on content type
     if isinstance(processed_content, str):
         # Simple text document
         chunks = chunk_text(processed_content)
         for i, chunk in enumerate(chunks):
-            try:
-                embedding = await get_embedding(chunk)
-                embeddings.append(embedding)
-                document_data["chunks"].append({
-                    "chunk_id": f"{document_id}_t{i}", # Indicate text chunk
-                    "text": chunk,
-                    "embedding_index": chunk_index_counter,
-                    "page_number": None # No page number for plain text
-                })
-                chunk_index_counter += 1
-            except Exception as e:
-                print(f"Error embedding text chunk {i} for {document_id}: {e}")
+            candidates.append({
+                "chunk_id": f"{document_id}_t{i}", # Indicate text chunk
+                "text": chunk,
+                "page_number": None # No page number for plain text
+            })
     elif isinstance(processed_content, list):
         # List of (page_num, page_text) tuples (likely from PDF)
         for page_num, page_text in processed_content:
@@ -113,28 +104,52 @@ async def create_document_embeddings(
                 
             page_chunks = chunk_text(page_text)
             for i, chunk in enumerate(page_chunks):
-                try:
-                    embedding = await get_embedding(chunk)
-                    embeddings.append(embedding)
-                    document_data["chunks"].append({
-                        "chunk_id": f"{document_id}_p{page_num}_c{i}", # Include page and chunk index
-                        "text": chunk,
-                        "embedding_index": chunk_index_counter,
-                        "page_number": page_num # STORE THE PAGE NUMBER
-                    })
-                    chunk_index_counter += 1
-                except Exception as e:
-                    print(f"Error embedding chunk {i} from page {page_num} for {document_id}: {e}")
+                candidates.append({
+                    "chunk_id": f"{document_id}_p{page_num}_c{i}", # Include page and chunk index
+                    "text": chunk,
+                    "page_number": page_num # STORE THE PAGE NUMBER
+                })
     else:
         # Handle error case or unsupported type
         error_message = f"Unsupported processed_content type: {type(processed_content)}"
         print(error_message)
         return {"success": False, "error": error_message}
+    
+    if not candidates:
+        # Nothing to embed (empty, image-only or very short text). Record the document anyway,
+        # otherwise it stays pending and the reconciler re-parses it on every pass
+        await asyncio.to_thread(record_document, document_id, {
+            "content_hash": content_hash([]),
+            "chunks": 0,
+            "embedding_model": provider.model,
+            "chunker": document_data["chunker"],
+            "filename": document_data["metadata"].get("filename")
+        })
+        return {"success": True, "document_id": document_id, "chunks": 0, "dimensions": None, "message": "Document was empty, skipping embedding."}
+
+    # Ingestion runs at bulk priority so interactive queries are not queued behind it
+    batches = [candidates[i:i + provider.batch_size] for i in range(0, len(candidates), provider.batch_size)]
+
+    async def embed_batch(batch: List[Dict]) -> List[List[float]]:
+        with span("embedding_batch", chunks=len(batch)):
+            return await provider.embed([c["text"].replace("\n", " ") for c in batch], priority=PRIORITY_BULK)
+
+    results = await asyncio.gather(*(embed_batch(batch) for batch in batches), return_exceptions=True)
+    failed = [(batch, result) for batch, result in zip(batches, results) if isinstance(result, BaseException)]
+    if failed:
+        # Fail the whole document rather than commit a partial index; it stays pending for the reconciler
+        for batch, error in failed:
+            print(f"Error embedding chunks {batch[0]['chunk_id']}..{batch[-1]['chunk_id']} for {document_id}: {error}")
+        return {"success": False, "error": f"{len(failed)} of {len(batches)} embedding batches failed: {failed[0][1]}"}
+
+    embeddings = []
+    for batch, result in zip(batches, results):
+        for candidate, embedding in zip(batch, result):
+            candidate["embedding_index"] = len(embeddings)
+            embeddings.append(embedding)
+            document_data["chunks"].append(candidate)
         
     if not embeddings:
-        # Check if content was just empty
-        if not processed_content:
-             return {"success": True, "document_id": document_id, "chunks": 0, "dimensions": None, "message": "Document was empty, skipping embedding."}
         return {"success": False, "error": "No valid embeddings created"}
     
     # Ensure dimension is correctly calculated
@@ -142,15 +157,49 @@ async def create_document_embeddings(
     if dimension > 0:
         embeddings_array = np.array(embeddings, dtype=np.float32)
         index_path = EMBEDDINGS_DIR / f"{document_id}.index"
+        coarse_index_path = EMBEDDINGS_DIR / f"{document_id}{COARSE_INDEX_SUFFIX}"
+        bm25_path = EMBEDDINGS_DIR / f"{document_id}{BM25_SUFFIX}"
         metadata_path = EMBEDDINGS_DIR / f"{document_id}.json"
+        # Files are written under temporary names and moved into place by the manifest commit
+        staged = {path: staged_path(path) for path in (index_path, coarse_index_path, bm25_path, metadata_path)}
         
         index = faiss.IndexFlatL2(dimension)
         index.add(embeddings_array)
         
-        faiss.write_index(index, str(index_path))
+        # Keep truncated vectors next to the full ones for the coarse search stage
+        coarse_index = faiss.IndexFlatL2(COARSE_DIMENSIONS)
+        coarse_index.add(truncate_embeddings(embeddings_array))
+        
+        try:
+            with span("faiss_write"):
+                faiss.write_index(index, str(staged[index_path]))
+                faiss.write_index(coarse_index, str(staged[coarse_index_path]))
+            document_data["dimensions"] = dimension
+            document_data["coarse_dimensions"] = COARSE_DIMENSIONS
+        
+            # Persist BM25 term statistics for hybrid retrieval
+            with span("bm25_postings"):
+                postings = build_document_postings([chunk["text"] for chunk in document_data["chunks"]])
+            with open(staged[bm25_path], "w") as f:
+                json.dump(postings, f)
         
-        with open(metadata_path, "w") as f:
-            json.dump(document_data, f)
+            with open(staged[metadata_path], "w") as f:
+                json.dump(document_data, f)
+        except Exception:
+            for tmp_path in staged.values():
+                tmp_path.unlink(missing_ok=True)
+            raise
+        
+        # Publish the files and bump the corpus version so loaders and caches pick up the document
+        chunk_texts = [chunk["text"] for chunk in document_data["chunks"]]
+        with span("manifest_commit"):
+            await asyncio.to_thread(record_document, document_id, {
+                "content_hash": content_hash(chunk_texts),
+                "chunks": len(chunk_texts),
+                "embedding_model": provider.model,
+                "chunker": document_data["chunker"],
+                "filename": document_data["metadata"].get("filename")
+            }, files=staged)
     else:
         # Handle case where no embeddings were generated but content wasn't empty (e.g., all chunks failed)
         return {"success": False, "error": "Embeddings could not be generated for any chunks."}
@@ -207,87 +256,77 @@ async def search_embeddings(
             
     return results
 
-async def search_all_documents(query: str, top_k: int = 3, user_onace_code: str = "0") -> List[Dict]:
-    """Search across all document embeddings for similar chunks (async version)."""
-    if not await asyncio.to_thread(EMBEDDINGS_DIR.exists):
-        return []
-    
-    # Get all metadata files asynchronously
-    def list_json_files(path):
-        return list(path.glob("*.json"))
+def chunk_results(corpus: CorpusIndex, matches: List[Tuple[int, float, Optional[float]]]) -> List[Dict]:
+    """Build search results with document metadata from (row, distance, fusion score) matches."""
+    results = []
+    for row, distance, fusion_score in matches:
+        chunk = corpus.chunks[row]
+        document_metadata = corpus.documents[chunk["document_id"]]["metadata"]
         
-    metadata_files = await asyncio.to_thread(list_json_files, EMBEDDINGS_DIR)
-    if not metadata_files:
+        chunk_metadata = document_metadata.copy() # Start with base doc metadata
+        if "page_number" in chunk:
+            chunk_metadata["page_number"] = chunk["page_number"]
+        
+        # Add ÖNACE information to metadata
+        chunk_metadata["onace_codes"] = document_metadata.get("onace_codes", "0")
+        chunk_metadata["is_vsme"] = document_metadata.get("is_vsme", False)
+        
+        result = {
+            "document_id": chunk["document_id"],
+            "chunk_id": chunk["chunk_id"],
+            "text": chunk["text"],
+            "score": distance,
+            "metadata": chunk_metadata
+        }
+        if fusion_score is not None:
+            result["fusion_score"] = fusion_score
+        results.append(result)
+    return results
+
+async def search_all_documents(
+    query: str,
+    top_k: int = 3,
+    user_onace_code: str = "0",
+    two_stage: bool = TWO_STAGE_SEARCH,
+    filters: Optional[Dict[str, Any]] = None,
+    hybrid: bool = HYBRID_SEARCH,
+    query_embedding: Optional[List[float]] = None,
+    document_ids: Optional[List[str]] = None
+) -> List[Dict]:
+    """
+    Search across all document embeddings for similar chunks (async version).
+    
+    With `hybrid` enabled, BM25 and vector rankings are fused and each result
+    carries a `fusion_score` (higher is better) next to its L2 `score`.
+    A precomputed `query_embedding` skips the embedding call, `document_ids`
+    restricts the search to those documents.
+    """
+    corpus = await get_corpus_index()
+    if corpus.size == 0:
         return []
     
     # Get query embedding asynchronously
-    query_embedding = await get_embedding(query)
+    if query_embedding is None:
+        with span("query_embedding"):
+            query_embedding = await get_embedding(query)
     query_embedding_array = np.array([query_embedding], dtype=np.float32)
     
-    # --- Helper function to process a single document asynchronously ---
-    async def process_single_document(metadata_file: Path) -> List[Dict]:
-        document_id = metadata_file.stem
-        index_path = metadata_file.with_suffix(".index")
-        
-        if not await asyncio.to_thread(index_path.exists):
-            return []
-            
-        # Load index and metadata asynchronously
-        index = await asyncio.to_thread(faiss.read_index, str(index_path))
-        
-        def load_json(path):
-            with open(path, "r") as f:
-                return json.load(f)
-        document_data = await asyncio.to_thread(load_json, metadata_file)
-        
-        # Check ÖNACE relevance before searching
-        doc_onace_codes = document_data.get("metadata", {}).get("onace_codes", "0")
-        from .onace_categories import OnaceManager
-        doc_onace_set = OnaceManager.parse_onace_codes(doc_onace_codes)
-        
-        # Skip if document is not relevant to user's industry
-        if not OnaceManager.is_document_relevant(doc_onace_set, user_onace_code):
-            return []
-        
-        # Search (sync within this task for now, see comment in search_embeddings)
-        distances, indices = index.search(query_embedding_array, top_k)
-        
-        doc_results = []
-        chunks_data = document_data.get("chunks", [])
-        metadata_base = document_data.get("metadata", {}).copy()
-
-        for i, idx in enumerate(indices[0]):
-            if 0 <= idx < len(chunks_data):
-                chunk = chunks_data[idx]
-                
-                chunk_metadata = metadata_base.copy() # Start with base doc metadata
-                if "page_number" in chunk:
-                    chunk_metadata["page_number"] = chunk["page_number"]
-                
-                # Add ÖNACE information to metadata
-                chunk_metadata["onace_codes"] = doc_onace_codes
-                chunk_metadata["is_vsme"] = document_data.get("metadata", {}).get("is_vsme", False)
-                
-                doc_results.append({
-                    "document_id": document_id,
-                    "chunk_id": chunk.get("chunk_id", f"{document_id}_{idx}"),
-                    "text": chunk.get("text", ""),
-                    "score": float(distances[0][i]), # Ensure float
-                    "metadata": chunk_metadata 
-                })
-        return doc_results
-    # --------------------------------------------------------------------
-
-    # Gather results from all documents concurrently
-    tasks = [process_single_document(mf) for mf in metadata_files]
-    results_list = await asyncio.gather(*tasks)
+    # ÖNACE partitions and filter bitmaps are precomputed per corpus snapshot
+    bitmap = corpus.filter_bitmap(user_onace_code, filters)
+    if document_ids is not None:
+        bitmap = corpus.document_bitmap(document_ids, bitmap)
     
-    # Flatten the list of lists
-    all_results = [item for sublist in results_list for item in sublist]
+    # FAISS and BM25 scoring are CPU-bound, run them in a thread executor
+    with span("index_search", hybrid=hybrid, two_stage=two_stage):
+        if hybrid:
+            matches = await asyncio.to_thread(corpus.hybrid_search, query, query_embedding_array, top_k, bitmap, two_stage)
+        else:
+            matches = [
+                (row, distance, None)
+                for row, distance in await asyncio.to_thread(corpus.search, query_embedding_array, top_k, bitmap, two_stage)
+            ]
     
-    # Sort by score (sync, fast operation)
-    all_results.sort(key=lambda x: x["score"])
-    return all_results[:top_k]
+    return chunk_results(corpus, matches)
 
 def get_all_documents() -> List[Dict]:
     """Get list of all documents in the documents directory."""
@@ -308,83 +347,68 @@ def get_all_documents() -> List[Dict]:
 
 def get_all_embedded_documents() -> List[str]:
     """Get list of document IDs that have embeddings."""
-    if not EMBEDDINGS_DIR.exists():
-        return []
-    
-    embedded_docs = []
-    for metadata_file in EMBEDDINGS_DIR.glob("*.json"):
-        if metadata_file.with_suffix(".index").exists():
-            embedded_docs.append(metadata_file.stem)
-    return embedded_docs
+    return list(get_manifest()["documents"])
 
 async def verify_document_embeddings() -> Dict[str, Any]:
-    """Verify that all documents in the documents directory have corresponding embeddings."""
-    documents_dir = Path(os.getenv("DOCUMENTS_DIR", "./data/documents"))
-    if not await asyncio.to_thread(documents_dir.exists):
-        return {"is_complete": True, "missing": [], "total": 0}
-        
-    all_files = [p.stem for p in await asyncio.to_thread(list, documents_dir.glob("*")) if await asyncio.to_thread(p.is_file)]
-    embedded_files = get_all_embedded_documents()
-    
-    missing = [doc_id for doc_id in all_files if doc_id not in embedded_files]
+    """
+    Verify that all documents in the documents directory have corresponding embeddings.
     
-    return {
-        "is_complete": not bool(missing),
-        "missing": missing,
-        "total": len(all_files)
-    }
+    Backed by the pending set of the corpus manifest, which uploads, embedding and
+    deletion keep up to date, so no directory is listed on the request path.
+    """
+    return await asyncio.to_thread(get_embedding_status)
 
-async def process_missing_embeddings() -> Dict[str, Any]:
-    """Process documents that are missing embeddings."""
-    verification = await verify_document_embeddings()
-    if verification["is_complete"]:
-        return {"message": "All documents already have embeddings.", "verification": verification}
-    
-    processed_count = 0
-    failed_count = 0
-    failed_docs = []
+async def repair_document(document_id: str, filename: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Create the missing embeddings of a stored original document.
     
+    Args:
+        document_id: ID of the document (stem of the stored original)
+        filename: Stored filename from the manifest's pending set, if known
+        
+    Returns:
+        Result of create_document_embeddings, or an error result
+    """
     documents_dir = Path(os.getenv("DOCUMENTS_DIR", "./data/documents"))
-
-    for doc_id in verification["missing"]:
+    file_path = documents_dir / filename if filename else None
+    if file_path is None or not file_path.exists():
         # Reconstruct the expected path based on doc_id and potential extensions
-        # This assumes doc_id is the stem and we need to find the actual file
-        possible_files = list(documents_dir.glob(f"{doc_id}.*"))
+        possible_files = sorted(documents_dir.glob(f"{document_id}.*"))
         if not possible_files:
-            print(f"Warning: Could not find original file for missing document ID: {doc_id}")
-            failed_count += 1
-            failed_docs.append(doc_id)
-            continue
-            
-        file_path = possible_files[0] # Take the first match
-        
-        try:
-            print(f"Processing missing embeddings for: {file_path.name}")
-            # Get content and metadata
-            content, metadata = get_document_content(str(file_path))
-            
-            # Create embeddings
-            result = await create_document_embeddings(
-                doc_id,
-                content,
-                metadata
-            )
-            if result["success"]:
-                processed_count += 1
-            else:
-                failed_count += 1
-                failed_docs.append(doc_id)
-                print(f"Failed to create embeddings for {doc_id}: {result.get('error')}")
-        except Exception as e:
-            failed_count += 1
-            failed_docs.append(doc_id)
-            print(f"Error processing document {doc_id}: {str(e)}")
-            
-    # Re-verify after processing
-    final_verification = await verify_document_embeddings()
+            return {"success": False, "error": f"Could not find original file for document ID: {document_id}"}
+        file_path = possible_files[0]
     
-    return {
-        "message": f"Processed {processed_count} documents. Failed: {failed_count}",
-        "failed_documents": failed_docs,
-        "verification": final_verification
-    } 
\ No newline at end of file
+    print(f"Processing missing embeddings for: {file_path.name}")
+    try:
+        # PDF parsing is blocking and slow, keep it off the event loop
+        content = await asyncio.to_thread(extract_content, file_path)
+    except Exception as e:
+        return {"success": False, "error": f"Error processing {file_path.name}: {str(e)}"}
+    
+    metadata = build_document_metadata(file_path.name, file_path.suffix)
+    return await create_document_embeddings(document_id, content, metadata)
+
+
+async def rescore_chunks(
+    chunk_ids: List[str],
+    query_embedding: List[float],
+    user_onace_code: str = "0",
+    filters: Optional[Dict[str, Any]] = None
+) -> List[Dict]:
+    """
+    Score known chunks against a new query, e.g. the chunks of the previous chat turn.
+
+    Chunks removed from the corpus or excluded by the ÖNACE code or filters are
+    skipped. Each result carries its L2 `score` and its cosine `similarity`.
+    """
+    corpus = await get_corpus_index()
+    rows = corpus.rows_for_chunks(chunk_ids, corpus.filter_bitmap(user_onace_code, filters))
+    if len(rows) == 0:
+        return []
+    query_embedding_array = np.array([query_embedding], dtype=np.float32)
+    distances = corpus.distances(rows, query_embedding_array)
+    similarities = corpus.similarities(rows, query_embedding_array)
+    results = chunk_results(corpus, [(int(row), float(distance), None) for row, distance in zip(rows, distances)])
+    for result, similarity in zip(results, similarities):
+        result["similarity"] = float(similarity)
+    return results
@@ -1,10 +1,9 @@
 """Smart AI-powered link detection for RAG responses."""
 import json
-import os
 from typing import List, Dict, Set, Optional
 from pathlib import Path
-from openai import AsyncOpenAI
 from dotenv import load_dotenv
+from .openai_scheduler import chat_completion
 
 # Load environment variables
 load_dotenv()
@@ -21,11 +20,7 @@ class LinkDetector:
             "nature": "https://natura2000.eea.europa.eu"
         }
         
-        # Initialize OpenAI client
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY environment variable is not set")
-        self.client = AsyncOpenAI(api_key=api_key)
+        # Requests go through the shared, pooled OpenAI client, which requires OPENAI_API_KEY on first use
     
     
     async def get_relevant_links(self, query: str, chunks: List[Dict], user_onace_code: str = "0") -> List[str]:
@@ -122,14 +117,15 @@ Context from relevant documents:
 Classify this query into one of the three categories, considering the user's industry context."""
 
         try:
-            response = await self.client.chat.completions.create(
+            response = await chat_completion(
                 model="gpt-4.1-mini-2025-04-14",
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
                 ],
                 temperature=0.0,
-                max_tokens=10
+                max_tokens=10,
+                operation="link_classification"
             )
             
             classification = response.choices[0].message.content.strip().lower()
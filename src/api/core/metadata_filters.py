@@ -0,0 +1,128 @@
+"""Per-chunk document attributes and metadata filter evaluation."""
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+# Document families derived from the filename prefix convention of the corpus
+DOCUMENT_FAMILIES = ["eu_regulation", "sbti", "ghg_protocol", "guidance", "un", "report", "national", "other"]
+FAMILY_PREFIXES = {
+    "EU": "eu_regulation",
+    "EG": "eu_regulation",
+    "EWG": "eu_regulation",
+    "G": "guidance",
+    "UN": "un",
+    "R": "report",
+    "AT": "national",
+}
+# Matches "EU_2023_…", "G_2025_…" and two-digit years like "EWG_86_…"
+FILENAME_PATTERN = re.compile(r"^(?P<prefix>[A-Z]+)_(?P<year>\d{2}|\d{4})(?:_|\b)")
+# Sentinel stored for documents without a year in their filename
+UNKNOWN_YEAR = 0
+
+
+def parse_document_attributes(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Derive filterable attributes from a document's metadata.
+
+    Args:
+        metadata: Document metadata as produced by save_uploaded_file
+
+    Returns:
+        Dict with family, year, file_type and is_vsme
+    """
+    filename = metadata.get("filename", "")
+    stem = Path(filename).stem
+    file_type = (metadata.get("file_type") or Path(filename).suffix).lower()
+
+    family = "other"
+    year = UNKNOWN_YEAR
+    match = FILENAME_PATTERN.match(stem)
+    if match:
+        family = FAMILY_PREFIXES.get(match.group("prefix"), "other")
+        year = int(match.group("year"))
+        if year < 100:
+            year += 1900 if year > 50 else 2000
+    if family == "guidance" and "_SBTi_" in stem:
+        family = "sbti"
+    if family == "guidance" and "_GHG_" in stem:
+        family = "ghg_protocol"
+
+    is_vsme = bool(metadata.get("is_vsme")) or "VSME" in stem.upper()
+
+    return {
+        "family": family,
+        "year": year,
+        "file_type": file_type,
+        "is_vsme": is_vsme
+    }
+
+
+def filter_cache_key(filters: Dict[str, Any]) -> Tuple:
+    """Hashable representation of a filter dict."""
+    return tuple(
+        (key, tuple(sorted(value)) if isinstance(value, list) else value)
+        for key, value in sorted(filters.items())
+    )
+
+
+@dataclass
+class ChunkAttributeTable:
+    """Column-oriented attributes for every row of the corpus store."""
+    families: np.ndarray
+    years: np.ndarray
+    file_types: np.ndarray
+    is_vsme: np.ndarray
+    file_type_codes: List[str]
+
+    @classmethod
+    def from_documents(cls, documents: Dict[str, Dict], size: int) -> "ChunkAttributeTable":
+        """Broadcast per-document attributes to the rows each document occupies."""
+        families = np.zeros(size, dtype=np.int8)
+        years = np.full(size, UNKNOWN_YEAR, dtype=np.int16)
+        file_types = np.zeros(size, dtype=np.int8)
+        is_vsme = np.zeros(size, dtype=bool)
+        file_type_codes: List[str] = []
+
+        for document in documents.values():
+            attributes = parse_document_attributes(document["metadata"])
+            if attributes["file_type"] not in file_type_codes:
+                file_type_codes.append(attributes["file_type"])
+            start, end = document["rows"]
+            families[start:end] = DOCUMENT_FAMILIES.index(attributes["family"])
+            years[start:end] = attributes["year"]
+            file_types[start:end] = file_type_codes.index(attributes["file_type"])
+            is_vsme[start:end] = attributes["is_vsme"]
+
+        return cls(families, years, file_types, is_vsme, file_type_codes)
+
+    def evaluate(self, filters: Dict[str, Any]) -> Optional[np.ndarray]:
+        """
+        Evaluate a filter into a boolean row mask.
+
+        Supported keys: families, year_from, year_to, file_types, vsme_only.
+        Conditions are combined with AND, values inside a list with OR.
+        Returns None when the filter does not restrict anything.
+        """
+        mask = None
+
+        def combine(condition: np.ndarray) -> None:
+            nonlocal mask
+            mask = condition if mask is None else mask & condition
+
+        if filters.get("families"):
+            codes = [DOCUMENT_FAMILIES.index(f) for f in filters["families"] if f in DOCUMENT_FAMILIES]
+            combine(np.isin(self.families, codes))
+        if filters.get("year_from") is not None:
+            combine(self.years >= filters["year_from"])
+        if filters.get("year_to") is not None:
+            combine((self.years <= filters["year_to"]) & (self.years != UNKNOWN_YEAR))
+        if filters.get("file_types"):
+            wanted = {ft.lower() if ft.startswith(".") else f".{ft.lower()}" for ft in filters["file_types"]}
+            codes = [i for i, ft in enumerate(self.file_type_codes) if ft in wanted]
+            combine(np.isin(self.file_types, codes))
+        if filters.get("vsme_only"):
+            combine(self.is_vsme)
+
+        return mask
@@ -0,0 +1,107 @@
+"""
+Prometheus metrics of the RAG API.
+
+With several worker processes, set PROMETHEUS_MULTIPROC_DIR to an empty
+directory before the workers start; every worker then writes its samples there
+and /metrics aggregates all of them.
+"""
+import os
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+
+# Directory shared by the worker processes (read by prometheus_client at import)
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Buckets from sub-millisecond index lookups up to slow PDF pages and completions
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+STAGE_DURATION = Histogram(
+    "rag_stage_duration_seconds",
+    "Duration of RAG pipeline and ingestion stages",
+    ["stage"],
+    buckets=STAGE_BUCKETS
+)
+
+# HTTP requests, labelled with the route template so path parameters do not create new series
+HTTP_REQUESTS = Counter(
+    "http_requests_total",
+    "HTTP requests by route and status",
+    ["method", "route", "status"]
+)
+HTTP_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route",
+    ["method", "route"],
+    buckets=STAGE_BUCKETS
+)
+
+# OpenAI calls by purpose: expansion, embedding, completion, link_classification, summary
+OPENAI_REQUESTS = Counter(
+    "openai_requests_total",
+    "OpenAI API calls by purpose and outcome (ok, rate_limited, error)",
+    ["purpose", "outcome"]
+)
+OPENAI_DURATION = Histogram(
+    "openai_request_duration_seconds",
+    "OpenAI API call latency by purpose",
+    ["purpose"],
+    buckets=STAGE_BUCKETS
+)
+OPENAI_TOKENS = Counter(
+    "openai_tokens_total",
+    "Tokens reported by the OpenAI API by purpose and kind (prompt, completion)",
+    ["purpose", "kind"]
+)
+OPENAI_QUEUE_DEPTH = Gauge(
+    "openai_queue_depth",
+    "Requests waiting for rate-limit quota",
+    ["purpose"],
+    multiprocess_mode="livesum"
+)
+
+# Hit ratio = hits / (hits + misses)
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total",
+    "Cache lookups by cache (answer, filter_bitmap) and result (hit, miss)",
+    ["cache", "result"]
+)
+
+# Corpus loaded by the worker; all workers serve the same corpus
+CORPUS_DOCUMENTS = Gauge("corpus_documents", "Documents in the loaded corpus index", multiprocess_mode="livemax")
+CORPUS_CHUNKS = Gauge("corpus_chunks", "Chunks in the loaded corpus index", multiprocess_mode="livemax")
+CORPUS_VERSION = Gauge("corpus_version", "Version of the loaded corpus index", multiprocess_mode="livemax")
+INDEX_BYTES = Gauge(
+    "corpus_index_bytes",
+    "Memory held by the vector indexes (full, coarse)",
+    ["index"],
+    multiprocess_mode="livemax"
+)
+
+# Ingestion backlog
+PENDING_DOCUMENTS = Gauge(
+    "ingestion_pending_documents",
+    "Documents whose embeddings are missing or outdated",
+    multiprocess_mode="livemax"
+)
+EMBEDDING_BATCH_WAITING = Gauge(
+    "embedding_batch_waiting",
+    "Embedding inputs waiting to be coalesced into a batch",
+    multiprocess_mode="livesum"
+)
+
+
+def render_metrics() -> bytes:
+    """Render all metrics, aggregated across worker processes in multiprocess mode."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def mark_worker_stopped() -> None:
+    """Drop the live gauges of this process when a worker shuts down."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
+
@@ -0,0 +1,182 @@
+"""Shared, connection-pooled OpenAI client."""
+import os
+import heapq
+import asyncio
+import itertools
+import importlib.util
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    # The SDK takes about a second to import; it is loaded with the first client
+    from openai import AsyncOpenAI
+
+# Load environment variables
+load_dotenv()
+
+# Alternative API endpoint, e.g. a local OpenAI-compatible stub server
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+# Concurrent requests per purpose, so slow completions never starve embedding calls and vice versa
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "8"))
+COMPLETION_CONCURRENCY = int(os.getenv("COMPLETION_CONCURRENCY", "16"))
+# Slots of each budget that only interactive requests may use, so bulk work never fills all of them
+INTERACTIVE_RESERVED_SLOTS = int(os.getenv("INTERACTIVE_RESERVED_SLOTS", "2"))
+# Connection pool; by default large enough for both budgets at once
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", str(EMBEDDING_CONCURRENCY + COMPLETION_CONCURRENCY)))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", str(OPENAI_MAX_CONNECTIONS)))
+# Seconds an idle connection is kept open for reuse
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+# Timeouts in seconds; completions can take a while, connecting should not
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+# Retries performed by the SDK itself (connection errors, 429 and 5xx)
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+# "auto" uses HTTP/2 when the h2 package is installed (pip install "httpx[http2]")
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "auto").lower()
+
+# Request purposes with their own concurrency budget
+PURPOSES = ("embedding", "completion")
+
+# Priorities; lower values are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+_client: Optional["AsyncOpenAI"] = None
+_slots: Dict[str, "PrioritySlots"] = {}
+
+
+def _use_http2() -> bool:
+    if OPENAI_HTTP2 == "auto":
+        return importlib.util.find_spec("h2") is not None
+    return OPENAI_HTTP2 == "true"
+
+
+def create_openai_client(
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = OPENAI_BASE_URL,
+    max_connections: int = OPENAI_MAX_CONNECTIONS,
+    http2: Optional[bool] = None
+) -> "AsyncOpenAI":
+    """
+    Create an AsyncOpenAI client with an explicitly configured httpx pool.
+
+    Args:
+        api_key: API key, defaults to OPENAI_API_KEY
+        base_url: API endpoint, defaults to OPENAI_BASE_URL or the public API
+        max_connections: Upper bound of open connections
+        http2: Force HTTP/2 on or off, defaults to OPENAI_HTTP2
+
+    Returns:
+        Configured client
+    """
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY environment variable is not set")
+
+    import httpx
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient, Timeout
+
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=min(OPENAI_MAX_KEEPALIVE, max_connections),
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+        ),
+        http2=_use_http2() if http2 is None else http2
+    )
+    return AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        timeout=Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+        max_retries=OPENAI_MAX_RETRIES,
+        http_client=http_client
+    )
+
+
+def get_openai_client() -> "AsyncOpenAI":
+    """Shared client used for all OpenAI calls, created on first use."""
+    global _client
+    if _client is None:
+        _client = create_openai_client()
+    return _client
+
+
+class PrioritySlots:
+    """Concurrency limit that hands a free slot to the highest-priority waiter first."""
+
+    def __init__(self, limit: int, reserved: int = 0):
+        self.limit = limit
+        # Held back for interactive requests; at least one slot stays usable by bulk work
+        self.reserved = max(0, min(reserved, limit - 1))
+        self.in_use = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    def _available(self, priority: int) -> bool:
+        limit = self.limit if priority <= PRIORITY_INTERACTIVE else self.limit - self.reserved
+        return self.in_use < limit
+
+    def _wake(self) -> None:
+        # Bulk requests have the lower limit, so if the first waiter cannot run, none can
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                # Cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            if not self._available(priority):
+                return
+            heapq.heappop(self._waiters)
+            self.in_use += 1
+            future.set_result(None)
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """Wait for a slot; release it with release()."""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self._wake()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Cancelled after the slot was handed over: pass it on
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        self.in_use -= 1
+        self._wake()
+
+
+@asynccontextmanager
+async def openai_slot(purpose: str, priority: int = PRIORITY_INTERACTIVE) -> AsyncIterator[None]:
+    """
+    Hold one slot of the concurrency budget of a request purpose.
+
+    Waiting requests get free slots in priority order, and INTERACTIVE_RESERVED_SLOTS
+    of the budget are never given to bulk requests.
+
+    Usage:
+        async with openai_slot("completion"):
+            response = await get_openai_client().chat.completions.create(...)
+    """
+    if purpose not in PURPOSES:
+        raise ValueError(f"Unknown OpenAI request purpose: {purpose}")
+    slots = _slots.get(purpose)
+    if slots is None:
+        limit = EMBEDDING_CONCURRENCY if purpose == "embedding" else COMPLETION_CONCURRENCY
+        slots = _slots[purpose] = PrioritySlots(limit, INTERACTIVE_RESERVED_SLOTS)
+    await slots.acquire(priority)
+    try:
+        yield
+    finally:
+        slots.release()
+
+
+async def close_openai_client() -> None:
+    """Close the pooled connections of the shared client, e.g. on shutdown."""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
@@ -0,0 +1,387 @@
+"""Rate-limit-aware scheduling and batching of OpenAI requests."""
+import os
+import time
+import heapq
+import asyncio
+import itertools
+from contextvars import ContextVar, Token
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from functools import lru_cache
+import tiktoken
+from .openai_client import get_openai_client, openai_slot, PRIORITY_INTERACTIVE, PRIORITY_BULK
+from .timing import span
+from .metrics import OPENAI_REQUESTS, OPENAI_DURATION, OPENAI_TOKENS, OPENAI_QUEUE_DEPTH, EMBEDDING_BATCH_WAITING
+
+# Account quota per purpose (requests and tokens per minute)
+EMBEDDING_RPM = int(os.getenv("EMBEDDING_RPM", "3000"))
+EMBEDDING_TPM = int(os.getenv("EMBEDDING_TPM", "1000000"))
+COMPLETION_RPM = int(os.getenv("COMPLETION_RPM", "500"))
+COMPLETION_TPM = int(os.getenv("COMPLETION_TPM", "200000"))
+# Output tokens reserved for a completion without max_tokens; corrected from the reported usage
+COMPLETION_OUTPUT_ESTIMATE = int(os.getenv("COMPLETION_OUTPUT_ESTIMATE", "1000"))
+
+# Embedding requests waiting at the same time are sent as one request
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "128"))
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "64000"))
+# How long the first request of a batch waits for others to join, in milliseconds
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))
+
+# Attempts per request for rate limits and transient errors
+OPENAI_MAX_ATTEMPTS = int(os.getenv("OPENAI_MAX_ATTEMPTS", "5"))
+# Base of the exponential backoff when the server sends no hint
+RETRY_BACKOFF = 1.5
+
+# Tokenizer shared with the chunker and the prompt packer
+ENCODING_NAME = "cl100k_base"
+
+
+# Completion token usage of the current answer, by operation; None when not tracked
+_request_usage: ContextVar[Optional[Dict[str, Dict[str, int]]]] = ContextVar("request_usage", default=None)
+
+
+def start_usage_tracking() -> Token:
+    """Start collecting the token usage of chat completions made in this context and the tasks it starts."""
+    return _request_usage.set({})
+
+
+def tracked_usage() -> Dict[str, Dict[str, int]]:
+    """Usage collected since start_usage_tracking, by operation."""
+    return _request_usage.get() or {}
+
+
+def finish_usage_tracking(token: Token) -> None:
+    """Stop collecting usage."""
+    _request_usage.reset(token)
+
+
+@lru_cache(maxsize=None)
+def get_token_encoding() -> tiktoken.Encoding:
+    """
+    The tokenizer, loaded on first use.
+
+    Loading may download the encoding file, so it is not done at import; the
+    startup warm-up calls this in the background.
+    """
+    return tiktoken.get_encoding(ENCODING_NAME)
+
+
+def count_tokens(text: str) -> int:
+    """Number of tokens of a text."""
+    return len(get_token_encoding().encode(text))
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Backoff requested by the server via retry-after-ms or retry-after headers."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class TokenBucket:
+    """Continuously refilled bucket holding up to one minute of quota."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` is available; requests above capacity wait for a full bucket."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.level -= amount
+
+    def refund(self, amount: float) -> None:
+        """Return (or, if negative, additionally charge) quota after the actual usage is known."""
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimitScheduler:
+    """Admits requests of one purpose within RPM/TPM quota, highest priority first."""
+
+    def __init__(self, name: str, rpm: int, tpm: int):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.blocked_until = 0.0
+        self.throttled = 0
+        self._queue: List[Tuple[int, int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._changed = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    async def acquire(self, tokens: int, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """Wait until the request may be sent."""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._sequence), tokens, future))
+        OPENAI_QUEUE_DEPTH.labels(purpose=self.name).inc()
+        self._changed.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    def backoff(self, seconds: float) -> None:
+        """Hold back all requests of this purpose, e.g. after a 429 with retry-after."""
+        self.throttled += 1
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self._changed.set()
+
+    def record_usage(self, estimated: int, actual: int) -> None:
+        """Correct the token bucket once the response reports the tokens actually used."""
+        self.tokens.refund(estimated - actual)
+
+    async def _dispatch(self) -> None:
+        while self._queue:
+            priority, _, tokens, future = self._queue[0]
+            if future.done():
+                # Cancelled while waiting (e.g. the client disconnected)
+                heapq.heappop(self._queue)
+                OPENAI_QUEUE_DEPTH.labels(purpose=self.name).dec()
+                continue
+
+            wait = max(
+                self.blocked_until - time.monotonic(),
+                self.requests.wait_time(1),
+                self.tokens.wait_time(tokens)
+            )
+            if wait > 0:
+                # Wake up early when a higher-priority request arrives or the backoff changes
+                self._changed.clear()
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._queue)
+            OPENAI_QUEUE_DEPTH.labels(purpose=self.name).dec()
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+            future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and remaining quota."""
+        return {
+            "queued": sum(1 for *_, future in self._queue if not future.done()),
+            "queued_interactive": sum(
+                1 for priority, *_, future in self._queue if priority == PRIORITY_INTERACTIVE and not future.done()
+            ),
+            "requests_available": int(self.requests.level),
+            "tokens_available": int(self.tokens.level),
+            "throttled": self.throttled,
+            "blocked_for": max(self.blocked_until - time.monotonic(), 0.0)
+        }
+
+
+schedulers = {
+    "embedding": RateLimitScheduler("embedding", EMBEDDING_RPM, EMBEDDING_TPM),
+    "completion": RateLimitScheduler("completion", COMPLETION_RPM, COMPLETION_TPM),
+}
+
+
+async def run_scheduled(
+    purpose: str,
+    tokens: int,
+    priority: int,
+    call: Callable[[], Awaitable[Any]],
+    operation: Optional[str] = None
+) -> Any:
+    """
+    Send a request within quota, retrying rate limits and transient errors.
+
+    Args:
+        purpose: "embedding" or "completion"
+        tokens: Estimated tokens the request consumes
+        priority: PRIORITY_INTERACTIVE or PRIORITY_BULK
+        call: Issues the request; called once per attempt
+        operation: Metrics label of the call, e.g. "expansion" (defaults to purpose)
+
+    Returns:
+        The response of the first successful attempt
+    """
+    scheduler = schedulers[purpose]
+    operation = operation or purpose
+    attempt = 0
+    while True:
+        with span(f"openai_{purpose}_wait"):
+            await scheduler.acquire(tokens, priority)
+        started = time.perf_counter()
+        try:
+            async with openai_slot(purpose, priority):
+                with span(f"openai_{purpose}", attempt=attempt):
+                    response = await call()
+            OPENAI_REQUESTS.labels(purpose=operation, outcome="ok").inc()
+            OPENAI_DURATION.labels(purpose=operation).observe(time.perf_counter() - started)
+            return response
+        except Exception as e:
+            # The SDK was imported when the client was created, this only looks it up
+            import openai
+            if isinstance(e, openai.RateLimitError):
+                OPENAI_REQUESTS.labels(purpose=operation, outcome="rate_limited").inc()
+                if getattr(e, "code", None) == "insufficient_quota":
+                    raise
+                delay = retry_after_seconds(e) or RETRY_BACKOFF ** (attempt + 1)
+                scheduler.backoff(delay)
+            elif isinstance(e, (openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)):
+                OPENAI_REQUESTS.labels(purpose=operation, outcome="error").inc()
+                delay = RETRY_BACKOFF ** (attempt + 1)
+            else:
+                OPENAI_REQUESTS.labels(purpose=operation, outcome="error").inc()
+                raise
+            error = e
+
+        attempt += 1
+        if attempt >= OPENAI_MAX_ATTEMPTS:
+            print(f"OpenAI {purpose} request failed after {attempt} attempts: {str(error)}")
+            raise error
+        print(f"OpenAI {purpose} API error: {str(error)}. Retrying in {delay:.1f} seconds...")
+        await asyncio.sleep(delay)
+
+
+async def chat_completion(priority: int = PRIORITY_INTERACTIVE, operation: str = "completion", **params: Any) -> Any:
+    """
+    Create a chat completion through the completion scheduler.
+
+    Args:
+        priority: PRIORITY_INTERACTIVE or PRIORITY_BULK
+        operation: Metrics label of the call ("completion", "expansion", "link_classification")
+        **params: Arguments of chat.completions.create (model, messages, temperature, ...)
+
+    Returns:
+        The ChatCompletion response
+    """
+    prompt_tokens = sum(count_tokens(message.get("content") or "") + 4 for message in params["messages"])
+    estimated = prompt_tokens + (params.get("max_tokens") or COMPLETION_OUTPUT_ESTIMATE)
+    # Retries are handled by the scheduler so backoff hints apply to every waiting request
+    client = get_openai_client().with_options(max_retries=0)
+    response = await run_scheduled(
+        "completion", estimated, priority, lambda: client.chat.completions.create(**params), operation
+    )
+    if getattr(response, "usage", None) is not None:
+        schedulers["completion"].record_usage(estimated, response.usage.total_tokens)
+        OPENAI_TOKENS.labels(purpose=operation, kind="prompt").inc(response.usage.prompt_tokens)
+        OPENAI_TOKENS.labels(purpose=operation, kind="completion").inc(response.usage.completion_tokens)
+        usage = _request_usage.get()
+        if usage is not None:
+            totals = usage.setdefault(operation, {"prompt_tokens": 0, "completion_tokens": 0})
+            totals["prompt_tokens"] += response.usage.prompt_tokens
+            totals["completion_tokens"] += response.usage.completion_tokens
+    return response
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrently waiting embedding requests into batched API calls."""
+
+    def __init__(self):
+        self._pending: Dict[Tuple[str, Optional[int], int], List[Tuple[str, int, asyncio.Future]]] = {}
+        self._pending_tokens: Dict[Tuple[str, Optional[int], int], int] = {}
+        self._timers: Dict[Tuple[str, Optional[int], int], asyncio.TimerHandle] = {}
+        self._tasks: set = set()
+        self.requests = 0
+        self.batches = 0
+
+    async def embed(self, text: str, model: str, dimensions: Optional[int] = None, priority: int = PRIORITY_INTERACTIVE) -> List[float]:
+        """Embed one text, sharing the API request with others of the same model, size and priority."""
+        loop = asyncio.get_running_loop()
+        key = (model, dimensions, priority)
+        future = loop.create_future()
+        tokens = count_tokens(text)
+
+        batch = self._pending.setdefault(key, [])
+        batch.append((text, tokens, future))
+        self._pending_tokens[key] = self._pending_tokens.get(key, 0) + tokens
+        self.requests += 1
+        EMBEDDING_BATCH_WAITING.inc()
+
+        if len(batch) >= EMBEDDING_BATCH_SIZE or self._pending_tokens[key] >= EMBEDDING_BATCH_TOKENS:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(EMBEDDING_BATCH_WINDOW_MS / 1000, self._flush, key)
+        return await future
+
+    def _flush(self, key: Tuple[str, Optional[int], int]) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, [])
+        self._pending_tokens.pop(key, None)
+        EMBEDDING_BATCH_WAITING.dec(len(batch))
+        if batch:
+            task = asyncio.create_task(self._send(key, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, key: Tuple[str, Optional[int], int], batch: List[Tuple[str, int, asyncio.Future]]) -> None:
+        model, dimensions, priority = key
+        params: Dict[str, Any] = {"input": [text for text, _, _ in batch], "model": model}
+        if dimensions:
+            params["dimensions"] = dimensions
+        client = get_openai_client().with_options(max_retries=0)
+        self.batches += 1
+        try:
+            response = await run_scheduled(
+                "embedding", sum(tokens for _, tokens, _ in batch), priority,
+                lambda: client.embeddings.create(**params)
+            )
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        if getattr(response, "usage", None) is not None:
+            OPENAI_TOKENS.labels(purpose="embedding", kind="prompt").inc(response.usage.prompt_tokens)
+        for item in response.data:
+            if 0 <= item.index < len(batch) and not batch[item.index][2].done():
+                batch[item.index][2].set_result(item.embedding)
+        # A short or partial response must not leave the other callers waiting forever
+        missing = sum(1 for _, _, future in batch if not future.done())
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(RuntimeError(
+                    f"Embedding response is missing {missing} of {len(batch)} inputs"
+                ))
+
+    def stats(self) -> Dict[str, Any]:
+        """Coalescing effectiveness."""
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "waiting": sum(len(batch) for batch in self._pending.values())
+        }
+
+
+# Global instance
+embedding_batcher = EmbeddingBatcher()
+
+
+def scheduler_stats() -> Dict[str, Any]:
+    """Per-purpose scheduler state and embedding batching statistics."""
+    return {
+        **{purpose: scheduler.stats() for purpose, scheduler in schedulers.items()},
+        "embedding_batches": embedding_batcher.stats()
+    }
@@ -1,45 +1,70 @@
 """RAG (Retrieval Augmented Generation) using OpenAI and FAISS."""
 import os
 from typing import Dict, List, Optional, Any
-from openai import AsyncOpenAI
 from dotenv import load_dotenv
 import threading
 from concurrent.futures import ThreadPoolExecutor
 import asyncio
-from .embeddings import search_embeddings, search_all_documents
+from .embeddings import search_embeddings, search_all_documents, get_embedding, rescore_chunks
+from .vector_store import HYBRID_SEARCH, get_corpus_index
+from .bm25 import RRF_K
+from .answer_cache import answer_cache, cache_scope, ANSWER_CACHE_ENABLED
+from .reranker import rerank_chunks, RERANK_ENABLED, RERANK_CANDIDATE_FACTOR
 from .link_detector import link_detector
+from .openai_scheduler import chat_completion, start_usage_tracking, tracked_usage, finish_usage_tracking
+from .context_packer import pack_prompt
+from .timing import span
 
 # Load environment variables
 load_dotenv()
 
-# Get OpenAI API key
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("OPENAI_API_KEY environment variable is not set")
-
-# Initialize Async OpenAI client
-client = AsyncOpenAI(api_key=api_key)
+# OPENAI_API_KEY is only required once a completion is requested (see openai_client)
 
 # Default model for completions
 COMPLETION_MODEL = "gpt-4.1-mini-2025-04-14"
 # Model for query expansion (can use a smaller/faster model)
 EXPANSION_MODEL = "gpt-4.1-mini-2025-04-14"
+# Number of LLM-generated query variants; the BM25 pass of hybrid search covers
+# exact tokens (article numbers, ESRS codes, CAS numbers), so fewer are needed
+QUERY_EXPANSIONS = int(os.getenv("QUERY_EXPANSIONS", "1" if HYBRID_SEARCH else "4"))
+# Whether chat follow-ups search the previous turn's documents instead of the whole corpus
+FOLLOWUP_REUSE_ENABLED = os.getenv("FOLLOWUP_REUSE_ENABLED", "true").lower() == "true"
+# Minimum cosine similarity between a follow-up and one of the previous chunks to reuse them
+FOLLOWUP_SIMILARITY_THRESHOLD = float(os.getenv("FOLLOWUP_SIMILARITY_THRESHOLD", "0.45"))
 
-def format_context(chunks: List[Dict]) -> str:
-    """Format retrieved chunks into a context string."""
-    if not chunks:
-        return ""
-    
-    formatted_chunks = []
-    for i, chunk in enumerate(chunks):
-        metadata = chunk.get('metadata', 'Unknown source')
-        source = metadata.get('filename', 'Unknown source')
-        formatted_chunks.append(f"[Chunk {i+1} - Source: {source}]\n{chunk['text']}\n")
-    
-    return "\n".join(formatted_chunks)
+def rank_key(chunk: Dict) -> float:
+    """Sort key for retrieved chunks: rerank score, then fused score, then L2 distance."""
+    if "rerank_score" in chunk:
+        return -chunk["rerank_score"]
+    if "fusion_score" in chunk:
+        return -chunk["fusion_score"]
+    return chunk.get("score", float('inf'))
 
-async def expand_query(query: str, num_expansions: int = 4) -> List[str]:
+def merge_seeds(seeds: List[Dict], chunks: List[Dict]) -> List[Dict]:
+    """
+    Merge follow-up seeds (see rescore_chunks) into search results, on the results' scale.
+
+    Hybrid results are ranked by fused score, so the seeds, ranked by similarity,
+    are fused in as one more ranked list. Vector-only results share the seeds'
+    L2 scale and are merged as they are.
+    """
+    if not any("fusion_score" in chunk for chunk in chunks):
+        return seeds + chunks
+    ranked = sorted(seeds, key=lambda seed: seed["similarity"], reverse=True)
+    shares = {seed["chunk_id"]: 1.0 / (RRF_K + rank + 1) for rank, seed in enumerate(ranked)}
+    merged = [
+        {**chunk, "fusion_score": chunk.get("fusion_score", 0.0) + shares[chunk["chunk_id"]]}
+        if chunk["chunk_id"] in shares else chunk
+        for chunk in chunks
+    ]
+    found = {chunk["chunk_id"] for chunk in chunks}
+    merged += [{**seed, "fusion_score": shares[seed["chunk_id"]]} for seed in ranked if seed["chunk_id"] not in found]
+    return merged
+
+async def expand_query(query: str, num_expansions: int = QUERY_EXPANSIONS) -> List[str]:
     """Generate expanded queries to improve retrieval."""
+    if num_expansions <= 0:
+        return []
     try:
         messages = [
             {"role": "system", "content": (
@@ -55,10 +80,11 @@ async def expand_query(query: str, num_expansions: int = 4) -> List[str]:
             {"role": "user", "content": f"Original query: '{query}'\n\nGenerate {num_expansions} alternative queries."}
         ]
         
-        response = await client.chat.completions.create(
+        response = await chat_completion(
             model=EXPANSION_MODEL,
             messages=messages,
-            temperature=0.7
+            temperature=0.7,
+            operation="expansion"
         )
         expanded_text = response.choices[0].message.content.strip()
         
@@ -101,6 +127,19 @@ def search_with_query(q: str, top_k: int) -> List[Dict]:
     # return await search_all_documents(q, top_k)
     pass # Or raise NotImplementedError
 
+def usage_report(context_usage: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Token usage of the completions made for the current answer."""
+    by_operation = tracked_usage()
+    prompt_tokens = sum(usage["prompt_tokens"] for usage in by_operation.values())
+    completion_tokens = sum(usage["completion_tokens"] for usage in by_operation.values())
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "by_operation": {operation: dict(usage) for operation, usage in by_operation.items()},
+        "context": context_usage or {}
+    }
+
 async def generate_answer(
     query: str,
     conversation_history: Optional[str] = None,
@@ -108,26 +147,87 @@ async def generate_answer(
     model: str = COMPLETION_MODEL,
     temperature: float = 0.0,
     meta_information: Optional[str] = None,
-    user_onace_code: str = "0"
+    user_onace_code: str = "0",
+    filters: Optional[Dict[str, Any]] = None,
+    previous_chunk_ids: Optional[List[str]] = None
 ) -> Dict[str, Any]:
-    """Generate an answer using RAG."""
+    """
+    Generate an answer using RAG.
+
+    With `previous_chunk_ids` (the chunks of the previous chat turn), a follow-up
+    that is still similar to one of them skips query expansion and only searches
+    their documents; otherwise the whole corpus is searched as usual.
+    """
+    usage_token = start_usage_tracking()
     try:
-        # First, expand the query to improve retrieval
-        expanded_queries = await expand_query(query)
+        # Paraphrases of recent questions are answered from the semantic cache
+        query_embedding = None
+        scope = None
+        if ANSWER_CACHE_ENABLED:
+            with span("query_embedding"):
+                query_embedding = await get_embedding(query)
+            corpus = await get_corpus_index()
+            scope = cache_scope(
+                user_onace_code=user_onace_code,
+                model=model,
+                temperature=temperature,
+                top_k=top_k,
+                corpus_version=corpus.version,
+                filters=filters,
+                conversation_history=conversation_history,
+                meta_information=meta_information
+            )
+            with span("cache_lookup"):
+                cached = answer_cache.get(scope, query_embedding)
+            if cached is not None:
+                return {**cached, "cached": True, "usage": usage_report()}
+        
+        # Follow-ups usually concern the previous turn's sources: re-score those chunks
+        # and, if the question still matches them, stay within their documents
+        seeds: List[Dict] = []
+        document_ids = None
+        if FOLLOWUP_REUSE_ENABLED and previous_chunk_ids:
+            if query_embedding is None:
+                with span("query_embedding"):
+                    query_embedding = await get_embedding(query)
+            with span("followup_seed"):
+                seeds = await rescore_chunks(previous_chunk_ids, query_embedding, user_onace_code, filters)
+            if seeds and max(seed["similarity"] for seed in seeds) >= FOLLOWUP_SIMILARITY_THRESHOLD:
+                document_ids = sorted({seed["document_id"] for seed in seeds})
+            else:
+                seeds = []
+        retrieval_mode = "followup" if document_ids is not None else "full"
+        
+        # First, expand the query to improve retrieval (not needed within known documents)
+        expanded_queries = []
+        if document_ids is None:
+            with span("query_expansion"):
+                expanded_queries = await expand_query(query)
         
         # Include original query in the search
         search_queries = [query] + expanded_queries
         
-        # Search for relevant chunks concurrently with ÖNACE filtering
-        search_tasks = [search_all_documents(eq, top_k, user_onace_code) for eq in search_queries]
-        list_of_chunk_lists = await asyncio.gather(*search_tasks)
+        # Retrieve a wider candidate set when a reranking stage follows
+        candidate_k = top_k * RERANK_CANDIDATE_FACTOR if RERANK_ENABLED else top_k
+        
+        # Search for relevant chunks concurrently with ÖNACE and metadata filtering
+        search_tasks = [
+            search_all_documents(
+                eq, candidate_k, user_onace_code, filters=filters,
+                query_embedding=query_embedding if eq == query else None,
+                document_ids=document_ids
+            )
+            for eq in search_queries
+        ]
+        with span("retrieval", mode=retrieval_mode):
+            list_of_chunk_lists = await asyncio.gather(*search_tasks)
         
         # Flatten the list of lists
-        all_chunks = [chunk for sublist in list_of_chunk_lists for chunk in sublist]
+        all_chunks = merge_seeds(seeds, [chunk for sublist in list_of_chunk_lists for chunk in sublist])
 
         # Remove duplicates (use the existing deduplicate_chunks function)
         # Sort by score before deduplicating to keep the best score for duplicates
-        all_chunks.sort(key=lambda x: x.get("score", float('inf')))
+        all_chunks.sort(key=rank_key)
         unique_chunks_dict = {}
         for chunk in all_chunks:
             # Deduplicate based on text content to avoid near-identical chunks from different queries
@@ -136,23 +236,24 @@ async def generate_answer(
                  unique_chunks_dict[text_key] = chunk
         unique_chunks = list(unique_chunks_dict.values()) 
         
+        # Rerank locally on CPU to improve precision and push near-duplicates down
+        if RERANK_ENABLED:
+            with span("rerank"):
+                unique_chunks = await asyncio.to_thread(rerank_chunks, query, unique_chunks)
+        
         # Prioritize VSME chunks and sort by relevance
         # First, separate VSME chunks from others
         vsme_chunks = [chunk for chunk in unique_chunks if chunk.get("metadata", {}).get("is_vsme", False)]
         other_chunks = [chunk for chunk in unique_chunks if not chunk.get("metadata", {}).get("is_vsme", False)]
         
         # Sort both groups by score
-        vsme_chunks.sort(key=lambda x: x.get("score", float('inf')))
-        other_chunks.sort(key=lambda x: x.get("score", float('inf')))
+        vsme_chunks.sort(key=rank_key)
+        other_chunks.sort(key=rank_key)
         
         # Prioritize VSME chunks: take up to 50% from VSME, rest from others
         vsme_limit = max(1, top_k // 2)  # At least 1 VSME chunk if available
         top_unique_chunks = vsme_chunks[:vsme_limit] + other_chunks[:top_k - vsme_limit]
 
-        # Format context from the top unique chunks
-        context = format_context(top_unique_chunks)
-        print(context)
-        
         # Build the prompt with VSME prioritization
         system_prompt = """You are an expert assistant specialized in sustainability reporting, regulations, and technical standards, with VSME (EU 2025/1710) as the primary reference document.
 
@@ -204,9 +305,15 @@ async def generate_answer(
         if meta_information and meta_information.strip():
             system_prompt += f"\n\nAdditional context from the user:\n{meta_information}"
         
+        # Fit history and chunks into the token budget: oldest turns go first, repeated chunk text is cut
+        packed = pack_prompt(system_prompt, query, top_unique_chunks, conversation_history)
+        top_unique_chunks = packed.chunks
+        context = packed.context
+        print(context)
+        
         # Add conversation history if available
-        if conversation_history:
-            system_prompt += f"\n\nPrevious conversation:\n{conversation_history}\n\nPlease consider the previous conversation when answering the current question."
+        if packed.conversation_history:
+            system_prompt += f"\n\nPrevious conversation:\n{packed.conversation_history}\n\nPlease consider the previous conversation when answering the current question."
         
         messages = [
             {"role": "system", "content": system_prompt},
@@ -215,23 +322,30 @@ async def generate_answer(
         ]
         
         # Generate response
-        response = await client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature
-        )
+        with span("completion", model=model):
+            response = await chat_completion(
+                model=model,
+                messages=messages,
+                temperature=temperature
+            )
         
         # Get relevant links based on query, chunks, and industry selection using AI
-        relevant_links = await link_detector.get_relevant_links(query, top_unique_chunks, user_onace_code)
+        with span("link_detection"):
+            relevant_links = await link_detector.get_relevant_links(query, top_unique_chunks, user_onace_code)
         
-        return {
+        result = {
             "answer": response.choices[0].message.content,
             "chunks": top_unique_chunks,
             "expanded_queries": expanded_queries,
             "sources": [chunk.get("metadata", {}).get("filename", "Unknown source") for chunk in top_unique_chunks],
             "relevant_links": relevant_links,
+            "usage": usage_report(packed.usage),
+            "retrieval_mode": retrieval_mode,
             "success": True
         }
+        if scope is not None:
+            answer_cache.put(scope, query_embedding, result)
+        return result
         
     except Exception as e:
         print(f"Error generating answer: {e}")
@@ -241,6 +355,9 @@ async def generate_answer(
             "expanded_queries": [],
             "sources": [],
             "relevant_links": [],
+            "usage": usage_report(),
             "success": False
-        } 
+        }
+    finally:
+        finish_usage_tracking(usage_token) 
 
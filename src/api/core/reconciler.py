@@ -0,0 +1,179 @@
+"""Background reconciliation of documents that are missing embeddings."""
+import os
+import time
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+from .corpus_manifest import get_manifest, file_lock, ingestion_claim, EMBEDDINGS_DIR
+from .embeddings import repair_document
+from .answer_cache import answer_cache
+
+# Whether the reconciler loop is started with the application
+RECONCILE_ENABLED = os.getenv("RECONCILE_ENABLED", "true").lower() == "true"
+# Seconds between reconciliation passes when nothing triggers one earlier
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "300"))
+# Documents repaired concurrently; each one parses a file and calls the embeddings API
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", "2"))
+# Failed attempts after which a document is only retried on an explicit request
+RECONCILE_MAX_ATTEMPTS = int(os.getenv("RECONCILE_MAX_ATTEMPTS", "5"))
+# Delay before retrying a failed document, doubled with every further failure
+RECONCILE_BACKOFF = float(os.getenv("RECONCILE_BACKOFF", "60"))
+# Lock file held during a pass, so only one worker process repairs the pending documents
+RECONCILE_LOCK_PATH = EMBEDDINGS_DIR / "reconcile.lock"
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class EmbeddingReconciler:
+    """Repairs the manifest's pending documents outside the request path."""
+
+    def __init__(self, interval: float = RECONCILE_INTERVAL, concurrency: int = RECONCILE_CONCURRENCY):
+        self.interval = interval
+        self.concurrency = concurrency
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._pass_lock = asyncio.Lock()
+        self.in_progress: Dict[str, str] = {}
+        self.failures: Dict[str, Dict[str, Any]] = {}
+        self.repaired = 0
+        self.passes = 0
+        self.last_pass_started: Optional[str] = None
+        self.last_pass_finished: Optional[str] = None
+
+    def start(self) -> None:
+        """Start the periodic loop on the running event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Cancel the loop; a document being embedded is abandoned and stays pending."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def trigger(self) -> None:
+        """Request a pass as soon as possible, e.g. when a query saw missing embeddings."""
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                print(f"Embedding reconciliation failed: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _is_due(self, document_id: str, now: float) -> bool:
+        failure = self.failures.get(document_id)
+        if failure is None:
+            return True
+        return failure["attempts"] < RECONCILE_MAX_ATTEMPTS and failure["retry_at"] <= now
+
+    async def _repair(self, semaphore: asyncio.Semaphore, document_id: str, filename: str) -> Optional[bool]:
+        """Repair one document; None when it was skipped because it is (or was just) embedded elsewhere."""
+        async with semaphore:
+            with ingestion_claim(document_id) as claimed:
+                # An upload holding the claim embeds the document itself; once it
+                # released it, the document may no longer be pending
+                if not claimed or document_id not in (await asyncio.to_thread(get_manifest))["pending"]:
+                    return None
+                self.in_progress[document_id] = filename
+                try:
+                    result = await repair_document(document_id, filename)
+                except Exception as e:
+                    result = {"success": False, "error": str(e)}
+                finally:
+                    self.in_progress.pop(document_id, None)
+
+        if result.get("success"):
+            self.failures.pop(document_id, None)
+            self.repaired += 1
+            return True
+
+        attempts = self.failures.get(document_id, {}).get("attempts", 0) + 1
+        self.failures[document_id] = {
+            "filename": filename,
+            "attempts": attempts,
+            "last_error": result.get("error"),
+            "retry_at": time.monotonic() + RECONCILE_BACKOFF * 2 ** (attempts - 1)
+        }
+        print(f"Failed to create embeddings for {document_id} (attempt {attempts}): {result.get('error')}")
+        return False
+
+    async def reconcile(self, force: bool = False) -> Dict[str, Any]:
+        """
+        Run one pass over the pending documents.
+
+        Args:
+            force: Also retry documents that are backing off or exhausted their attempts
+
+        Returns:
+            Dict with the number of repaired and failed documents of this pass
+        """
+        async with self._pass_lock:
+            with file_lock(RECONCILE_LOCK_PATH, blocking=False) as acquired:
+                if not acquired:
+                    return {
+                        "message": "Another worker is processing the pending documents",
+                        "failed_documents": [],
+                        "skipped_documents": []
+                    }
+
+                self.last_pass_started = _now()
+                pending = (await asyncio.to_thread(get_manifest))["pending"]
+                now = time.monotonic()
+                due = {doc_id: filename for doc_id, filename in pending.items() if force or self._is_due(doc_id, now)}
+
+                semaphore = asyncio.Semaphore(self.concurrency)
+                outcomes = await asyncio.gather(
+                    *(self._repair(semaphore, doc_id, filename) for doc_id, filename in due.items())
+                )
+                results = dict(zip(due, outcomes))
+                repaired = sum(1 for ok in outcomes if ok)
+                failed = [doc_id for doc_id, ok in results.items() if ok is False]
+                if repaired:
+                    answer_cache.clear()
+
+                self.passes += 1
+                self.last_pass_finished = _now()
+                if due:
+                    print(f"Background embedding repair: repaired {repaired} of {len(due)} documents")
+                return {
+                    "message": f"Processed {repaired} documents. Failed: {len(failed)}",
+                    "failed_documents": failed,
+                    # Not due yet, or being embedded by an upload
+                    "skipped_documents": [doc_id for doc_id in pending if results.get(doc_id) is None]
+                }
+
+    async def status(self) -> Dict[str, Any]:
+        """Reconciliation progress for the health endpoint."""
+        # Reading the manifest may parse or even bootstrap it; keep that off the event loop
+        pending = (await asyncio.to_thread(get_manifest))["pending"]
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "pending": len(pending),
+            "in_progress": list(self.in_progress),
+            "repaired": self.repaired,
+            "failed": {
+                doc_id: {key: value for key, value in failure.items() if key != "retry_at"}
+                for doc_id, failure in self.failures.items()
+                if doc_id in pending
+            },
+            "passes": self.passes,
+            "last_pass_started": self.last_pass_started,
+            "last_pass_finished": self.last_pass_finished
+        }
+
+
+# Global instance
+reconciler = EmbeddingReconciler()
@@ -0,0 +1,88 @@
+"""Lightweight local reranking of retrieved chunks."""
+import os
+import time
+from typing import Dict, List, Set
+from .bm25 import tokenize
+
+# Whether generate_answer reranks a wider candidate set before truncating to top_k
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "true").lower() == "true"
+# Candidates retrieved per requested chunk when reranking is enabled
+RERANK_CANDIDATE_FACTOR = int(os.getenv("RERANK_CANDIDATE_FACTOR", "4"))
+# Candidates scored per batch; the latency budget is checked between batches
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+# Time budget for the whole reranking stage in milliseconds
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "50"))
+# Weight of the retrieval order versus query term coverage in the relevance score
+RETRIEVAL_PRIOR_WEIGHT = 0.3
+# MMR trade-off between relevance (1.0) and novelty (0.0)
+MMR_LAMBDA = 0.6
+
+
+def _relevance(query_terms: Set[str], chunk_terms: Set[str], rank: int, total: int) -> float:
+    """Blend the incoming retrieval rank with the share of query terms the chunk covers."""
+    prior = 1.0 - rank / max(total, 1)
+    coverage = len(query_terms & chunk_terms) / len(query_terms) if query_terms else 0.0
+    return RETRIEVAL_PRIOR_WEIGHT * prior + (1 - RETRIEVAL_PRIOR_WEIGHT) * coverage
+
+
+def _similarity(a: Set[str], b: Set[str]) -> float:
+    """Jaccard similarity of two token sets."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def rerank_chunks(query: str, chunks: List[Dict], budget_ms: float = RERANK_BUDGET_MS) -> List[Dict]:
+    """
+    Rerank chunks by lexical relevance and suppress near-duplicates (MMR).
+
+    Args:
+        query: User's query
+        chunks: Candidates in retrieval order (best first)
+        budget_ms: Latency budget; candidates not scored in time keep their retrieval order
+
+    Returns:
+        All chunks reordered, each with a `rerank_score` (higher is better)
+    """
+    if len(chunks) <= 1:
+        return [dict(chunk, rerank_score=1.0) for chunk in chunks]
+
+    deadline = time.perf_counter() + budget_ms / 1000
+    query_terms = {term for term in tokenize(query) if len(term) > 1}
+    total = len(chunks)
+
+    # Score candidates in batches so the budget can cut the tail short
+    token_sets: List[Set[str]] = []
+    relevance: List[float] = []
+    for batch_start in range(0, total, RERANK_BATCH_SIZE):
+        if batch_start and time.perf_counter() > deadline:
+            break
+        for rank in range(batch_start, min(batch_start + RERANK_BATCH_SIZE, total)):
+            terms = set(tokenize(chunks[rank].get("text", "")))
+            token_sets.append(terms)
+            relevance.append(_relevance(query_terms, terms, rank, total))
+
+    scored = len(relevance)
+    remaining = list(range(scored))
+    selected: List[int] = []
+
+    # Greedy MMR: prefer relevant chunks that differ from those already selected
+    while remaining:
+        if time.perf_counter() > deadline:
+            selected.extend(sorted(remaining, key=lambda i: relevance[i], reverse=True))
+            break
+        best, best_score = remaining[0], float("-inf")
+        for i in remaining:
+            redundancy = max((_similarity(token_sets[i], token_sets[j]) for j in selected), default=0.0)
+            score = MMR_LAMBDA * relevance[i] - (1 - MMR_LAMBDA) * redundancy
+            if score > best_score:
+                best, best_score = i, score
+        selected.append(best)
+        remaining.remove(best)
+
+    # Candidates not scored in time keep their retrieval order at the end
+    order = selected + list(range(scored, total))
+    return [
+        dict(chunks[i], rerank_score=(total - position) / total)
+        for position, i in enumerate(order)
+    ]
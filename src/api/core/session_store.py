@@ -0,0 +1,221 @@
+"""Server-side chat sessions: history, summary and the previous turn's chunks."""
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from .conversation_memory import ConversationSummary
+
+# "memory" keeps sessions in this process only, "sqlite" also persists them to SESSION_DB_PATH
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()
+SESSION_DB_PATH = Path(os.getenv("SESSION_DB_PATH", "./data/sessions.sqlite3"))
+# Sessions idle for longer than this are dropped
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+# Number of sessions kept in memory (the SQLite backend keeps all of them)
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "2000"))
+# Seconds between removals of expired sessions from the database
+SESSION_PRUNE_INTERVAL = 600
+# Attempts of an update that keeps losing to concurrent saves of the same session
+SESSION_UPDATE_ATTEMPTS = 10
+
+
+@dataclass
+class Session:
+    """Conversation state kept between chat requests."""
+    session_id: str
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    summary: Optional[ConversationSummary] = None
+    previous_chunk_ids: List[str] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Session":
+        summary = data.get("summary")
+        return cls(**{**data, "summary": ConversationSummary(**summary) if summary else None})
+
+
+class SessionStore:
+    """
+    LRU cache of sessions, optionally written through to SQLite.
+
+    With SQLite, the database is authoritative: several workers share it, so a
+    cached session is only used while its row is unchanged, and updates are
+    only written if the row is still the one they were based on.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[Path] = SESSION_DB_PATH if SESSION_BACKEND == "sqlite" else None,
+        ttl: int = SESSION_TTL,
+        max_size: int = SESSION_CACHE_SIZE
+    ):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_size = max_size
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._pruned_at = 0.0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._db.commit()
+        return self._db
+
+    def _db_load(self, session_id: str, cached: Optional[Session] = None) -> Optional[Session]:
+        # The data is only transferred and parsed when the row differs from the cached copy
+        with self._db_lock:
+            row = self._connection().execute(
+                "SELECT CASE WHEN updated_at = ? THEN NULL ELSE data END FROM sessions WHERE session_id = ? AND updated_at >= ?",
+                (cached.updated_at if cached else None, session_id, time.time() - self.ttl)
+            ).fetchone()
+        if row is None:
+            return None
+        return cached if row[0] is None else Session.from_dict(json.loads(row[0]))
+
+    def _db_save(self, session: Session, expected: Optional[float] = None, check: bool = False) -> bool:
+        # With check, the row must still have updated_at == expected (None: no live row), else nothing is written
+        with self._db_lock:
+            db = self._connection()
+            data = json.dumps(session.to_dict())
+            if not check:
+                saved = db.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?)",
+                    (session.session_id, data, session.updated_at)
+                ).rowcount > 0
+            elif expected is None:
+                # A row may still exist for an expired session; it is replaced like a missing one
+                saved = db.execute(
+                    "INSERT INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT (session_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at "
+                    "WHERE sessions.updated_at < ?",
+                    (session.session_id, data, session.updated_at, time.time() - self.ttl)
+                ).rowcount > 0
+            else:
+                saved = db.execute(
+                    "UPDATE sessions SET data = ?, updated_at = ? WHERE session_id = ? AND updated_at = ?",
+                    (data, session.updated_at, session.session_id, expected)
+                ).rowcount > 0
+            if time.time() - self._pruned_at > SESSION_PRUNE_INTERVAL:
+                db.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+                self._pruned_at = time.time()
+            db.commit()
+        return saved
+
+    def _db_delete(self, session_id: str) -> bool:
+        with self._db_lock:
+            db = self._connection()
+            deleted = db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount > 0
+            db.commit()
+        return deleted
+
+    def _cache(self, session: Session) -> None:
+        self._sessions[session.session_id] = session
+        self._sessions.move_to_end(session.session_id)
+        while len(self._sessions) > self.max_size:
+            self._sessions.popitem(last=False)
+
+    def new(self, session_id: Optional[str] = None) -> Session:
+        """Create a session (not stored until saved)."""
+        return Session(session_id=session_id or uuid.uuid4().hex)
+
+    async def get(self, session_id: str) -> Optional[Session]:
+        """Get a session that has not expired."""
+        if self.db_path is not None:
+            # Another worker may have saved newer turns or deleted the session
+            session = await asyncio.to_thread(self._db_load, session_id, self._sessions.get(session_id))
+            if session is None:
+                self._sessions.pop(session_id, None)
+            else:
+                self._cache(session)
+            return session
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if time.time() - session.updated_at > self.ttl:
+            del self._sessions[session_id]
+            return None
+        self._sessions.move_to_end(session_id)
+        return session
+
+    async def save(self, session: Session) -> None:
+        """Store a session unconditionally, persisting it with the SQLite backend (see update)."""
+        session.updated_at = time.time()
+        self._cache(session)
+        if self.db_path is not None:
+            await asyncio.to_thread(self._db_save, session)
+
+    async def update(
+        self,
+        session_id: str,
+        apply: Callable[[Session], bool],
+        create: bool = True
+    ) -> Optional[Session]:
+        """
+        Change the current state of a session without losing concurrent changes.
+
+        The change is applied to a copy of the session as stored and saved only
+        if no other request (possibly on another worker) saved it meanwhile;
+        otherwise it is applied again to the newer state. Nothing is held while
+        the caller prepares the change, e.g. while an answer is generated.
+
+        Args:
+            session_id: The session
+            apply: Changes the session in place; returns False to leave it unsaved
+            create: Whether to start a new session if none is stored
+
+        Returns:
+            The session after the update, or None if it did not exist and create is False
+        """
+        for attempt in range(SESSION_UPDATE_ATTEMPTS):
+            current = await self.get(session_id)
+            if current is None and not create:
+                return None
+            session = Session.from_dict(current.to_dict()) if current else self.new(session_id)
+            if not apply(session):
+                return current
+            if self.db_path is None:
+                # Nothing is awaited between get and here, so no other turn interleaved
+                await self.save(session)
+                return session
+            expected = current.updated_at if current else None
+            # A distinct timestamp, so the row of this save never matches an expectation based on the old one
+            session.updated_at = max(time.time(), (expected or 0.0) + 1e-6)
+            if await asyncio.to_thread(self._db_save, session, expected, True):
+                self._cache(session)
+                return session
+            print(f"Session {session_id} was saved concurrently, applying the update again (attempt {attempt + 1})")
+        raise RuntimeError(f"Session {session_id} could not be updated: too many concurrent saves")
+
+    async def delete(self, session_id: str) -> bool:
+        """Delete a session; returns whether it existed."""
+        deleted = self._sessions.pop(session_id, None) is not None
+        if self.db_path is not None:
+            deleted = await asyncio.to_thread(self._db_delete, session_id) or deleted
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "sqlite" if self.db_path is not None else "memory",
+            "cached_sessions": len(self._sessions)
+        }
+
+
+# Global instance
+session_store = SessionStore()
@@ -0,0 +1,103 @@
+"""Per-stage timing spans exported as Prometheus metrics, OpenTelemetry traces and Server-Timing headers."""
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar, Token
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from .metrics import STAGE_DURATION
+
+# Whether spans are also emitted as OpenTelemetry spans (needs the opentelemetry packages)
+OTEL_TRACES_ENABLED = os.getenv("OTEL_TRACES_ENABLED", "false").lower() == "true"
+
+# Spans recorded during the current request; None outside of requests
+_request_spans: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_spans", default=None)
+_tracer: Any = None
+
+
+def configure_tracing() -> bool:
+    """
+    Set up OpenTelemetry tracing if enabled and installed.
+
+    Spans are exported over OTLP when opentelemetry-exporter-otlp is installed
+    (configured by the standard OTEL_EXPORTER_OTLP_* variables); otherwise an
+    already configured global tracer provider is used.
+    """
+    global _tracer
+    if not OTEL_TRACES_ENABLED:
+        return False
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        print("OTEL_TRACES_ENABLED is set but opentelemetry-api is not installed; tracing disabled")
+        return False
+
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        provider = TracerProvider(resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", "rag-api")}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        trace.set_tracer_provider(provider)
+    except ImportError:
+        pass
+    _tracer = trace.get_tracer("api.rag")
+    return True
+
+
+def record_span(name: str, seconds: float) -> None:
+    """Record a finished stage for the metrics and the current request."""
+    STAGE_DURATION.labels(stage=name).observe(seconds)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((name, seconds))
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[None]:
+    """
+    Time a stage.
+
+    Usage:
+        with span("completion", model=model):
+            response = await chat_completion(...)
+    """
+    trace_span = _tracer.start_as_current_span(name, attributes=attributes) if _tracer is not None else nullcontext()
+    start = time.perf_counter()
+    with trace_span:
+        try:
+            yield
+        finally:
+            record_span(name, time.perf_counter() - start)
+
+
+def start_request_timing() -> Token:
+    """Start collecting spans for the current request (context), e.g. in a middleware."""
+    return _request_spans.set([])
+
+
+def finish_request_timing(token: Token) -> List[Tuple[str, float]]:
+    """Stop collecting and return the spans recorded since start_request_timing."""
+    spans = _request_spans.get() or []
+    _request_spans.reset(token)
+    return spans
+
+
+def server_timing_header(spans: List[Tuple[str, float]]) -> str:
+    """
+    Format spans as a Server-Timing header value.
+
+    Stages that ran several times (e.g. one search per expanded query) are summed
+    and their count is given in the description.
+    """
+    totals: Dict[str, List[float]] = {}
+    for name, seconds in spans:
+        totals.setdefault(name, []).append(seconds)
+    entries = []
+    for name, durations in totals.items():
+        entry = f"{name};dur={sum(durations) * 1000:.1f}"
+        if len(durations) > 1:
+            entry += f';desc="x{len(durations)}"'
+        entries.append(entry)
+    return ", ".join(entries)
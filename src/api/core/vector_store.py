@@ -0,0 +1,503 @@
+"""Corpus-wide vector store with two-stage (Matryoshka) search."""
+import os
+import json
+import shutil
+import asyncio
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+import faiss
+from .onace_categories import OnaceManager, load_document_onace_mapping
+from .metadata_filters import ChunkAttributeTable, filter_cache_key
+from .bm25 import BM25Index, BM25Builder, BM25_SUFFIX, reciprocal_rank_fusion
+from .corpus_manifest import (
+    get_corpus_version, get_manifest, manifest_digest, file_lock, corpus_read_lock, requeue_stale_documents
+)
+from .timing import span
+from .metrics import CACHE_LOOKUPS, CORPUS_DOCUMENTS, CORPUS_CHUNKS, CORPUS_VERSION, INDEX_BYTES
+
+# Path to the per-document FAISS indexes
+EMBEDDINGS_DIR = Path(os.getenv("EMBEDDINGS_DIR", "./src/api/data/embeddings"))
+# Dimensionality of the truncated vectors used for the coarse first stage
+COARSE_DIMENSIONS = int(os.getenv("COARSE_DIMENSIONS", "256"))
+# Number of coarse candidates re-scored with full vectors per requested result
+SHORTLIST_FACTOR = int(os.getenv("SHORTLIST_FACTOR", "10"))
+# Lower bound for the shortlist so small top_k values still get a useful candidate pool
+MIN_SHORTLIST = 50
+# Whether searches use the coarse + re-score path by default
+TWO_STAGE_SEARCH = os.getenv("TWO_STAGE_SEARCH", "true").lower() == "true"
+# Suffix of the truncated-vector index written next to each full index
+COARSE_INDEX_SUFFIX = ".coarse.index"
+# Maximum number of distinct filter bitmaps kept per corpus snapshot
+FILTER_CACHE_SIZE = 256
+# Whether searches fuse BM25 and vector rankings by default
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+# Candidates taken from each ranking before fusion, per requested result
+HYBRID_POOL_FACTOR = 4
+# Whether workers memory-map a shared on-disk corpus snapshot instead of each merging the documents
+CORPUS_SNAPSHOTS = os.getenv("CORPUS_SNAPSHOTS", "true").lower() == "true"
+# Subdirectory of EMBEDDINGS_DIR with one immutable snapshot directory per corpus state
+SNAPSHOTS_DIRNAME = "snapshots"
+# Snapshots kept on disk; workers still using a removed one keep their mapping
+SNAPSHOTS_KEPT = 2
+# FAISS threads per worker process; by default the cores are divided among the workers
+FAISS_THREADS = int(os.getenv(
+    "FAISS_THREADS", str(max(1, (os.cpu_count() or 1) // int(os.getenv("WEB_CONCURRENCY", "1"))))
+))
+# Map flat index vectors in place (faiss >= 1.11); older versions read them into memory
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+
+faiss.omp_set_num_threads(FAISS_THREADS)
+
+
+def rows_to_bitmap(size: int, rows: np.ndarray) -> np.ndarray:
+    """Pack row ids into the little-endian bitmap layout expected by faiss.IDSelectorBitmap."""
+    mask = np.zeros(size, dtype=bool)
+    mask[rows] = True
+    return np.packbits(mask, bitorder="little")
+
+
+def document_onace_codes(metadata: Dict) -> str:
+    """Get the ÖNACE codes of a document, falling back to the filename mapping."""
+    if metadata.get("onace_codes"):
+        return metadata["onace_codes"]
+    filename = metadata.get("filename", "")
+    return load_document_onace_mapping().get(Path(filename).stem, "0")
+
+
+def truncate_embeddings(vectors: np.ndarray, dimensions: int = COARSE_DIMENSIONS) -> np.ndarray:
+    """
+    Shorten embeddings to their first `dimensions` components and re-normalise.
+
+    text-embedding-3 models are trained Matryoshka-style, so a prefix of the
+    vector is itself a valid embedding once scaled back to unit length. This is
+    what the API's `dimensions` parameter does server-side.
+    """
+    truncated = np.ascontiguousarray(vectors[:, :dimensions], dtype=np.float32)
+    norms = np.linalg.norm(truncated, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return truncated / norms
+
+
+@dataclass
+class CorpusIndex:
+    """All document embeddings of the corpus, merged into one searchable store."""
+    version: int
+    full_index: faiss.Index
+    coarse_index: faiss.Index
+    chunks: List[Dict]
+    documents: Dict[str, Dict]
+    onace_partitions: Dict[str, Optional[np.ndarray]]
+    attributes: ChunkAttributeTable
+    lexical_index: BM25Index
+    chunk_rows: Dict[str, int] = field(default_factory=dict)
+    filter_cache: Dict[Tuple, Optional[np.ndarray]] = field(default_factory=dict)
+
+    @property
+    def size(self) -> int:
+        return len(self.chunks)
+
+    def onace_bitmap(self, user_onace_code: str) -> Optional[np.ndarray]:
+        """
+        Get the precomputed row bitmap for a user's ÖNACE code.
+
+        Returns None when every row is relevant, so the search runs unfiltered.
+        Unknown codes only see general documents, like OnaceManager.is_document_relevant.
+        """
+        if user_onace_code in self.onace_partitions:
+            return self.onace_partitions[user_onace_code]
+        return self.onace_partitions.get("0")
+
+    def filter_bitmap(self, user_onace_code: str, filters: Optional[Dict[str, Any]] = None) -> Optional[np.ndarray]:
+        """
+        Combine the ÖNACE partition with a metadata filter into a single row bitmap.
+
+        Filter bitmaps are cached per corpus snapshot, so repeated filters cost a dict lookup.
+        """
+        onace_bitmap = self.onace_bitmap(user_onace_code)
+        if not filters:
+            return onace_bitmap
+
+        key = (user_onace_code, filter_cache_key(filters))
+        if key in self.filter_cache:
+            CACHE_LOOKUPS.labels(cache="filter_bitmap", result="hit").inc()
+            return self.filter_cache[key]
+        CACHE_LOOKUPS.labels(cache="filter_bitmap", result="miss").inc()
+
+        mask = self.attributes.evaluate(filters)
+        if mask is None:
+            bitmap = onace_bitmap
+        else:
+            bitmap = np.packbits(mask, bitorder="little")
+            if onace_bitmap is not None:
+                bitmap &= onace_bitmap
+
+        if len(self.filter_cache) >= FILTER_CACHE_SIZE:
+            self.filter_cache.pop(next(iter(self.filter_cache)))
+        self.filter_cache[key] = bitmap
+        return bitmap
+
+    def rows_for_chunks(self, chunk_ids: List[str], bitmap: Optional[np.ndarray] = None) -> np.ndarray:
+        """Rows of the given chunk ids that are still in the corpus and, if given, in the bitmap."""
+        rows = np.array([self.chunk_rows[chunk_id] for chunk_id in chunk_ids if chunk_id in self.chunk_rows], dtype=np.int64)
+        if bitmap is not None and len(rows):
+            rows = rows[(bitmap[rows >> 3] >> (rows & 7)) & 1 == 1]
+        return rows
+
+    def document_bitmap(self, document_ids: List[str], bitmap: Optional[np.ndarray] = None) -> np.ndarray:
+        """Restrict a row bitmap (or the whole corpus) to the rows of the given documents."""
+        ranges = [np.arange(*self.documents[document_id]["rows"]) for document_id in document_ids if document_id in self.documents]
+        restricted = rows_to_bitmap(self.size, np.concatenate(ranges) if ranges else np.array([], dtype=np.int64))
+        return restricted if bitmap is None else restricted & bitmap
+
+    def search(
+        self,
+        query_vector: np.ndarray,
+        top_k: int,
+        bitmap: Optional[np.ndarray] = None,
+        two_stage: bool = TWO_STAGE_SEARCH
+    ) -> List[Tuple[int, float]]:
+        """
+        Search the corpus and return (row, squared L2 distance) pairs.
+
+        Args:
+            query_vector: Full-dimensional query embedding, shape (1, d)
+            top_k: Number of results to return
+            bitmap: Optional packed row bitmap (see rows_to_bitmap) restricting the search
+            two_stage: Run a coarse search on truncated vectors and re-score the
+                shortlist with full vectors instead of an exact full search
+
+        Returns:
+            Up to top_k (row, distance) pairs sorted by ascending distance
+        """
+        if self.size == 0 or top_k <= 0:
+            return []
+        if bitmap is not None and not bitmap.any():
+            return []
+
+        params = None
+        if bitmap is not None:
+            # The selector only holds a pointer, `bitmap` must stay alive during the search.
+            # Its length is given in bytes, not rows
+            selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+            params = faiss.SearchParameters(sel=selector)
+
+        if not two_stage:
+            distances, indices = self.full_index.search(query_vector, top_k, params=params)
+            return [(int(idx), float(dist)) for idx, dist in zip(indices[0], distances[0]) if idx >= 0]
+
+        # Stage one: coarse search over the truncated vectors
+        shortlist_size = min(self.size, max(top_k * SHORTLIST_FACTOR, MIN_SHORTLIST))
+        coarse_query = truncate_embeddings(query_vector)
+        _, indices = self.coarse_index.search(coarse_query, shortlist_size, params=params)
+        candidates = indices[0][indices[0] >= 0]
+        if len(candidates) == 0:
+            return []
+
+        # Stage two: exact distances on full vectors for the shortlist only
+        distances = self.distances(candidates, query_vector)
+        order = np.argsort(distances)[:top_k]
+        return [(int(candidates[i]), float(distances[i])) for i in order]
+
+    def distances(self, rows: np.ndarray, query_vector: np.ndarray) -> np.ndarray:
+        """Squared L2 distances between the query and the full vectors of the given rows."""
+        vectors = self.full_index.reconstruct_batch(np.asarray(rows, dtype=np.int64))
+        return np.sum((vectors - query_vector[0]) ** 2, axis=1)
+
+    def similarities(self, rows: np.ndarray, query_vector: np.ndarray) -> np.ndarray:
+        """Cosine similarities between the query and the full vectors of the given rows."""
+        vectors = self.full_index.reconstruct_batch(np.asarray(rows, dtype=np.int64))
+        norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_vector[0])
+        norms[norms == 0] = 1.0
+        return vectors @ query_vector[0] / norms
+
+    def hybrid_search(
+        self,
+        query: str,
+        query_vector: np.ndarray,
+        top_k: int,
+        bitmap: Optional[np.ndarray] = None,
+        two_stage: bool = TWO_STAGE_SEARCH
+    ) -> List[Tuple[int, float, float]]:
+        """
+        Fuse BM25 and vector rankings with reciprocal rank fusion.
+
+        Returns:
+            Up to top_k (row, squared L2 distance, fused score) triples sorted by
+            descending fused score. Lexical-only hits get their distance computed
+            so callers can keep treating the distance as the chunk score.
+        """
+        pool = max(top_k * HYBRID_POOL_FACTOR, 20)
+        vector_matches = self.search(query_vector, pool, bitmap, two_stage)
+        lexical_matches = self.lexical_index.search(query, pool, bitmap)
+        fused = reciprocal_rank_fusion([
+            [row for row, _ in vector_matches],
+            [row for row, _ in lexical_matches]
+        ])[:top_k]
+        if not fused:
+            return []
+
+        known = dict(vector_matches)
+        missing = [row for row, _ in fused if row not in known]
+        if missing:
+            known.update(zip(missing, self.distances(np.array(missing), query_vector).tolist()))
+        return [(row, float(known[row]), score) for row, score in fused]
+
+
+_corpus_index: Optional[CorpusIndex] = None
+_load_lock = asyncio.Lock()
+
+
+def build_onace_partitions(documents: Dict[str, Dict], size: int) -> Dict[str, Optional[np.ndarray]]:
+    """
+    Precompute one row bitmap per ÖNACE section (general documents + that section).
+
+    Sections whose bitmap would cover the whole corpus map to None.
+    """
+    document_codes = {
+        document_id: OnaceManager.parse_onace_codes(document["metadata"]["onace_codes"])
+        for document_id, document in documents.items()
+    }
+    partitions: Dict[str, Optional[np.ndarray]] = {}
+    for code in OnaceManager.get_all_categories():
+        relevant = [
+            np.arange(*documents[document_id]["rows"])
+            for document_id, codes in document_codes.items()
+            if OnaceManager.is_document_relevant(codes, code)
+        ]
+        rows = np.concatenate(relevant) if relevant else np.empty(0, dtype=np.int64)
+        partitions[code] = None if len(rows) == size else rows_to_bitmap(size, rows)
+    return partitions
+
+
+def assemble_corpus_index(
+    version: int,
+    full_index: faiss.Index,
+    coarse_index: faiss.Index,
+    chunks: List[Dict],
+    documents: Dict[str, Dict],
+    lexical_index: BM25Index
+) -> CorpusIndex:
+    """Derive the ÖNACE partitions, filter attributes and chunk lookup of a merged corpus."""
+    return CorpusIndex(
+        version=version,
+        full_index=full_index,
+        coarse_index=coarse_index,
+        chunks=chunks,
+        documents=documents,
+        onace_partitions=build_onace_partitions(documents, len(chunks)),
+        attributes=ChunkAttributeTable.from_documents(documents, len(chunks)),
+        lexical_index=lexical_index,
+        chunk_rows={chunk["chunk_id"]: row for row, chunk in enumerate(chunks)}
+    )
+
+
+def load_corpus_index(embeddings_dir: Path = EMBEDDINGS_DIR, embedding_model: Optional[str] = None) -> CorpusIndex:
+    """
+    Load every document of the manifest into a single corpus-wide store.
+
+    Files are read under the corpus read lock, so the store holds exactly the
+    documents of the manifest version it reports. With `embedding_model`,
+    documents embedded with another model are excluded and requeued for the
+    reconciler first.
+    """
+    if embedding_model:
+        requeued = requeue_stale_documents(embedding_model, embeddings_dir)
+        if requeued:
+            print(f"Requeued {len(requeued)} documents embedded with a model other than {embedding_model}")
+    with corpus_read_lock(embeddings_dir):
+        manifest = get_manifest(embeddings_dir)
+        version = manifest["version"]
+        full_parts: List[np.ndarray] = []
+        coarse_parts: List[np.ndarray] = []
+        chunks: List[Dict] = []
+        documents: Dict[str, Dict] = {}
+        lexical_builder = BM25Builder()
+        dimension = None
+
+        # Committed documents only: files of uncommitted or deleted documents are ignored
+        for document_id, entry in sorted(manifest["documents"].items()):
+            if entry.get("chunks") == 0:
+                # Empty documents are recorded without files
+                continue
+            if embedding_model and entry.get("embedding_model") not in (None, embedding_model):
+                # Recorded by a worker with another provider since the requeue above
+                print(f"Skipping {document_id}: embedded with {entry['embedding_model']}, not {embedding_model}")
+                continue
+            metadata_file = embeddings_dir / f"{document_id}.json"
+            index_path = embeddings_dir / f"{document_id}.index"
+            if not index_path.exists() or not metadata_file.exists():
+                print(f"Skipping {document_id}: listed in the manifest but its files are missing")
+                continue
+
+            try:
+                with open(metadata_file, "r") as f:
+                    document_data = json.load(f)
+                index = faiss.read_index(str(index_path))
+            except Exception as e:
+                print(f"Error loading embeddings for {document_id}: {e}")
+                continue
+
+            if index.ntotal == 0:
+                continue
+            if dimension is None:
+                dimension = index.d
+            if index.d != dimension:
+                print(f"Skipping {document_id}: dimension {index.d} does not match corpus dimension {dimension}")
+                continue
+
+            full_vectors = index.reconstruct_n(0, index.ntotal)
+
+            # Prefer the persisted truncated vectors, derive them for older documents
+            coarse_path = embeddings_dir / f"{document_id}{COARSE_INDEX_SUFFIX}"
+            coarse_vectors = None
+            if coarse_path.exists():
+                coarse_index = faiss.read_index(str(coarse_path))
+                if coarse_index.ntotal == index.ntotal and coarse_index.d == COARSE_DIMENSIONS:
+                    coarse_vectors = coarse_index.reconstruct_n(0, coarse_index.ntotal)
+            if coarse_vectors is None:
+                coarse_vectors = truncate_embeddings(full_vectors)
+
+            start = len(chunks)
+            chunks_data = document_data.get("chunks", [])
+            for position in range(index.ntotal):
+                chunk = chunks_data[position] if position < len(chunks_data) else {}
+                record = {
+                    "document_id": document_id,
+                    "chunk_id": chunk.get("chunk_id", f"{document_id}_{position}"),
+                    "text": chunk.get("text", "")
+                }
+                if "page_number" in chunk:
+                    record["page_number"] = chunk["page_number"]
+                chunks.append(record)
+
+            # Prefer the persisted term statistics, tokenize older documents on load
+            postings = None
+            bm25_path = embeddings_dir / f"{document_id}{BM25_SUFFIX}"
+            if bm25_path.exists():
+                with open(bm25_path, "r") as f:
+                    postings = json.load(f)
+            if postings is not None and len(postings.get("lengths", [])) == index.ntotal:
+                lexical_builder.add_postings(start, postings)
+            else:
+                lexical_builder.add_texts(start, [chunk["text"] for chunk in chunks[start:]])
+
+            metadata = document_data.get("metadata", {}).copy()
+            metadata["onace_codes"] = document_onace_codes(metadata)
+            documents[document_id] = {
+                "metadata": metadata,
+                "rows": (start, len(chunks))
+            }
+            full_parts.append(full_vectors)
+            coarse_parts.append(coarse_vectors)
+
+    full_index = faiss.IndexFlatL2(dimension or 0)
+    coarse_index = faiss.IndexFlatL2(COARSE_DIMENSIONS)
+    if full_parts:
+        full_index.add(np.vstack(full_parts))
+        coarse_index.add(np.vstack(coarse_parts))
+
+    return assemble_corpus_index(version, full_index, coarse_index, chunks, documents, lexical_builder.build(len(chunks)))
+
+
+def write_corpus_snapshot(corpus: CorpusIndex, path: Path) -> None:
+    """Write a merged corpus to a snapshot directory that appears with a single rename."""
+    tmp_path = path.with_name(f"{path.name}.tmp.{os.getpid()}")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+    faiss.write_index(corpus.full_index, str(tmp_path / "full.index"))
+    faiss.write_index(corpus.coarse_index, str(tmp_path / "coarse.index"))
+    corpus.lexical_index.save(tmp_path)
+    with open(tmp_path / "corpus.json", "w") as f:
+        json.dump({"version": corpus.version, "chunks": corpus.chunks, "documents": corpus.documents}, f)
+    for file in tmp_path.iterdir():
+        with open(file, "rb") as f:
+            os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+
+
+def read_corpus_snapshot(path: Path) -> CorpusIndex:
+    """Open a snapshot; vectors and BM25 postings are memory-mapped and shared between workers."""
+    with open(path / "corpus.json", "r") as f:
+        data = json.load(f)
+    documents = {
+        document_id: {**document, "rows": tuple(document["rows"])}
+        for document_id, document in data["documents"].items()
+    }
+    return assemble_corpus_index(
+        data["version"],
+        faiss.read_index(str(path / "full.index"), MMAP_FLAGS),
+        faiss.read_index(str(path / "coarse.index"), MMAP_FLAGS),
+        data["chunks"],
+        documents,
+        BM25Index.load(path)
+    )
+
+
+def prune_snapshots(snapshots_dir: Path, keep: int = SNAPSHOTS_KEPT) -> None:
+    """Remove all but the newest snapshots and leftovers of interrupted builds (call with the build lock held)."""
+    snapshots = sorted(
+        (path for path in snapshots_dir.iterdir() if path.is_dir()),
+        key=lambda path: path.stat().st_mtime
+    )
+    complete = [path for path in snapshots if ".tmp." not in path.name]
+    for path in [path for path in snapshots if ".tmp." in path.name] + complete[:-keep]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def load_corpus_snapshot(embeddings_dir: Path = EMBEDDINGS_DIR, embedding_model: Optional[str] = None) -> CorpusIndex:
+    """
+    Open the snapshot of the current corpus, building it if no worker did yet.
+
+    Builds are serialized across processes with a file lock, so the documents are
+    merged once per corpus change and every worker maps the same files.
+    """
+    if embedding_model:
+        # Requeuing changes the manifest, so a snapshot holding stale documents is not reused
+        requeue_stale_documents(embedding_model, embeddings_dir)
+    manifest = get_manifest(embeddings_dir)
+    snapshots_dir = embeddings_dir / SNAPSHOTS_DIRNAME
+    path = snapshots_dir / f"v{manifest['version']}-{manifest_digest(manifest)[:16]}"
+    if not path.exists():
+        with file_lock(snapshots_dir / ".lock"):
+            if not path.exists():
+                corpus = load_corpus_index(embeddings_dir, embedding_model)
+                if corpus.version != manifest["version"]:
+                    # The corpus changed while merging; the next version check loads it again
+                    return corpus
+                write_corpus_snapshot(corpus, path)
+                prune_snapshots(snapshots_dir)
+    return read_corpus_snapshot(path)
+
+
+async def get_corpus_index() -> CorpusIndex:
+    """
+    Get the corpus index, reloading it when the corpus version changed.
+
+    The version is read from the shared manifest, so every worker notices a
+    document ingested by another one on its next query. Documents embedded with
+    a model other than the active provider's are left out and requeued.
+    """
+    global _corpus_index
+    version = await asyncio.to_thread(get_corpus_version)
+    if _corpus_index is not None and _corpus_index.version == version:
+        return _corpus_index
+
+    # Imported here because the embedding providers import this module
+    from .embedding_providers import get_embedding_provider
+    embedding_model = get_embedding_provider().model
+
+    async with _load_lock:
+        if _corpus_index is not None and _corpus_index.version == version:
+            return _corpus_index
+        with span("corpus_load"):
+            _corpus_index = await asyncio.to_thread(
+                load_corpus_snapshot if CORPUS_SNAPSHOTS else load_corpus_index, EMBEDDINGS_DIR, embedding_model
+            )
+        CORPUS_VERSION.set(_corpus_index.version)
+        CORPUS_DOCUMENTS.set(len(_corpus_index.documents))
+        CORPUS_CHUNKS.set(_corpus_index.size)
+        INDEX_BYTES.labels(index="full").set(_corpus_index.full_index.ntotal * _corpus_index.full_index.d * 4)
+        INDEX_BYTES.labels(index="coarse").set(_corpus_index.coarse_index.ntotal * _corpus_index.coarse_index.d * 4)
+        return _corpus_index
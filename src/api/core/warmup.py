@@ -0,0 +1,113 @@
+"""Background warm-up of the query path after startup."""
+import os
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+from .openai_scheduler import get_token_encoding
+from .openai_client import get_openai_client
+from .vector_store import get_corpus_index
+from .rag import generate_answer
+from .timing import span
+
+# Whether the warm-up starts with the application
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+# Connections opened to the OpenAI API ahead of the first query (TCP and TLS handshakes)
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "2"))
+# Question answered once through the full RAG path before the worker reports ready; empty = off
+WARMUP_QUERY = os.getenv("WARMUP_QUERY", "").strip()
+
+
+async def load_tokenizer() -> None:
+    await asyncio.to_thread(get_token_encoding)
+
+
+async def load_openai_client() -> None:
+    # Creating the client imports the SDK, which takes about a second
+    await asyncio.to_thread(get_openai_client)
+
+
+async def open_openai_connections(count: int = WARMUP_CONNECTIONS) -> None:
+    # Concurrent requests each take their own connection, which then stays in the keep-alive pool
+    client = get_openai_client().with_options(max_retries=0)
+    await asyncio.gather(*(client.models.list() for _ in range(count)))
+
+
+async def load_corpus_index() -> None:
+    await get_corpus_index()
+
+
+async def run_synthetic_query(query: str = WARMUP_QUERY) -> None:
+    response = await generate_answer(query=query)
+    if not response["success"]:
+        raise RuntimeError(response["answer"])
+
+
+class WarmUp:
+    """Loads what the first query would otherwise wait for, without delaying startup."""
+
+    def __init__(self):
+        self.steps: Dict[str, Callable[[], Awaitable[None]]] = {
+            "corpus_index": load_corpus_index,
+            "tokenizer": load_tokenizer,
+            "openai_client": load_openai_client
+        }
+        if WARMUP_CONNECTIONS > 0:
+            self.steps["openai_connections"] = open_openai_connections
+        if WARMUP_QUERY:
+            self.steps["synthetic_query"] = run_synthetic_query
+        self._task: Optional[asyncio.Task] = None
+        self.durations: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def start(self) -> None:
+        """Start the warm-up on the running event loop."""
+        if self._task is None:
+            self.started_at = time.time()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Cancel an unfinished warm-up, e.g. on shutdown."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self) -> None:
+        for name, step in self.steps.items():
+            started = time.perf_counter()
+            try:
+                with span(f"warmup_{name}"):
+                    await step()
+                self.durations[name] = round(time.perf_counter() - started, 3)
+            except Exception as e:
+                # The step is retried by the first request that needs it
+                print(f"Warm-up step {name} failed: {str(e)}")
+                self.errors[name] = str(e)
+        self.finished_at = time.time()
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def ready(self) -> bool:
+        """Whether the worker should receive traffic; failed steps do not hold it back."""
+        return not WARMUP_ENABLED or self.done
+
+    def status(self) -> Dict[str, Any]:
+        """Warm-up progress for the health and readiness endpoints."""
+        return {
+            "enabled": WARMUP_ENABLED,
+            "done": self.done,
+            "durations": self.durations,
+            "errors": self.errors,
+            "seconds": round((self.finished_at or time.time()) - self.started_at, 3) if self.started_at else None
+        }
+
+
+# Global instance
+warmup = WarmUp()
@@ -48,15 +48,27 @@ class ChunkResponse(BaseModel):
     metadata: Dict[str, Any] = Field(default_factory=dict, description="Chunk metadata, may include 'filename', 'file_type', 'page_number', etc.")
 
 
+class SearchFilter(BaseModel):
+    """Restricts retrieval to a subset of the corpus. Conditions are combined with AND."""
+    families: Optional[List[str]] = Field(None, description="Document families: eu_regulation, sbti, ghg_protocol, guidance, un, report, national, other")
+    year_from: Optional[int] = Field(None, description="Earliest publication year taken from the filename, e.g. 2020")
+    year_to: Optional[int] = Field(None, description="Latest publication year taken from the filename")
+    file_types: Optional[List[str]] = Field(None, description="File extensions, e.g. ['.pdf', '.xlsx']")
+    vsme_only: bool = Field(False, description="Only retrieve from VSME documents")
+
+
 class ChatRequest(BaseModel):
     """A chat request with optional conversation history."""
     message: str
-    history: Optional[List[Message]] = None
+    history: Optional[List[Message]] = Field(None, description="Only needed without a session; the server keeps the history of a session")
+    session_id: Optional[str] = Field(None, description="Session of the previous response; a new session is started if omitted")
+    conversation_id: Optional[str] = Field(None, description="Alias of session_id")
     top_k: Optional[int] = 3
     model: Optional[str] = "gpt-4.1-mini-2025-04-14"
     temperature: Optional[float] = 0.0
     meta_information: Optional[str] = None
     user_onace_code: Optional[str] = "0"
+    filters: Optional[SearchFilter] = None
 
 
 class ChatResponse(BaseModel):
@@ -66,6 +78,20 @@ class ChatResponse(BaseModel):
     expanded_queries: List[str]
     success: bool
     relevant_links: List[str] = Field(default_factory=list, description="Relevant links based on query and context")
+    usage: Optional[Dict[str, Any]] = Field(None, description="Prompt/completion tokens of the request and how the context budget was spent")
+    retrieval_mode: Optional[str] = Field(None, description="\"followup\" when the previous turn's documents were reused, \"full\" for a corpus-wide search")
+    session_id: Optional[str] = Field(None, description="Session id to send with the next message")
+    conversation_id: Optional[str] = Field(None, description="Alias of session_id")
+
+
+class SessionResponse(BaseModel):
+    """Stored state of a chat session."""
+    session_id: str
+    messages: List[Message]
+    summary: Optional[str] = Field(None, description="Summary of the turns before the most recent ones")
+    previous_chunk_ids: List[str] = Field(default_factory=list, description="Chunks retrieved for the last answer")
+    created_at: float
+    updated_at: float
 
 
 class QARequest(BaseModel):
@@ -74,6 +100,7 @@ class QARequest(BaseModel):
     top_k: Optional[int] = Field(3, description="Number of chunks to retrieve")
     model: Optional[str] = Field("gpt-4.1-mini-2025-04-14", description="OpenAI model to use for generation")
     temperature: Optional[float] = Field(0.0, description="Sampling temperature")
+    filters: Optional[SearchFilter] = Field(None, description="Optional metadata filter for retrieval")
 
 
 class QAResponse(BaseModel):
@@ -82,4 +109,5 @@ class QAResponse(BaseModel):
     chunks: List[ChunkResponse]
     expanded_queries: Optional[List[str]] = Field(default_factory=list, description="Expanded queries used for retrieval")
     success: bool
-    relevant_links: List[str] = Field(default_factory=list, description="Relevant links based on query and context") 
\ No newline at end of file
+    relevant_links: List[str] = Field(default_factory=list, description="Relevant links based on query and context")
+    usage: Optional[Dict[str, Any]] = Field(None, description="Prompt/completion tokens of the request and how the context budget was spent")
@@ -1,31 +1,56 @@
 """Chat routes for RAG system."""
+import logging
 from typing import List, Optional
-from fastapi import APIRouter, HTTPException
-from ..models import Message, ChatRequest, ChatResponse
+from fastapi import APIRouter, HTTPException, BackgroundTasks
+from ..models import Message, ChatRequest, ChatResponse, SessionResponse
 from ..core.rag import generate_answer
+from ..core.conversation_memory import conversation_memory
+from ..core.session_store import Session, session_store
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
-def format_conversation_history(messages: List[Message]) -> str:
-    """Format conversation history into a string, including only user questions and assistant responses."""
-    formatted_history = ""
-    for msg in messages:
-        if msg.role in ["user", "assistant"]:
-            role = "Assistant" if msg.role == "assistant" else "User"
-            formatted_history += f"{role}: {msg.content}\n"
-    return formatted_history.strip()
+async def refresh_summary(session_id: str) -> None:
+    """Fold turns that left the verbatim window into the session's summary."""
+    session = await session_store.get(session_id)
+    if session is None:
+        return
+    summary = await conversation_memory.update(session_id, session.messages, session.summary)
+    if summary is None:
+        return
+
+    def apply_summary(current: Session) -> bool:
+        # Another turn may have been added meanwhile; keep the summary if it still matches
+        if not conversation_memory.summary_applies(summary, current.messages):
+            return False
+        current.summary = summary
+        return True
+
+    await session_store.update(session_id, apply_summary, create=False)
 
 @router.post("/process", response_model=ChatResponse)
-async def process_chat(request: ChatRequest):
-    """Process a chat message with conversation history."""
+async def process_chat(request: ChatRequest, background_tasks: BackgroundTasks):
+    """
+    Process a chat message.
+
+    The conversation is kept server-side: send the session_id of the previous
+    response instead of the history. A client-sent history is used when the
+    server knows fewer messages (e.g. a new or expired session).
+    """
     try:
-        # Format conversation history if available
-        conversation_history = None
-        print("Received history:", request.history)  # Debug: Print received history
-        if request.history and len(request.history) > 0:
-            conversation_history = format_conversation_history(request.history)
-            print("Formatted history:", conversation_history)  # Debug: Print formatted history
-        
+        session_id = request.session_id or request.conversation_id or session_store.new().session_id
+
+        # No lock is held while answering; the turn is appended to the session as stored by then
+        session = await session_store.get(session_id) or session_store.new(session_id)
+        history = [msg.model_dump() for msg in request.history or []]
+        if len(history) > len(session.messages):
+            session.messages = history
+        logger.debug(f"Session {session.session_id}: {len(session.messages)} messages")
+
+        # Recent turns verbatim, older turns as the session's summary
+        conversation_history = conversation_memory.build_history(session.messages, session.summary)
+
         # Generate response using RAG with ÖNACE filtering
         response = await generate_answer(
             query=request.message,
@@ -34,24 +59,68 @@ async def process_chat(request: ChatRequest):
             model=request.model,
             temperature=request.temperature,
             meta_information=request.meta_information,
-            user_onace_code=getattr(request, 'user_onace_code', '0')
+            user_onace_code=getattr(request, 'user_onace_code', '0'),
+            filters=request.filters.model_dump(exclude_none=True) if request.filters else None,
+            previous_chunk_ids=session.previous_chunk_ids
         )
-        
+
         # Create the assistant message
         assistant_message = Message(
             role="assistant",
             content=response["answer"]
         )
-        
+
+        if response["success"]:
+            def add_turn(current: Session) -> bool:
+                # A concurrent turn saved meanwhile stays in front of this one
+                if len(history) > len(current.messages):
+                    current.messages = history
+                current.messages = current.messages + [
+                    {"role": "user", "content": request.message},
+                    assistant_message.model_dump()
+                ]
+                current.previous_chunk_ids = [chunk["chunk_id"] for chunk in response["chunks"]]
+                return True
+
+            await session_store.update(session_id, add_turn)
+            # Summarize turns leaving the verbatim window once the response is sent
+            background_tasks.add_task(refresh_summary, session_id)
+
         # No need to convert chunks - use them directly
         return ChatResponse(
             message=assistant_message,
             chunks=response["chunks"],  # Use the full chunk objects
             expanded_queries=response["expanded_queries"],
             success=response["success"],
-            relevant_links=response.get("relevant_links", [])
+            relevant_links=response.get("relevant_links", []),
+            usage=response.get("usage"),
+            retrieval_mode=response.get("retrieval_mode"),
+            session_id=session_id,
+            conversation_id=session_id
         )
-        
+
     except Exception as e:
         print(f"Error in process_chat: {e}")  # Add this to see the actual error
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/sessions/{session_id}", response_model=SessionResponse)
+async def get_session(session_id: str):
+    """Get the stored history of a chat session."""
+    session = await session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return SessionResponse(
+        session_id=session.session_id,
+        messages=[Message(**msg) for msg in session.messages],
+        summary=session.summary.text if session.summary else None,
+        previous_chunk_ids=session.previous_chunk_ids,
+        created_at=session.created_at,
+        updated_at=session.updated_at
+    )
+
+@router.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """Delete a chat session."""
+    if not await session_store.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"success": True, "session_id": session_id}
@@ -1,6 +1,8 @@
 """Document handling routes."""
 import os
 import json
+import uuid
+import asyncio
 from typing import List
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
 from fastapi.responses import JSONResponse, FileResponse
@@ -9,7 +11,12 @@ import mimetypes
 
 from ..models import DocumentResponse, TextDocumentRequest, FileListResponse, FileEntry
 from ..core.document_processor import process_text_document, save_uploaded_file, get_document_content
-from ..core.embeddings import create_document_embeddings, verify_document_embeddings, process_missing_embeddings
+from ..core.embeddings import create_document_embeddings, verify_document_embeddings
+from ..core.reconciler import reconciler
+from ..core.vector_store import COARSE_INDEX_SUFFIX
+from ..core.bm25 import BM25_SUFFIX
+from ..core.answer_cache import answer_cache
+from ..core.corpus_manifest import remove_document, get_manifest, ingestion_claim
 
 router = APIRouter(prefix="/documents", tags=["documents"])
 # Get the documents directory from environment or default
@@ -56,16 +63,24 @@ async def get_all_files():
         raise HTTPException(status_code=500, detail=f"Error getting file list: {str(e)}")
 
 
+@router.get("/manifest")
+async def get_corpus_manifest():
+    """Get the corpus version and the per-document manifest entries."""
+    return await asyncio.to_thread(get_manifest)
+
+
 @router.get("/embedding-status")
 async def get_embedding_status():
     """Get the status of document embeddings."""
-    return verify_document_embeddings()
+    return await verify_document_embeddings()
 
 
 @router.post("/process-missing-embeddings")
 async def process_missing():
-    """Process embeddings for any documents that are missing them."""
-    return await process_missing_embeddings()
+    """Process embeddings for any documents that are missing them, including ones backing off after failures."""
+    result = await reconciler.reconcile(force=True)
+    result["verification"] = await verify_document_embeddings()
+    return result
 
 
 @router.post("/upload", response_model=DocumentResponse)
@@ -75,52 +90,56 @@ async def upload_document(file: UploadFile = File(...)):
         # Log upload attempt
         print(f"Processing upload for file: {file.filename}")
         
-        document_info = save_uploaded_file(file.file, file.filename)
+        # Claimed before it is registered as pending, so the reconciler does not embed it too
+        document_id = str(uuid.uuid4())
+        with ingestion_claim(document_id):
+            document_info = save_uploaded_file(file.file, file.filename, document_id=document_id)
         
-        # Process embeddings
-        processed_content = document_info.get("processed_content") 
+            # Process embeddings
+            processed_content = document_info.get("processed_content") 
         
-        if processed_content:
-            print(f"Creating embeddings for document: {document_info['document_id']}")
+            if processed_content:
+                print(f"Creating embeddings for document: {document_info['document_id']}")
             
-            # Check content type for debugging
-            content_type = type(processed_content)
-            print(f"Content type: {content_type}")
+                # Check content type for debugging
+                content_type = type(processed_content)
+                print(f"Content type: {content_type}")
             
-            if isinstance(processed_content, str) and processed_content.startswith("Error"):
-                # Don't attempt embedding if there was a processing error
-                print(f"Skipping embedding due to processing error: {processed_content}")
-                return DocumentResponse(
-                    document_id=document_info["document_id"],
-                    filename=document_info["filename"],
-                    size=document_info["size"],
-                    success=True,
-                    message="Document uploaded but processing had errors. Embeddings not created."
-                )
+                if isinstance(processed_content, str) and processed_content.startswith("Error"):
+                    # Don't attempt embedding if there was a processing error
+                    print(f"Skipping embedding due to processing error: {processed_content}")
+                    return DocumentResponse(
+                        document_id=document_info["document_id"],
+                        filename=document_info["filename"],
+                        size=document_info["size"],
+                        success=True,
+                        message="Document uploaded but processing had errors. Embeddings not created."
+                    )
                 
-            embedding_result = await create_document_embeddings(
-                document_info["document_id"],
-                processed_content,
-                document_info["metadata"]
-            )
-            
-            if not embedding_result.get("success"):
-                error_msg = f"Document {document_info['document_id']} uploaded but embedding failed: {embedding_result.get('error')}"
-                print(f"Warning: {error_msg}")
-                return DocumentResponse(
-                    document_id=document_info["document_id"],
-                    filename=document_info["filename"],
-                    size=document_info["size"],
-                    success=True,
-                    message=error_msg
+                embedding_result = await create_document_embeddings(
+                    document_info["document_id"],
+                    processed_content,
+                    document_info["metadata"]
                 )
+                answer_cache.clear()
+            
+                if not embedding_result.get("success"):
+                    error_msg = f"Document {document_info['document_id']} uploaded but embedding failed: {embedding_result.get('error')}"
+                    print(f"Warning: {error_msg}")
+                    return DocumentResponse(
+                        document_id=document_info["document_id"],
+                        filename=document_info["filename"],
+                        size=document_info["size"],
+                        success=True,
+                        message=error_msg
+                    )
         
-        return DocumentResponse(
-            document_id=document_info["document_id"],
-            filename=document_info["filename"],
-            size=document_info["size"],
-            success=True
-        )
+            return DocumentResponse(
+                document_id=document_info["document_id"],
+                filename=document_info["filename"],
+                size=document_info["size"],
+                success=True
+            )
     except Exception as e:
         error_msg = f"Error processing document: {str(e)}"
         print(f"Upload error: {error_msg}")
@@ -133,18 +152,23 @@ async def upload_document(file: UploadFile = File(...)):
 async def process_text(request: TextDocumentRequest):
     """Process a text document directly."""
     try:
-        document_info = process_text_document(
-            request.content,
-            request.filename,
-            request.metadata
-        )
-        
-        # Process embeddings
-        create_document_embeddings(
-            document_info["document_id"],
-            request.content,
-            document_info["metadata"]
-        )
+        # Claimed before it is registered as pending, so the reconciler does not embed it too
+        document_id = str(uuid.uuid4())
+        with ingestion_claim(document_id):
+            document_info = process_text_document(
+                request.content,
+                request.filename,
+                request.metadata,
+                document_id=document_id
+            )
+            
+            # Process embeddings
+            await create_document_embeddings(
+                document_info["document_id"],
+                request.content,
+                document_info["metadata"]
+            )
+        answer_cache.clear()
         
         return DocumentResponse(
             document_id=document_info["document_id"],
@@ -207,28 +231,27 @@ async def delete_document(document_id: str):
                 except Exception as e:
                     errors.append(f"Failed to delete document {document_path.name}: {str(e)}")
         
-        # 2. Delete embedding files (.json and .index)
-        metadata_path = embeddings_dir / f"{document_id}.json"
-        index_path = embeddings_dir / f"{document_id}.index"
-        
-        if metadata_path.exists():
-            try:
-                metadata_path.unlink()
-                deleted_files.append(f"metadata: {metadata_path.name}")
-                print(f"Deleted metadata file: {metadata_path}")
-            except Exception as e:
-                errors.append(f"Failed to delete metadata {metadata_path.name}: {str(e)}")
-        
-        if index_path.exists():
-            try:
-                index_path.unlink()
-                deleted_files.append(f"index: {index_path.name}")
-                print(f"Deleted index file: {index_path}")
-            except Exception as e:
-                errors.append(f"Failed to delete index {index_path.name}: {str(e)}")
+        # 2. Delete embedding files (.json, .index and derived retrieval files) in the
+        # manifest commit that bumps the corpus version, so loaders never see half a document
+        embedding_files = {
+            "metadata": embeddings_dir / f"{document_id}.json",
+            "index": embeddings_dir / f"{document_id}.index",
+            "coarse index": embeddings_dir / f"{document_id}{COARSE_INDEX_SUFFIX}",
+            "bm25 postings": embeddings_dir / f"{document_id}{BM25_SUFFIX}",
+        }
+        existing_files = {label: path for label, path in embedding_files.items() if path.exists()}
+        try:
+            await asyncio.to_thread(remove_document, document_id, files=list(embedding_files.values()))
+            for label, path in existing_files.items():
+                deleted_files.append(f"{label}: {path.name}")
+                print(f"Deleted {label} file: {path}")
+        except Exception as e:
+            errors.append(f"Failed to delete embedding files: {str(e)}")
+        # Cached answers may cite the deleted document
+        answer_cache.clear()
         
         # 3. Check if any files were found and deleted
-        if not found_document and not metadata_path.exists() and not index_path.exists():
+        if not found_document and not existing_files:
             raise HTTPException(status_code=404, detail=f"Document with ID '{document_id}' not found")
         
         # 4. Return result
@@ -4,7 +4,8 @@ from pydantic import ValidationError
 
 from ..models import QARequest, QAResponse, ChunkResponse
 from ..core.rag import generate_answer
-from ..core.embeddings import verify_document_embeddings, process_missing_embeddings
+from ..core.embeddings import verify_document_embeddings
+from ..core.reconciler import reconciler
 
 router = APIRouter(prefix="/qa", tags=["question-answering"])
 
@@ -15,35 +16,25 @@ async def answer_question(request: QARequest):
     Answer a question using RAG from all available documents.
     
     This endpoint:
-    1. Verifies that all documents have embeddings
-    2. If any documents are missing embeddings, processes them automatically
+    1. Checks the maintained embedding status (constant time)
+    2. If any documents are missing embeddings, wakes the background reconciler
     3. Takes a question
-    4. Retrieves relevant chunks from all documents using FAISS similarity search
+    4. Retrieves relevant chunks from the indexed documents using FAISS similarity search
     5. Generates an answer using OpenAI
     """
     try:
-        # Verify document embeddings and process any missing ones
+        # Missing embeddings are repaired by the reconciler; answer from what is indexed
         verification = await verify_document_embeddings()
         if not verification["is_complete"]:
-            # Process missing embeddings
-            processing_result = await process_missing_embeddings()
-            
-            # Check if processing was successful
-            if not processing_result["verification"]["is_complete"]:
-                raise HTTPException(
-                    status_code=400,
-                    detail={
-                        "message": "Failed to process all missing embeddings",
-                        "processing_result": processing_result
-                    }
-                )
+            reconciler.trigger()
         
         # Generate answer using RAG
         result = await generate_answer(
             query=request.query,
             top_k=request.top_k or 3,
             model=request.model,
-            temperature=request.temperature or 0.0
+            temperature=request.temperature or 0.0,
+            filters=request.filters.model_dump(exclude_none=True) if request.filters else None
         )
         
         # Convert chunks to ChunkResponse model
@@ -63,7 +54,8 @@ async def answer_question(request: QARequest):
             chunks=chunks,
             expanded_queries=result["expanded_queries"],
             success=result["success"],
-            relevant_links=result.get("relevant_links", [])
+            relevant_links=result.get("relevant_links", []),
+            usage=result.get("usage")
         )
     
     except ValidationError as e:
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI API, for repeatable end-to-end load tests.
+
+Serves /v1/embeddings and /v1/chat/completions (including streaming) with
+deterministic responses and configurable latency and error injection.
+Point the RAG API at it with OPENAI_BASE_URL:
+
+    python src/api/scripts/mock_openai_server.py --port 8001 --latency-ms 50
+    OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=mock python -m uvicorn src.api.app:app
+"""
+
+import os
+import re
+import json
+import time
+import base64
+import random
+import asyncio
+import hashlib
+import argparse
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+TOKEN_PATTERN = re.compile(r"\w+(?:[./-]\w+)*")
+
+
+@dataclass
+class MockConfig:
+    """Latency and failure behaviour of the mock server."""
+    embedding_dimensions: int = 1536
+    # Fixed delay per request plus uniform jitter, in milliseconds
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    # Additional delay per embedded input, models batching cost
+    embedding_latency_per_input_ms: float = 0.0
+    # Delay between streamed completion chunks
+    stream_chunk_ms: float = 0.0
+    # Fraction of requests answered with a 500 or a 429 (with retry-after-ms)
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after_ms: int = 200
+    # Words of generated answers
+    completion_words: int = 120
+    seed: Optional[int] = None
+    stats: Dict[str, int] = field(default_factory=lambda: {
+        "embedding_requests": 0, "embedding_inputs": 0, "chat_requests": 0,
+        "stream_requests": 0, "errors": 0, "rate_limited": 0
+    })
+
+
+def count_tokens(text: str) -> int:
+    """Rough token count used for the usage fields."""
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def embed_text(text: str, dimensions: int) -> np.ndarray:
+    """Deterministic unit vector; texts sharing words get similar vectors."""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+        vector[h % dimensions] += 1.0 if h >> 63 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        return vector
+    return vector / norm
+
+
+def generate_reply(messages: List[Dict[str, Any]], max_tokens: Optional[int], words: int) -> str:
+    """Deterministic completion text derived from the last user message."""
+    query = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+    # The link detector asks for a single category word
+    if max_tokens is not None and max_tokens <= 10:
+        return "none"
+    system = " ".join(m.get("content") or "" for m in messages if m.get("role") == "system")
+    if "query expansion" in system.lower():
+        return "\n".join(f"{i}. {query} (variant {i})" for i in range(1, 5))
+    filler = TOKEN_PATTERN.findall(system)[:words] or ["context"]
+    body = " ".join(filler[i % len(filler)] for i in range(words))
+    return f"Mock answer to: {query}\n\n{body}"
+
+
+def create_app(config: MockConfig) -> FastAPI:
+    """Build the mock application for a configuration."""
+    app = FastAPI(title="Mock OpenAI API")
+    rng = random.Random(config.seed)
+
+    async def inject(extra_ms: float = 0.0) -> Optional[JSONResponse]:
+        """Sleep for the configured latency and possibly return an injected error."""
+        delay = config.latency_ms + rng.uniform(0, config.jitter_ms) + extra_ms
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        roll = rng.random()
+        if roll < config.rate_limit_rate:
+            config.stats["rate_limited"] += 1
+            return JSONResponse(
+                status_code=429,
+                headers={"retry-after-ms": str(config.retry_after_ms)},
+                content={"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}}
+            )
+        if roll < config.rate_limit_rate + config.error_rate:
+            config.stats["errors"] += 1
+            return JSONResponse(
+                status_code=500,
+                content={"error": {"message": "Injected server error (mock)", "type": "server_error", "code": None}}
+            )
+        return None
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        config.stats["embedding_requests"] += 1
+        config.stats["embedding_inputs"] += len(inputs)
+
+        error = await inject(config.embedding_latency_per_input_ms * len(inputs))
+        if error is not None:
+            return error
+
+        dimensions = body.get("dimensions") or config.embedding_dimensions
+        data = []
+        for index, text in enumerate(inputs):
+            vector = embed_text(str(text), dimensions)
+            if body.get("encoding_format") == "base64":
+                embedding: Any = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        tokens = sum(count_tokens(str(text)) for text in inputs)
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "mock-embedding"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        stream = bool(body.get("stream"))
+        config.stats["stream_requests" if stream else "chat_requests"] += 1
+
+        error = await inject()
+        if error is not None:
+            return error
+
+        reply = generate_reply(messages, body.get("max_tokens"), config.completion_words)
+        prompt_tokens = sum(count_tokens(m.get("content") or "") for m in messages)
+        completion_tokens = count_tokens(reply)
+        completion_id = f"chatcmpl-mock-{hashlib.md5(reply.encode()).hexdigest()[:12]}"
+        created = int(time.time())
+        model = body.get("model", "mock-chat")
+
+        if not stream:
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply},
+                    "finish_reason": "stop"
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens
+                }
+            }
+
+        async def events():
+            def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+                payload = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+                }
+                return f"data: {json.dumps(payload)}\n\n"
+
+            yield chunk({"role": "assistant", "content": ""})
+            for piece in re.findall(r"\S+\s*", reply):
+                if config.stream_chunk_ms > 0:
+                    await asyncio.sleep(config.stream_chunk_ms / 1000)
+                yield chunk({"content": piece})
+            yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [
+            {"id": name, "object": "model", "created": 0, "owned_by": "mock"}
+            for name in ("text-embedding-3-small", "gpt-4.1-mini-2025-04-14")
+        ]}
+
+    @app.get("/mock/stats")
+    async def stats():
+        """Request counters, e.g. to check how well embedding requests were batched."""
+        return config.stats
+
+    @app.post("/mock/reset")
+    async def reset():
+        for key in config.stats:
+            config.stats[key] = 0
+        return config.stats
+
+    return app
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible API server")
+    env = os.environ.get
+    parser.add_argument("--host", default=env("MOCK_OPENAI_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(env("MOCK_OPENAI_PORT", "8001")))
+    parser.add_argument("--dimensions", type=int, default=int(env("MOCK_EMBEDDING_DIMENSIONS", "1536")))
+    parser.add_argument("--latency-ms", type=float, default=float(env("MOCK_LATENCY_MS", "0")))
+    parser.add_argument("--jitter-ms", type=float, default=float(env("MOCK_JITTER_MS", "0")))
+    parser.add_argument("--embedding-latency-per-input-ms", type=float, default=float(env("MOCK_EMBEDDING_LATENCY_PER_INPUT_MS", "0")))
+    parser.add_argument("--stream-chunk-ms", type=float, default=float(env("MOCK_STREAM_CHUNK_MS", "0")))
+    parser.add_argument("--error-rate", type=float, default=float(env("MOCK_ERROR_RATE", "0")))
+    parser.add_argument("--rate-limit-rate", type=float, default=float(env("MOCK_RATE_LIMIT_RATE", "0")))
+    parser.add_argument("--retry-after-ms", type=int, default=int(env("MOCK_RETRY_AFTER_MS", "200")))
+    parser.add_argument("--completion-words", type=int, default=int(env("MOCK_COMPLETION_WORDS", "120")))
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = MockConfig(
+        embedding_dimensions=args.dimensions,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        embedding_latency_per_input_ms=args.embedding_latency_per_input_ms,
+        stream_chunk_ms=args.stream_chunk_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after_ms=args.retry_after_ms,
+        completion_words=args.completion_words,
+        seed=args.seed
+    )
+    print(f"Mock OpenAI API on http://{args.host}:{args.port}/v1")
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
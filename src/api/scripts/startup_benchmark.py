@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Startup-time benchmark of the RAG API, to keep cold starts from regressing.
+
+Imports the application in fresh interpreters with `python -X importtime`,
+reports the slowest imports and exits with status 1 when the median import
+time exceeds the budget or when a package that should load lazily (on the
+first upload or in the background warm-up) is imported at startup:
+
+    python src/api/scripts/startup_benchmark.py --runs 5 --max-ms 1000
+"""
+
+import os
+import re
+import sys
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# Repository root, the working directory of start.sh
+REPO_ROOT = Path(__file__).resolve().parents[3]
+# Packages that must not be imported when the application module is loaded
+LAZY_PACKAGES = ("pandas", "openpyxl", "pdfplumber", "openai")
+
+# "import time: <self us> | <cumulative us> | <indented module name>"
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$")
+
+
+def measure_imports(module: str) -> Dict[str, Tuple[int, int, int]]:
+    """
+    Import a module in a fresh interpreter.
+
+    Returns:
+        Imported module -> (self microseconds, cumulative microseconds, nesting depth)
+    """
+    env = {**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "benchmark")}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    timings = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            timings[match.group(4)] = (int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2)
+    return timings
+
+
+def slowest_imports(timings: Dict[str, Tuple[int, int, int]], limit: int, max_depth: int = 2) -> List[Tuple[str, int]]:
+    """Imports up to `max_depth` levels below the benchmarked module, by cumulative time."""
+    imports = [(name, cumulative) for name, (_, cumulative, depth) in timings.items() if 1 <= depth <= max_depth]
+    return sorted(imports, key=lambda item: item[1], reverse=True)[:limit]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Import-time benchmark of the RAG API")
+    env = os.environ.get
+    parser.add_argument("--module", default="src.api.app")
+    parser.add_argument("--runs", type=int, default=int(env("STARTUP_BENCHMARK_RUNS", "5")))
+    parser.add_argument("--max-ms", type=float, default=float(env("STARTUP_BUDGET_MS", "1000")))
+    parser.add_argument("--top", type=int, default=15)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    runs = [measure_imports(args.module) for _ in range(args.runs)]
+    totals_ms = [run[args.module][1] / 1000 for run in runs]
+    median_ms = statistics.median(totals_ms)
+    last = runs[-1]
+
+    print(f"import {args.module}: median {median_ms:.0f} ms over {args.runs} runs "
+          f"(min {min(totals_ms):.0f} ms, max {max(totals_ms):.0f} ms, budget {args.max_ms:.0f} ms)")
+    print("Slowest imports (cumulative, last run):")
+    for name, cumulative in slowest_imports(last, args.top):
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    failures = []
+    eager = sorted({name.split(".")[0] for name in last} & set(LAZY_PACKAGES))
+    if eager:
+        failures.append(f"imported at startup, should load lazily: {', '.join(eager)}")
+    if median_ms > args.max_ms:
+        failures.append(f"median import time {median_ms:.0f} ms exceeds the budget of {args.max_ms:.0f} ms")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,25 @@ echo "PORT: ${PORT:-8000}"
 # Set default port if not provided
 export PORT=${PORT:-8000}
 
+# Worker processes; they share the memory-mapped corpus snapshot, while metrics
+# and chat sessions need shared storage as soon as there is more than one.
+# The SQLite session store reads sessions through and locks turns across workers
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-1}
+if [ "$WEB_CONCURRENCY" -gt 1 ]; then
+    export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus-multiproc}
+    export SESSION_BACKEND=${SESSION_BACKEND:-sqlite}
+    if [ "$SESSION_BACKEND" != "sqlite" ]; then
+        echo "WARNING: SESSION_BACKEND=$SESSION_BACKEND keeps chat sessions per worker; use sqlite with several workers"
+    fi
+fi
+echo "Workers: $WEB_CONCURRENCY"
+
+# Prometheus multiprocess mode: samples of previous runs must not be merged into the new ones
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
 # Start the application
-python -m uvicorn src.api.app:app --host 0.0.0.0 --port $PORT --workers 1
+python -m uvicorn src.api.app:app --host 0.0.0.0 --port $PORT --workers $WEB_CONCURRENCY
 # Test comment
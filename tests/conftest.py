@@ -0,0 +1,10 @@
+"""Test configuration: point the data directories at a temporary directory before the API is imported."""
+import os
+import tempfile
+
+_data_dir = tempfile.mkdtemp(prefix="rag-api-tests-")
+os.environ.setdefault("EMBEDDINGS_DIR", os.path.join(_data_dir, "embeddings"))
+os.environ.setdefault("DOCUMENTS_DIR", os.path.join(_data_dir, "documents"))
+os.environ.setdefault("EMBEDDING_PROVIDER", "hashing")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("RECONCILE_ENABLED", "false")
@@ -0,0 +1,52 @@
+"""Tests for document embedding and the corpus manifest."""
+import asyncio
+from api.core.corpus_manifest import get_embedding_status, get_manifest, register_pending, remove_document
+from api.core.embeddings import create_document_embeddings
+
+
+def test_empty_document_leaves_pending():
+    register_pending("empty-scan", "empty-scan.pdf")
+    assert "empty-scan" in get_embedding_status()["missing"]
+
+    # A PDF whose pages have no extractable text
+    result = asyncio.run(create_document_embeddings("empty-scan", [(1, ""), (2, None)], {"filename": "empty-scan.pdf"}))
+
+    assert result["success"]
+    assert result["chunks"] == 0
+    status = get_embedding_status()
+    assert status["is_complete"]
+    assert get_manifest()["documents"]["empty-scan"]["chunks"] == 0
+
+
+def test_failed_batch_leaves_no_partial_index(monkeypatch):
+    from api.core import embeddings
+    from api.core.corpus_manifest import EMBEDDINGS_DIR
+
+    provider = embeddings.get_embedding_provider()
+    original_embed = provider.embed
+    calls = []
+
+    async def flaky_embed(texts, priority=None):
+        # The second batch still fails after the scheduler's retries
+        calls.append(len(texts))
+        if len(calls) == 2:
+            raise RuntimeError("rate limited")
+        return await original_embed(texts, priority=priority)
+
+    monkeypatch.setattr(provider, "embed", flaky_embed)
+    monkeypatch.setattr(provider, "batch_size", 1)
+    # One chunk per page, so each page is its own batch
+    monkeypatch.setattr(embeddings, "chunk_text", lambda text: [text])
+    register_pending("flaky-report", "flaky-report.txt")
+
+    pages = [(page, f"page {page} scope 2 emissions") for page in range(1, 4)]
+    try:
+        result = asyncio.run(create_document_embeddings("flaky-report", pages, {"filename": "flaky-report.txt"}))
+
+        assert not result["success"]
+        assert len(calls) == 3
+        assert "flaky-report" in get_manifest()["pending"]
+        assert "flaky-report" not in get_manifest()["documents"]
+        assert not list(EMBEDDINGS_DIR.glob("flaky-report*"))
+    finally:
+        remove_document("flaky-report")
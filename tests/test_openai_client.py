@@ -0,0 +1,58 @@
+"""Tests for the shared OpenAI client's concurrency budget."""
+import asyncio
+from api.core.openai_client import PrioritySlots, PRIORITY_INTERACTIVE, PRIORITY_BULK
+
+
+def test_bulk_requests_leave_reserved_slots_free():
+    async def scenario():
+        slots = PrioritySlots(limit=4, reserved=1)
+        for _ in range(3):
+            await slots.acquire(PRIORITY_BULK)
+        # The fourth bulk request waits, an interactive one gets the reserved slot at once
+        bulk = asyncio.create_task(slots.acquire(PRIORITY_BULK))
+        await asyncio.wait_for(slots.acquire(PRIORITY_INTERACTIVE), timeout=1)
+        await asyncio.sleep(0)
+        return bulk.done(), slots.in_use
+
+    bulk_done, in_use = asyncio.run(scenario())
+    assert not bulk_done
+    assert in_use == 4
+
+
+def test_released_slots_go_to_interactive_waiters_first():
+    async def scenario():
+        slots = PrioritySlots(limit=1)
+        await slots.acquire(PRIORITY_BULK)
+        order = []
+
+        async def request(name, priority):
+            await slots.acquire(priority)
+            order.append(name)
+            slots.release()
+
+        waiters = [asyncio.create_task(request("bulk", PRIORITY_BULK))]
+        await asyncio.sleep(0)
+        waiters.append(asyncio.create_task(request("interactive", PRIORITY_INTERACTIVE)))
+        await asyncio.sleep(0)
+        slots.release()
+        await asyncio.gather(*waiters)
+        return order, slots.in_use
+
+    order, in_use = asyncio.run(scenario())
+    assert order == ["interactive", "bulk"]
+    assert in_use == 0
+
+
+def test_cancelled_waiter_does_not_hold_a_slot():
+    async def scenario():
+        slots = PrioritySlots(limit=1)
+        await slots.acquire()
+        waiter = asyncio.create_task(slots.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        slots.release()
+        await asyncio.wait_for(slots.acquire(), timeout=1)
+        return slots.in_use
+
+    assert asyncio.run(scenario()) == 1
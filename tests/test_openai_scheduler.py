@@ -0,0 +1,25 @@
+"""Tests for the OpenAI request scheduler."""
+import asyncio
+from types import SimpleNamespace
+from api.core import openai_scheduler
+from api.core.openai_scheduler import EmbeddingBatcher
+
+
+def test_partial_embedding_response_fails_missing_inputs(monkeypatch):
+    async def run_scheduled(purpose, tokens, priority, call):
+        # Only the first input comes back
+        return SimpleNamespace(data=[SimpleNamespace(index=0, embedding=[1.0])], usage=None)
+
+    monkeypatch.setattr(openai_scheduler, "run_scheduled", run_scheduled)
+    monkeypatch.setattr(openai_scheduler, "get_openai_client", lambda: SimpleNamespace(with_options=lambda **_: None))
+    monkeypatch.setattr(openai_scheduler, "count_tokens", len)
+
+    async def embed_both():
+        batcher = EmbeddingBatcher()
+        return await asyncio.wait_for(asyncio.gather(
+            batcher.embed("first", "model"), batcher.embed("second", "model"), return_exceptions=True
+        ), timeout=5)
+
+    first, second = asyncio.run(embed_both())
+    assert first == [1.0]
+    assert isinstance(second, RuntimeError)
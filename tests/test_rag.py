@@ -0,0 +1,44 @@
+"""Tests for merging retrieval results."""
+import os
+import subprocess
+import sys
+from pathlib import Path
+from api.core.rag import merge_seeds, rank_key
+
+
+def test_followup_seeds_are_fused_with_hybrid_results():
+    seeds = [
+        {"chunk_id": "a", "text": "a", "score": 0.4, "similarity": 0.9},
+        {"chunk_id": "b", "text": "b", "score": 0.8, "similarity": 0.6},
+    ]
+    results = [
+        {"chunk_id": "c", "text": "c", "score": 0.5, "fusion_score": 0.0325},
+        {"chunk_id": "b", "text": "b", "score": 0.8, "fusion_score": 0.0320},
+    ]
+
+    merged = sorted(merge_seeds(seeds, results), key=rank_key)
+
+    # "b" was found by the search and is a seed, "a" only is a seed
+    assert [chunk["chunk_id"] for chunk in merged] == ["b", "c", "a"]
+    assert all("fusion_score" in chunk for chunk in merged)
+
+
+def test_followup_seeds_keep_l2_scores_with_vector_results():
+    seeds = [{"chunk_id": "a", "text": "a", "score": 0.2, "similarity": 0.9}]
+    results = [{"chunk_id": "c", "text": "c", "score": 0.5}]
+
+    merged = sorted(merge_seeds(seeds, results), key=rank_key)
+
+    assert [chunk["chunk_id"] for chunk in merged] == ["a", "c"]
+
+
+def test_app_imports_without_openai_key_for_local_embeddings(tmp_path):
+    # A fresh interpreter: the modules under test are already imported here
+    env = {key: value for key, value in os.environ.items() if key != "OPENAI_API_KEY"}
+    env["EMBEDDING_PROVIDER"] = "hashing"
+    env["PYTHONPATH"] = str(Path(__file__).parent.parent / "src")
+    result = subprocess.run(
+        [sys.executable, "-c", "import api.app, api.core.rag, api.core.link_detector"],
+        cwd=tmp_path, env=env, capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
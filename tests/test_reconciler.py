@@ -0,0 +1,72 @@
+"""Tests for the background reconciler running next to uploads."""
+import asyncio
+import httpx
+from api.app import app
+from api.core import reconciler as reconciler_module
+from api.core.corpus_manifest import get_manifest, ingestion_claim, record_document, register_pending
+from api.core.reconciler import EmbeddingReconciler
+from api.routers import documents
+
+
+def test_claims_are_exclusive_until_released():
+    with ingestion_claim("claimed-doc") as first:
+        with ingestion_claim("claimed-doc") as second:
+            assert first and not second
+    with ingestion_claim("claimed-doc") as again:
+        assert again
+
+
+def test_reconciler_does_not_embed_a_document_the_upload_is_embedding(monkeypatch):
+    repairs = []
+    embedding_started = asyncio.Event()
+
+    async def slow_embedding(document_id, content, metadata=None):
+        # The document is pending while the upload embeds it
+        embedding_started.set()
+        await asyncio.sleep(0.2)
+        await asyncio.to_thread(record_document, document_id, {"chunks": 1, "filename": metadata["filename"]})
+        return {"success": True, "document_id": document_id}
+
+    async def repair(document_id, filename=None):
+        repairs.append(document_id)
+        return {"success": True}
+
+    monkeypatch.setattr(documents, "create_document_embeddings", slow_embedding)
+    monkeypatch.setattr(reconciler_module, "repair_document", repair)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            upload = asyncio.create_task(
+                client.post("/documents/upload", files={"file": ("report.txt", b"scope 1 emissions", "text/plain")})
+            )
+            await embedding_started.wait()
+            document_id = next(iter(get_manifest()["pending"]))
+            during = await EmbeddingReconciler().reconcile(force=True)
+            response = await upload
+            after = await EmbeddingReconciler().reconcile(force=True)
+        return document_id, during, response, after
+
+    document_id, during, response, after = asyncio.run(scenario())
+    assert response.json()["document_id"] == document_id
+    assert document_id in during["skipped_documents"]
+    assert document_id not in get_manifest()["pending"]
+    assert after["failed_documents"] == []
+    assert repairs == []
+
+
+def test_reconciler_repairs_a_pending_document_nobody_embeds(monkeypatch):
+    repairs = []
+
+    async def repair(document_id, filename=None):
+        repairs.append(document_id)
+        await asyncio.to_thread(record_document, document_id, {"chunks": 1, "filename": filename})
+        return {"success": True}
+
+    monkeypatch.setattr(reconciler_module, "repair_document", repair)
+    register_pending("orphan", "orphan.txt")
+
+    result = asyncio.run(EmbeddingReconciler().reconcile(force=True))
+
+    assert repairs == ["orphan"]
+    assert result["failed_documents"] == []
@@ -0,0 +1,103 @@
+"""Tests for chat sessions shared by several workers through SQLite."""
+import asyncio
+import httpx
+from api.app import app
+from api.core.session_store import SessionStore
+from api.routers import chat
+
+
+def append(content):
+    def add_message(session):
+        session.messages = session.messages + [{"role": "user", "content": content}]
+        return True
+    return add_message
+
+
+def test_stores_on_one_database_see_each_others_turns(tmp_path):
+    db_path = tmp_path / "sessions.sqlite3"
+    worker_a, worker_b = SessionStore(db_path=db_path), SessionStore(db_path=db_path)
+
+    async def scenario():
+        session = worker_a.new("s1")
+        session.messages = [{"role": "user", "content": "first"}]
+        await worker_a.save(session)
+        # Cached by worker B from here on
+        assert len((await worker_b.get("s1")).messages) == 1
+
+        await worker_a.update("s1", append("second"))
+        newer = await worker_b.get("s1")
+
+        await worker_a.delete("s1")
+        deleted = await worker_b.get("s1")
+        return newer, deleted
+
+    newer, deleted = asyncio.run(scenario())
+    assert [message["content"] for message in newer.messages] == ["first", "second"]
+    assert deleted is None
+
+
+def test_update_is_applied_again_after_a_concurrent_save(tmp_path, monkeypatch):
+    db_path = tmp_path / "sessions.sqlite3"
+    worker_a, worker_b = SessionStore(db_path=db_path), SessionStore(db_path=db_path)
+    read = worker_a.get
+    interleaved = []
+
+    async def read_then_concurrent_turn(session_id):
+        session = await read(session_id)
+        if not interleaved:
+            # Worker B saves a turn after worker A has read the session
+            interleaved.append(await worker_b.update(session_id, append("turn b")))
+        return session
+
+    async def scenario():
+        await worker_a.update("s1", append("first"))
+        monkeypatch.setattr(worker_a, "get", read_then_concurrent_turn)
+        await worker_a.update("s1", append("turn a"))
+        return await SessionStore(db_path=db_path).get("s1")
+
+    session = asyncio.run(scenario())
+    assert [message["content"] for message in session.messages] == ["first", "turn b", "turn a"]
+
+
+def test_update_without_create_leaves_deleted_sessions_deleted(tmp_path):
+    store = SessionStore(db_path=tmp_path / "sessions.sqlite3")
+
+    async def scenario():
+        await store.update("s1", append("first"))
+        await store.delete("s1")
+        return await store.update("s1", append("late summary"), create=False), await store.get("s1")
+
+    assert asyncio.run(scenario()) == (None, None)
+
+
+def test_chat_turns_do_not_wait_for_answers_in_progress(tmp_path, monkeypatch):
+    store = SessionStore(db_path=tmp_path / "sessions.sqlite3")
+    monkeypatch.setattr(chat, "session_store", store)
+    release = asyncio.Event()
+
+    async def generate_answer(query, **kwargs):
+        if query == "slow":
+            await release.wait()
+        return {"success": True, "answer": f"re: {query}", "chunks": [], "expanded_queries": []}
+
+    monkeypatch.setattr(chat, "generate_answer", generate_answer)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            async def turn(message, session_id):
+                return await client.post("/chat/process", json={"message": message, "session_id": session_id})
+
+            slow = asyncio.create_task(turn("slow", "s1"))
+            await asyncio.sleep(0.1)
+            # Neither another session nor another turn of the same session waits for the slow answer
+            await asyncio.wait_for(turn("other session", "s2"), timeout=2)
+            await asyncio.wait_for(turn("same session", "s1"), timeout=2)
+            release.set()
+            await slow
+        return await store.get("s1")
+
+    session = asyncio.run(scenario())
+    assert [message["content"] for message in session.messages] == [
+        "same session", "re: same session", "slow", "re: slow"
+    ]
@@ -0,0 +1,70 @@
+"""Tests for the corpus-wide vector store."""
+import asyncio
+import numpy as np
+import faiss
+import pytest
+from api.core import embeddings
+from api.core.corpus_manifest import EMBEDDINGS_DIR, get_manifest, record_document, remove_document
+from api.core.embedding_providers import get_embedding_provider
+from api.core.vector_store import (
+    CorpusIndex, COARSE_DIMENSIONS, load_corpus_index, rows_to_bitmap, truncate_embeddings
+)
+
+
+def make_corpus(size: int, dimension: int = COARSE_DIMENSIONS * 2) -> CorpusIndex:
+    vectors = np.random.default_rng(0).random((size, dimension), dtype=np.float32)
+    full_index = faiss.IndexFlatL2(dimension)
+    full_index.add(vectors)
+    coarse_index = faiss.IndexFlatL2(COARSE_DIMENSIONS)
+    coarse_index.add(truncate_embeddings(vectors))
+    return CorpusIndex(
+        version=1,
+        full_index=full_index,
+        coarse_index=coarse_index,
+        chunks=[{"chunk_id": f"c{row}", "document_id": "d"} for row in range(size)],
+        documents={},
+        onace_partitions={},
+        attributes=None,
+        lexical_index=None
+    )
+
+
+@pytest.mark.parametrize("two_stage", [False, True])
+def test_bitmap_restricts_search_to_selected_rows(two_stage):
+    # 1003 rows: the last bitmap byte is only partly used
+    corpus = make_corpus(1003)
+    selected = np.array([0, 7, 8, 500, 1001, 1002])
+    query = corpus.full_index.reconstruct(1002).reshape(1, -1)
+
+    matches = corpus.search(query, top_k=10, bitmap=rows_to_bitmap(corpus.size, selected), two_stage=two_stage)
+
+    assert sorted(row for row, _ in matches) == sorted(selected.tolist())
+    assert matches[0][0] == 1002
+
+
+def test_empty_bitmap_returns_nothing():
+    corpus = make_corpus(20)
+    query = corpus.full_index.reconstruct(0).reshape(1, -1)
+
+    assert corpus.search(query, top_k=5, bitmap=rows_to_bitmap(corpus.size, np.array([], dtype=np.int64))) == []
+
+
+def test_documents_of_another_embedding_model_are_requeued(monkeypatch):
+    monkeypatch.setattr(embeddings, "chunk_text", lambda text: [text])
+    model = get_embedding_provider().model
+    for document_id in ("current-model", "previous-model"):
+        metadata = {"filename": f"{document_id}.txt"}
+        asyncio.run(embeddings.create_document_embeddings(document_id, "scope 3 emissions", metadata))
+    entry = get_manifest()["documents"]["previous-model"]
+    record_document("previous-model", {**entry, "embedding_model": "text-embedding-3-small"})
+
+    try:
+        corpus = load_corpus_index(EMBEDDINGS_DIR, model)
+
+        assert "current-model" in corpus.documents
+        assert "previous-model" not in corpus.documents
+        assert get_manifest()["pending"]["previous-model"] == "previous-model.txt"
+        assert corpus.version == get_manifest()["version"]
+    finally:
+        for document_id in ("current-model", "previous-model"):
+            remove_document(document_id, files=list(EMBEDDINGS_DIR.glob(f"{document_id}.*")))